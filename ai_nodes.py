@@ -1,19 +1,58 @@
 # ai_nodes.py
+import asyncio
+import contextvars
 import json
+import math
 import os
-from typing import Dict, Any, Optional
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date
+from typing import Dict, Any, AsyncIterator, Iterator, List, Optional, Tuple, Type
 
 from dotenv import load_dotenv
+from langchain_core.messages import BaseMessage, HumanMessage
+from langchain_core.runnables import Runnable
 from langchain_openai import ChatOpenAI
-from pydantic import ValidationError
-
+from pydantic import BaseModel, ValidationError
+
+from category_guidance import render_guidance
+from coach_context import (
+    COACH_SUMMARY_MAX_TOKENS,
+    extractive_summary,
+    format_messages,
+    pending_fold,
+    render_coach_messages,
+    truncate_tokens,
+)
+from deadlines import deadline_for
+from habit_canonicalizer import local_canonical
+from health import CRITICAL, node_status, record_backfill
+from instrumentation import instrumented, llm_node, mark_cache_hit, mark_fallback, mark_local
+from llm_clients import get_chat_model, get_structured_model
+from metrics import counter
+from plan_templates import template_plan21
+from quiz_cache import get_quiz_form_cache
+from retry_policy import (
+    PARSE,
+    RATE_LIMIT,
+    Attempt,
+    acall_with_retry,
+    call_with_retry,
+    classify,
+    retry_delay,
+)
+from response_cache import lookup, store, template_id
+from safety_prefilter import prefilter
 from prompts import (
     SAFETY_PROMPT,
-    QUIZ_SUMMARY_PROMPT,
-    PLAN_21D_PROMPT,
-    COACH_PROMPT,
     QUIZ_GENERATOR_PROMPT,
-    CANONICALIZE_PROMPT
+    CANONICALIZE_PROMPT,
+    SAFETY_MESSAGES,
+    QUIZ_SUMMARY_MESSAGES,
+    PLAN_21D_MESSAGES,
+    QUIZ_GENERATOR_MESSAGES,
+    CANONICALIZE_MESSAGES,
+    CHAT_SUMMARY_MESSAGES,
 )
 from schemas import HabitState, SafetyResult, QuizSummary, Plan21D,QuizForm
 
@@ -21,66 +60,107 @@ load_dotenv()
 
 MODEL_JSON = os.getenv("OPENAI_MODEL_JSON", "gpt-4.1")
 MODEL_TEXT = os.getenv("OPENAI_MODEL_TEXT", "gpt-4.1")
+# The quiz nodes historically defaulted to the mini model when the env var is unset.
+MODEL_QUIZ = os.getenv("OPENAI_MODEL_JSON", "gpt-4.1-mini")
+
+# Response-cache namespaces; ids change whenever the prompt text changes.
+SAFETY_TEMPLATE_ID = template_id("safety", SAFETY_PROMPT)
+CANONICALIZE_TEMPLATE_ID = template_id("canonicalize", CANONICALIZE_PROMPT)
+QUIZ_FORM_TEMPLATE_ID = template_id("quiz_form", QUIZ_GENERATOR_PROMPT)
+
+
+_JSON_REPAIR_HINT = (
+    "\nReturn STRICT JSON. No commentary. "
+    "Do NOT repeat previous suggestions."
+)
+
+
+def _json_attempt(
+    prompt: List[BaseMessage],
+    max_tokens: int,
+    temperature: float,
+    attempt: Attempt,
+) -> Tuple[Runnable, List[BaseMessage]]:
+    """
+    Model (capped at `max_tokens` completion tokens) and messages for one JSON
+    attempt. After a parse failure: a little more randomness and a stricter
+    instruction (the caller's messages are not modified). The instruction goes
+    at the end so the cached system prefix still matches.
+    """
+    if attempt.last_error == PARSE:
+        temperature += 0.2
+        prompt = prompt[:-1] + [HumanMessage(content=prompt[-1].content + _JSON_REPAIR_HINT)]
+    llm = get_chat_model(MODEL_JSON, temperature, response_format={"type": "json_object"})
+    return llm.bind(max_tokens=max_tokens), prompt
+
+
 def _llm_json(
-    prompt: str,
+    prompt: List[BaseMessage],
     max_tokens: int = 800,
     temperature: float = 0.5,
-    retries: int = 2,
+    node: str = "json",
 ) -> Dict[str, Any]:
     """
     Call the JSON-optimized LLM and return a Python dict.
-    Retries with slightly higher temperature and stronger JSON instructions if parsing fails.
+    Failures (transient or unparseable JSON) are retried under `node`'s retry
+    policy; returns {} once that gives up.
     """
-    for attempt in range(retries):
-        llm = ChatOpenAI(
-            model=MODEL_JSON,
-            temperature=temperature + (attempt * 0.2),
-            response_format={"type": "json_object"},
-        )
+    def call(attempt: Attempt) -> Dict[str, Any]:
+        llm, attempt_prompt = _json_attempt(prompt, max_tokens, temperature, attempt)
+        return json.loads(llm.invoke(attempt_prompt, timeout=attempt.timeout).content)
 
-        resp = llm.invoke(prompt).content
+    try:
+        return call_with_retry(node, call)
+    except Exception:
+        return {}
 
-        try:
-            return json.loads(resp)
-        except Exception:
-            # strengthen instructions & increase randomness
-            prompt += (
-                "\nReturn STRICT JSON. No commentary. "
-                "Do NOT repeat previous suggestions."
-            )
-            continue
 
-    # final fallback if everything fails
-    return {}
+async def _allm_json(
+    prompt: List[BaseMessage],
+    max_tokens: int = 800,
+    temperature: float = 0.5,
+    node: str = "json",
+) -> Dict[str, Any]:
+    """
+    Async twin of `_llm_json`.
+    """
+    async def call(attempt: Attempt) -> Dict[str, Any]:
+        llm, attempt_prompt = _json_attempt(prompt, max_tokens, temperature, attempt)
+        return json.loads((await llm.ainvoke(attempt_prompt, timeout=attempt.timeout)).content)
+
+    try:
+        return await acall_with_retry(node, call)
+    except Exception:
+        return {}
 
 
 def _json_llm(temperature: float = 0.3) -> ChatOpenAI:
     """
     Base JSON-optimized LLM (used with structured outputs).
     """
-    return ChatOpenAI(
-        model=MODEL_JSON,
-        temperature=temperature,
-    )
+    return get_chat_model(MODEL_JSON, temperature)
 
 
-def _text_llm(temperature: float = 0.6) -> ChatOpenAI:
+def _structured_llm(
+    schema: Type[BaseModel],
+    temperature: float = 0.3,
+    model: str = MODEL_JSON,
+) -> Runnable:
     """
-    Base text LLM for the coach.
+    Pooled `with_structured_output(schema)` runnable from the client registry.
     """
-    return ChatOpenAI(
-        model=MODEL_TEXT,
-        temperature=temperature,
-    )
+    return get_structured_model(model, temperature, schema)
 
 
+def _text_llm(temperature: float = 0.6) -> ChatOpenAI:
+    """
+    Base text LLM for the coach.
+    """
+    return get_chat_model(MODEL_TEXT, temperature)
 
-def canonicalize_habit_node(state: HabitState):
-    user_raw = state.habit_description or ""
 
-    prompt = CANONICALIZE_PROMPT.format(user_habit_raw=user_raw)
-    data = _llm_json(prompt)
 
+def _canonical_result(data: Dict[str, Any], user_raw: str) -> Dict[str, Any]:
     # Fallback if model fails
     canonical = data.get("canonical_habit_name", user_raw)
     category = data.get("habit_category", "unknown")
@@ -93,8 +173,115 @@ def canonicalize_habit_node(state: HabitState):
     }
 
 
+@instrumented("canonicalize")
+def canonicalize_habit_node(state: HabitState):
+    user_raw = state.habit_description or ""
+
+    # Known slang (exact or a typo away) is resolved locally; the rest goes to the LLM.
+    data = local_canonical(user_raw)
+    if data is not None:
+        mark_local()
+        return _canonical_result(data, user_raw)
+
+    key, data = lookup(CANONICALIZE_TEMPLATE_ID, MODEL_JSON, 0.5, user_raw)
+    if data is None:
+        prompt = CANONICALIZE_MESSAGES.format_messages(user_habit_raw=user_raw)
+        data = _llm_json(prompt, node="canonicalize")
+        if data:
+            store(key, data)
+        else:
+            mark_fallback("empty_response")
+    else:
+        mark_cache_hit()
+
+    return _canonical_result(data, user_raw)
+
+
+@instrumented("canonicalize")
+async def acanonicalize_habit_node(state: HabitState):
+    user_raw = state.habit_description or ""
+
+    data = local_canonical(user_raw)
+    if data is not None:
+        mark_local()
+        return _canonical_result(data, user_raw)
+
+    key, data = lookup(CANONICALIZE_TEMPLATE_ID, MODEL_JSON, 0.5, user_raw)
+    if data is None:
+        prompt = CANONICALIZE_MESSAGES.format_messages(user_habit_raw=user_raw)
+        data = await _allm_json(prompt, node="canonicalize")
+        if data:
+            store(key, data)
+        else:
+            mark_fallback("empty_response")
+    else:
+        mark_cache_hit()
+
+    return _canonical_result(data, user_raw)
+
+
 # ---------- Safety Node ----------
 
+def _safety_user_text(state: HabitState) -> str:
+    # Prefer the freshest user message; fall back to habit_description or empty string
+    return (
+        getattr(state, "last_user_message", None)
+        or getattr(state, "habit_description", None)
+        or getattr(state, "user_input", "")
+        or ""
+    )
+
+
+def _safety_fallback() -> SafetyResult:
+    # Be conservative if safety fails: block & escalate instead of silently allowing
+    return SafetyResult(
+        risk="other",
+        action="block_and_escalate",
+        message=(
+            "I’m here only for habit and behavior coaching, so I can’t safely respond to this. "
+            "Please avoid medical, illegal, or harmful topics, and consider reaching out to a "
+            "trusted person or local professional if you’re in distress."
+        ),
+    )
+
+
+def _classify_safety(user_text: str) -> Tuple[SafetyResult, bool]:
+    """
+    Cached LLM classification of `user_text`; returns (safety, cache_hit).
+    Failures give the conservative `_safety_fallback()`.
+    """
+    key, safety = lookup(SAFETY_TEMPLATE_ID, MODEL_JSON, 0.1, user_text, SafetyResult)
+    if safety is not None:
+        return safety, True
+
+    prompt = SAFETY_MESSAGES.format_messages(user_text=user_text)
+    structured_llm = _structured_llm(SafetyResult, temperature=0.1)
+    try:
+        safety = call_with_retry("safety", lambda a: structured_llm.invoke(prompt, timeout=a.timeout))
+        store(key, safety)
+    except Exception as exc:
+        safety = _safety_fallback()
+        mark_fallback(classify(exc), node="safety")
+    return safety, False
+
+
+async def _aclassify_safety(user_text: str) -> Tuple[SafetyResult, bool]:
+    key, safety = lookup(SAFETY_TEMPLATE_ID, MODEL_JSON, 0.1, user_text, SafetyResult)
+    if safety is not None:
+        return safety, True
+
+    prompt = SAFETY_MESSAGES.format_messages(user_text=user_text)
+    structured_llm = _structured_llm(SafetyResult, temperature=0.1)
+    try:
+        safety = await acall_with_retry("safety", lambda a: structured_llm.ainvoke(prompt, timeout=a.timeout))
+        store(key, safety)
+    except Exception as exc:
+        safety = _safety_fallback()
+        mark_fallback(classify(exc), node="safety")
+    return safety, False
+
+
+@instrumented("safety")
 def safety_node(state: HabitState) -> Dict[str, Any]:
     """
     Classify the latest user text for safety and scope.
@@ -104,38 +291,95 @@ def safety_node(state: HabitState) -> Dict[str, Any]:
     - action: "allow" | "block_and_escalate"
     - message: short, safe helper text
     """
+    user_text = _safety_user_text(state)
 
-    # Prefer the freshest user message; fall back to habit_description or empty string
-    user_text = (
-        getattr(state, "last_user_message", None)
-        or getattr(state, "habit_description", None)
-        or getattr(state, "user_input", "")
-        or ""
-    )
+    # Clear-cut text (everyday habit, or an obvious high-risk phrase) never reaches the model.
+    safety = prefilter(user_text)
+    if safety is not None:
+        mark_local()
+        return {"safety": safety}
 
-    prompt = SAFETY_PROMPT.format(user_text=user_text)
+    safety, cache_hit = _classify_safety(user_text)
+    if cache_hit:
+        mark_cache_hit()
+    return {"safety": safety}
 
-    llm = _json_llm(temperature=0.1)
-    structured_llm = llm.with_structured_output(SafetyResult)
 
-    try:
-        safety = structured_llm.invoke(prompt)
-    except Exception:
-        # Be conservative if safety fails: block & escalate instead of silently allowing
-        safety = SafetyResult(
-            risk="other",
-            action="block_and_escalate",
-            message=(
-                "I’m here only for habit and behavior coaching, so I can’t safely respond to this. "
-                "Please avoid medical, illegal, or harmful topics, and consider reaching out to a "
-                "trusted person or local professional if you’re in distress."
-            ),
-        )
+@instrumented("safety")
+async def asafety_node(state: HabitState) -> Dict[str, Any]:
+    """
+    Async `safety_node`.
+    """
+    user_text = _safety_user_text(state)
+
+    safety = prefilter(user_text)
+    if safety is not None:
+        mark_local()
+        return {"safety": safety}
 
+    safety, cache_hit = await _aclassify_safety(user_text)
+    if cache_hit:
+        mark_cache_hit()
     return {"safety": safety}
 
 
 
+def _quiz_form_fallback(habit_description: str) -> QuizForm:
+    # Fallback that is STILL tied to the described habit
+    habit_label = habit_description or "this habit"
+    return QuizForm(
+        habit_name_guess=habit_label,
+        questions=[
+            {
+                "id": "q1",
+                "question": f"In your own words, what does {habit_label} look like for you?",
+                "helper_text": "Describe what you do, what you use, and how it usually happens.",
+            },
+            {
+                "id": "q2",
+                "question": f"How often do you usually do {habit_label} in a day or week?",
+                "helper_text": None,
+            },
+            {
+                "id": "q3",
+                "question": f"At what times of day does {habit_label} usually happen?",
+                "helper_text": "For example: late night, after work, during breaks, etc.",
+            },
+            {
+                "id": "q4",
+                "question": f"Where are you most often when {habit_label} happens?",
+                "helper_text": "Bedroom, bathroom, desk, outside, with friends, etc.",
+            },
+            {
+                "id": "q5",
+                "question": f"What are you usually feeling right before {habit_label}?",
+                "helper_text": "Bored, stressed, lonely, tired, anxious, excited, etc.",
+            },
+            {
+                "id": "q6",
+                "question": f"What tends to trigger {habit_label} most often?",
+                "helper_text": "People, places, apps, notifications, objects, situations, etc.",
+            },
+            {
+                "id": "q7",
+                "question": f"Have you tried changing {habit_label} before? What worked or failed?",
+                "helper_text": None,
+            },
+            {
+                "id": "q8",
+                "question": f"Why do you want to reduce or change {habit_label} now?",
+                "helper_text": "What matters most to you here?",
+            },
+            {
+                "id": "q9",
+                "question": f"In which situations is {habit_label} hardest to control?",
+                "helper_text": "Specific times, people, places, or moods.",
+            },
+        ],
+    )
+
+
+@instrumented("quiz_form")
 def quiz_form_node(state: HabitState) -> Dict[str, Any]:
     """
     Generate a tailored 8–10 question quiz based on the user's habit description.
@@ -146,331 +390,164 @@ def quiz_form_node(state: HabitState) -> Dict[str, Any]:
     """
     habit_description = state.habit_description or ""
 
-    prompt = QUIZ_GENERATOR_PROMPT.format(
-        habit_description=habit_description
-    )
+    key, quiz_form = lookup(QUIZ_FORM_TEMPLATE_ID, MODEL_QUIZ, 0.4, habit_description, QuizForm)
+    similar_cache = get_quiz_form_cache()
+    if quiz_form is None and similar_cache is not None:
+        quiz_form = similar_cache.get(habit_description)
 
-    llm = ChatOpenAI(
-        model=os.getenv("OPENAI_MODEL_JSON", "gpt-4.1-mini"),
-        temperature=0.4,
-    )
-    structured_llm = llm.with_structured_output(QuizForm)
+    if quiz_form is not None:
+        mark_cache_hit()
+    else:
+        prompt = QUIZ_GENERATOR_MESSAGES.format_messages(habit_description=habit_description)
+        structured_llm = _structured_llm(QuizForm, temperature=0.4, model=MODEL_QUIZ)
 
-    try:
-        quiz_form = structured_llm.invoke(prompt)
-    except Exception:
-        # Fallback that is STILL tied to the described habit
-        habit_label = habit_description or "this habit"
-        quiz_form = QuizForm(
-            habit_name_guess=habit_label,
-            questions=[
-                {
-                    "id": "q1",
-                    "question": f"In your own words, what does {habit_label} look like for you?",
-                    "helper_text": "Describe what you do, what you use, and how it usually happens.",
-                },
-                {
-                    "id": "q2",
-                    "question": f"How often do you usually do {habit_label} in a day or week?",
-                    "helper_text": None,
-                },
-                {
-                    "id": "q3",
-                    "question": f"At what times of day does {habit_label} usually happen?",
-                    "helper_text": "For example: late night, after work, during breaks, etc.",
-                },
-                {
-                    "id": "q4",
-                    "question": f"Where are you most often when {habit_label} happens?",
-                    "helper_text": "Bedroom, bathroom, desk, outside, with friends, etc.",
-                },
-                {
-                    "id": "q5",
-                    "question": f"What are you usually feeling right before {habit_label}?",
-                    "helper_text": "Bored, stressed, lonely, tired, anxious, excited, etc.",
-                },
-                {
-                    "id": "q6",
-                    "question": f"What tends to trigger {habit_label} most often?",
-                    "helper_text": "People, places, apps, notifications, objects, situations, etc.",
-                },
-                {
-                    "id": "q7",
-                    "question": f"Have you tried changing {habit_label} before? What worked or failed?",
-                    "helper_text": None,
-                },
-                {
-                    "id": "q8",
-                    "question": f"Why do you want to reduce or change {habit_label} now?",
-                    "helper_text": "What matters most to you here?",
-                },
-                {
-                    "id": "q9",
-                    "question": f"In which situations is {habit_label} hardest to control?",
-                    "helper_text": "Specific times, people, places, or moods.",
-                },
-            ],
-        )
+        try:
+            quiz_form = call_with_retry("quiz_form", lambda a: structured_llm.invoke(prompt, timeout=a.timeout))
+            store(key, quiz_form)
+            if similar_cache is not None:
+                similar_cache.put(habit_description, quiz_form)
+        except Exception as exc:
+            quiz_form = _quiz_form_fallback(habit_description)
+            mark_fallback(classify(exc))
 
     return {"quiz_form": quiz_form}
 
-# ---------- Quiz Summary Node ----------
 
-def quiz_summary_node(state: HabitState) -> Dict[str, Any]:
+@instrumented("quiz_form")
+async def aquiz_form_node(state: HabitState) -> Dict[str, Any]:
     """
-    Convert:
-    - original habit_description
-    - AI-generated quiz_form
-    - user_quiz_answers
-
-    into a compact QuizSummary JSON.
+    Async `quiz_form_node`.
     """
     habit_description = state.habit_description or ""
+
+    key, quiz_form = lookup(QUIZ_FORM_TEMPLATE_ID, MODEL_QUIZ, 0.4, habit_description, QuizForm)
+    similar_cache = get_quiz_form_cache()
+    if quiz_form is None and similar_cache is not None:
+        quiz_form = similar_cache.get(habit_description)
+
+    if quiz_form is not None:
+        mark_cache_hit()
+    else:
+        prompt = QUIZ_GENERATOR_MESSAGES.format_messages(habit_description=habit_description)
+        structured_llm = _structured_llm(QuizForm, temperature=0.4, model=MODEL_QUIZ)
+
+        try:
+            quiz_form = await acall_with_retry("quiz_form", lambda a: structured_llm.ainvoke(prompt, timeout=a.timeout))
+            store(key, quiz_form)
+            if similar_cache is not None:
+                similar_cache.put(habit_description, quiz_form)
+        except Exception as exc:
+            quiz_form = _quiz_form_fallback(habit_description)
+            mark_fallback(classify(exc))
+
+    return {"quiz_form": quiz_form}
+
+# ---------- Quiz Summary Node ----------
+
+def _quiz_summary_prompt(state: HabitState) -> List[BaseMessage]:
+    habit_description = state.habit_description or ""
     quiz_form_json = state.quiz_form.model_dump() if state.quiz_form else {}
     user_quiz_answers = state.user_quiz_answers or ""
 
     # THIS is where the error was: we MUST pass quiz_form_json
-    prompt = QUIZ_SUMMARY_PROMPT.format(
+    return QUIZ_SUMMARY_MESSAGES.format_messages(
         habit_description=habit_description,
         quiz_form_json=json.dumps(quiz_form_json, ensure_ascii=False),
         user_quiz_answers=user_quiz_answers,
     )
 
-    llm = ChatOpenAI(
-        model=os.getenv("OPENAI_MODEL_JSON", "gpt-4.1-mini"),
-        temperature=0.3,
+
+def _quiz_summary_fallback(habit_description: str) -> QuizSummary:
+    # Defensive fallback – still honest, no hallucinated structure. The name
+    # and category come from the local canonicalizer when it is sure; the
+    # placeholders below are plan_templates.MISSING_VALUES.
+    local = local_canonical(habit_description) if habit_description else None
+    return QuizSummary(
+        user_habit_raw=habit_description,
+        canonical_habit_name=local["canonical_habit_name"] if local else "user habit",
+        habit_category=local["habit_category"] if local else "other",
+        category_confidence="low",
+        product_type="unspecified",
+        severity_level="mild",
+        main_trigger="unknown",
+        peak_times="unknown",
+        common_locations="unknown",
+        emotional_patterns="unclear",
+        frequency_pattern="unknown",
+        previous_attempts="not_clear",
+        motivation_reason="user_wants_change",
+        risk_situations="unknown",
     )
-    structured_llm = llm.with_structured_output(QuizSummary)
+
+
+@instrumented("quiz_summary")
+def quiz_summary_node(state: HabitState) -> Dict[str, Any]:
+    """
+    Convert:
+    - original habit_description
+    - AI-generated quiz_form
+    - user_quiz_answers
+
+    into a compact QuizSummary JSON.
+    """
+    prompt = _quiz_summary_prompt(state)
+
+    structured_llm = _structured_llm(QuizSummary, temperature=0.3, model=MODEL_QUIZ)
 
     try:
-        summary = structured_llm.invoke(prompt)
-    except (ValidationError, Exception):
-        # Defensive fallback – still honest, no hallucinated structure
-        summary = QuizSummary(
-            user_habit_raw=habit_description,
-            canonical_habit_name=habit_description or "user habit",
-            habit_category="other",
-            category_confidence="low",
-            product_type="unspecified",
-            severity_level="mild",
-            main_trigger="unknown",
-            peak_times="unknown",
-            common_locations="unknown",
-            emotional_patterns="unclear",
-            frequency_pattern="unknown",
-            previous_attempts="not_clear",
-            motivation_reason="user_wants_change",
-            risk_situations="unknown",
-        )
+        summary = call_with_retry("quiz_summary", lambda a: structured_llm.invoke(prompt, timeout=a.timeout))
+    except (ValidationError, Exception) as exc:
+        summary = _quiz_summary_fallback(state.habit_description or "")
+        mark_fallback(classify(exc))
 
     return {"quiz_summary": summary}
 
 
-def _category_guidance(summary: QuizSummary) -> str:
-    """
-    Rich category- and user-specific guidance so each habit type
-    produces a structurally different 21-day plan.
-
-    This is injected into the PLAN_21D_PROMPT as extra context.
-    """
-
-    cat = (summary.habit_category or "other").lower()
-    severity = summary.severity_level
-    name = summary.canonical_habit_name or summary.user_habit_raw or "the habit"
-    raw = summary.user_habit_raw or ""
-    trigger = summary.main_trigger or "unclear triggers"
-    peak = summary.peak_times or "unclear peak times"
-    loc = summary.common_locations or "unclear locations"
-    emo = summary.emotional_patterns or "unclear emotional patterns"
-    freq = summary.frequency_pattern or "unclear frequency"
-    motive = summary.motivation_reason or "unclear motivation"
-    risk = summary.risk_situations or "unclear risk situations"
-    prev = summary.previous_attempts or "not clearly described"
-
-    base_context = f"""
-User-specific context:
-- Exact wording: {raw}
-- Canonical habit name: {name}
-- Severity: {severity}
-- Main trigger: {trigger}
-- Peak times: {peak}
-- Common locations: {loc}
-- Emotional pattern: {emo}
-- Frequency pattern: {freq}
-- Motivation: {motive}
-- High-risk situations: {risk}
-- Previous attempts: {prev}
-
-Plan must explicitly reference these details across the 21 days.
-"""
-
-    # Now add deep category-specific strategy
-    if cat in ["nicotine_smoking", "nicotine_vaping", "nicotine_oral"]:
-        cat_block = f"""
-Category: Nicotine
-
-Core strategy:
-- Treat {name} as a dopamine and ritual loop, not just a chemical.
-- Emphasize routines around peak times (for example {peak}), and environments like {loc}.
-- Explicitly build friction around storage, access, purchase, and first use of the day.
-- For oral products like pouches, include mouth and hand substitution tasks.
-- For higher severity, include more aggressive environment restructuring and longer urge delays.
-
-Must include across 21 days:
-- At least 4 tasks about changing where {name} is kept or accessed.
-- At least 4 tasks about first use of the day and last use window.
-- At least 3 tasks about physical state regulation during withdrawal (sleep window, hydration, body movement).
-- At least 3 tasks that use emotional patterns like {emo} to pre-empt urges.
-"""
-
-    elif cat == "pornography":
-        cat_block = f"""
-Category: Pornography / sexual content
-
-Core strategy:
-- Treat {name} as a privacy plus device plus emotional loop.
-- Focus on device rules, room layout, and late-night behaviour, especially around {peak}.
-- Explicitly design friction around entering high-risk locations such as {loc}.
-- Use stimulus control (lights, door, blockers, charging locations) instead of just "willpower".
-- Tie reflection tasks to shame cycles and emotion patterns like {emo}, but without using shame language.
-
-Must include across 21 days:
-- At least 4 tasks that change how and where the device is used.
-- At least 3 tasks that pre-empt late-night or alone-time triggers.
-- At least 3 tasks that redirect immediately after a strong urge into a specific alternative behaviour.
-- At least 2 tasks that review a slip in a non-judgmental, purely diagnostic way.
-"""
-
-    elif cat in ["screen_time", "social_media", "gaming"]:
-        cat_block = f"""
-Category: Screen-based habit (social media, scrolling, or gaming)
-
-Core strategy:
-- Treat {name} as an algorithm plus environment plus boredom loop.
-- Focus on first and last 30 minutes of the day, especially if peak times include {peak}.
-- Redesign notification logic, home screen layout, and app availability.
-- Use strong "screen zones" and "screen windows" instead of unrealistic total bans.
-- Tie replacement activities to the motivation: {motive}.
-
-Must include across 21 days:
-- At least 3 tasks modifying notifications, app positions, or app removal.
-- At least 3 tasks that change morning behaviour before the first use.
-- At least 3 tasks that change evening behaviour and pre-sleep routines.
-- At least 3 tasks that deliberately swap a high-risk scrolling window with something aligned to {motive}.
-"""
-
-    elif cat in ["alcohol", "cannabis"]:
-        cat_block = f"""
-Category: Substance use (alcohol or cannabis)
-
-Core strategy:
-- Treat {name} as a context plus people plus emotional regulation loop.
-- Focus on social settings, routes, and specific times like {peak}.
-- Include clear "no-use" contexts and re-routing strategies for high-risk places like {loc}.
-- Include craving delay plus alternative rituals at the exact times they usually use.
-- Tie medium-term tasks to motivation {motive} and long-term identity.
-
-Must include across 21 days:
-- At least 3 tasks that alter routes or places that usually lead to use.
-- At least 3 tasks that create explicit "no-use" rules in specific contexts.
-- At least 3 tasks focused on high-risk situations described as {risk}.
-- At least 2 tasks rehearsing what to do during a social invite or stress spike.
-"""
-
-    elif cat in ["sugar", "food_overeating"]:
-        cat_block = f"""
-Category: Food / sugar / overeating
-
-Core strategy:
-- Treat {name} as a kitchen plus shopping plus emotional soothing loop.
-- Focus on visibility and proximity of foods, especially around locations like {loc}.
-- Tie tasks to emotional states like {emo} and times like {peak}.
-- Include shopping list and preparation changes that reduce impulsive access.
-- Use small plate, portion, and environment tricks rather than "never eat X again" rules.
-
-Must include across 21 days:
-- At least 3 tasks about shopping or preparing alternatives in advance.
-- At least 3 tasks about changing visibility and proximity of trigger foods.
-- At least 3 tasks about emotional check-ins before eating in high-risk moments.
-- At least 2 tasks about how to handle evenings or specific risk situations like {risk}.
-"""
-
-    elif cat in ["shopping_spending", "gambling"]:
-        cat_block = f"""
-Category: Spending / gambling
-
-Core strategy:
-- Treat {name} as a excitement plus access plus impulse loop.
-- Focus on financial access: cards, apps, cash, sites, groups.
-- Use strong pre-commitment rules, delays, and visibility of consequences.
-- Tie specific tasks to high-risk times or contexts like {peak} and {risk}.
-- Use replacement forms of excitement or reward that are lower-risk.
-
-Must include across 21 days:
-- At least 3 tasks about restricting or delaying financial access.
-- At least 3 tasks about changing what happens in the 10–20 minutes before spending or betting.
-- At least 2 tasks about reviewing a past spending or gambling episode analytically, not emotionally.
-- At least 2 tasks that explicitly reinforce the motivation: {motive}.
-"""
-
-    elif cat == "procrastination":
-        cat_block = f"""
-Category: Procrastination
-
-Core strategy:
-- Treat {name} as avoidance of a specific type of work or feeling.
-- Tie tasks directly to the kind of work they avoid most (for example study or deep work).
-- Use very small, clear start behaviours instead of vague discipline tasks.
-- Design environment and time box rules around the true peak avoidance windows like {peak}.
-- Link identity work to becoming someone who handles {trigger} with short, focused bursts.
-
-Must include across 21 days:
-- At least 5 tasks that define a tiny, concrete starting action (for example open document and write one sentence).
-- At least 3 tasks that reduce distractions in the main work location {loc}.
-- At least 3 tasks that handle emotional patterns like {emo} before work instead of during.
-- At least 2 tasks that rehearse what to do after a bad day without abandoning the plan.
-"""
-
-    else:
-        cat_block = f"""
-Category: Other or unclear
+@instrumented("quiz_summary")
+async def aquiz_summary_node(state: HabitState) -> Dict[str, Any]:
+    """
+    Async `quiz_summary_node`.
+    """
+    prompt = _quiz_summary_prompt(state)
 
-Core strategy:
-- The category label is not precise, so lean heavily on the user's actual patterns.
-- Design tasks explicitly around the main trigger {trigger}, peak times {peak}, and locations {loc}.
-- Use emotional pattern {emo} to time interventions before the urge becomes very strong.
-- Apply standard habit-breaking tools: friction, replacement, identity, slip recovery, environment design.
+    structured_llm = _structured_llm(QuizSummary, temperature=0.3, model=MODEL_QUIZ)
 
-Must include across 21 days:
-- At least 5 tasks that directly reference the described triggers, times, or locations.
-- At least 3 tasks that practice urge delay plus a named replacement behaviour.
-- At least 2 tasks that explicitly connect daily actions to the motivation: {motive}.
-"""
+    try:
+        summary = await acall_with_retry("quiz_summary", lambda a: structured_llm.ainvoke(prompt, timeout=a.timeout))
+    except (ValidationError, Exception) as exc:
+        summary = _quiz_summary_fallback(state.habit_description or "")
+        mark_fallback(classify(exc))
 
-    return base_context + "\n" + cat_block
+    return {"quiz_summary": summary}
 
 
 # ---------- 21-Day Plan Node ----------
 
+# "llm": always ask the model (the template plan is only the fallback);
+# "template": never ask; "auto": serve the template plan while plan21's
+# fallback rate is critical, i.e. while the model is mostly failing anyway.
+PLAN21_MODE = os.getenv("UNHABIT_PLAN21_MODE", "auto")
+
+PLAN21_TEMPLATE_PLANS = counter(
+    "unhabit_plan21_template_total",
+    "21-day plans served from local templates without an LLM call, by reason (mode, overload).",
+    labelnames=("reason",),
+)
+
+
 def _fallback_plan21(quiz_summary: Optional[QuizSummary] = None) -> Plan21D:
     """
     Fallback 21-day plan if the LLM output fails validation.
 
-    Uses QuizSummary if available (canonical_habit_name, main_trigger, motivation_reason),
-    but does NOT rely on any old fields like 'habit_name'.
+    With a QuizSummary this is the local template plan for its category
+    (see plan_templates); without one, a generic plan.
     """
     if quiz_summary:
-        habit = (
-            quiz_summary.canonical_habit_name
-            or quiz_summary.user_habit_raw
-            or "your habit"
-        )
-        trigger = quiz_summary.main_trigger or "your usual triggers"
-        motive = quiz_summary.motivation_reason or "your reasons for change"
-    else:
-        habit = "your habit"
-        trigger = "your usual triggers"
-        motive = "your reasons for change"
+        return template_plan21(quiz_summary)
+
+    habit = "your habit"
+    trigger = "your usual triggers"
+    motive = "your reasons for change"
 
     plan_summary = (
         f"This 21-day plan helps you reduce {habit} with small daily actions, "
@@ -503,110 +580,207 @@ def _fallback_plan21(quiz_summary: Optional[QuizSummary] = None) -> Plan21D:
 
     return Plan21D(plan_summary=plan_summary, day_tasks=day_tasks)
 
-def plan21_node(state: HabitState) -> Dict[str, Any]:
-    """
-    Generate the 21-day plan using the QuizSummary as context
-    + category-specific guidance so different habits feel truly different.
-    """
-    if not state.quiz_summary:
-        return {"plan21": _fallback_plan21(None)}
+def _plan21_prompt(quiz_summary: QuizSummary) -> List[BaseMessage]:
+    quiz_json = quiz_summary.model_dump()
+    guidance = render_guidance(quiz_summary)
 
-    quiz_json = state.quiz_summary.model_dump()
-    guidance = _category_guidance(state.quiz_summary)
-
-    prompt = PLAN_21D_PROMPT.format(
+    return PLAN_21D_MESSAGES.format_messages(
         quiz_summary_json=json.dumps(quiz_json, ensure_ascii=False),
         category_guidance=guidance,
     )
 
-    # 🔹 Use your JSON LLM helper, NOT MODEL_JSON, NOT _json_llm
-    data = _llm_json(prompt, max_tokens=1600, temperature=0.35)
 
+def _sanitize_plan21(data: Dict[str, Any], quiz_summary: QuizSummary) -> Plan21D:
     try:
         # Basic sanitization
         day_tasks = data.get("day_tasks", {}) or {}
-        for i in range(1, 21):
+        fallback_tasks = _fallback_plan21(quiz_summary).day_tasks
+        backfilled = 0
+        for i in range(1, 22):
             key = f"day_{i}"
             if key not in day_tasks or not isinstance(day_tasks[key], str) or not day_tasks[key].strip():
-                day_tasks[key] = _fallback_plan21(state.quiz_summary).day_tasks[key]
+                day_tasks[key] = fallback_tasks[key]
+                backfilled += 1
 
         data["day_tasks"] = day_tasks
+        record_backfill(backfilled)
+        if backfilled == len(fallback_tasks):
+            # Nothing usable came back: this is the fallback plan in all but name.
+            mark_fallback("empty_plan", node="plan21")
 
         if "plan_summary" not in data or not isinstance(data["plan_summary"], str):
             data["plan_summary"] = (
-                f"Personalized 21-day behavioural plan to reduce {state.quiz_summary.canonical_habit_name}."
+                f"Personalized 21-day behavioural plan to reduce {quiz_summary.canonical_habit_name}."
             )
 
-        plan = Plan21D(**data)
+        return Plan21D(**data)
     except:
-        plan = _fallback_plan21(state.quiz_summary)
+        mark_fallback("invalid_plan", node="plan21")
+        return _fallback_plan21(quiz_summary)
 
-    return {"plan21": plan}
 
+def _template_plan21_reason() -> Optional[str]:
+    if PLAN21_MODE == "template":
+        return "mode"
+    if PLAN21_MODE == "auto" and node_status("plan21") == CRITICAL:
+        return "overload"
+    return None
 
 
-# ---------- Coach Node ----------
+def _local_plan21(state: HabitState) -> Optional[Plan21D]:
+    """
+    The template plan when UNHABIT_PLAN21_MODE says to skip the LLM, else None.
+    """
+    reason = _template_plan21_reason()
+    if reason is None:
+        return None
+    PLAN21_TEMPLATE_PLANS.inc(reason=reason)
+    return template_plan21(state.quiz_summary)
 
-def coach_node(state: HabitState) -> Dict[str, Any]:
+
+def _plan21_result(state: HabitState, plan: Plan21D) -> Dict[str, Any]:
+    # A fresh plan starts today unless the caller already pinned a start date.
+    return {
+        "plan21": plan,
+        "plan_started_at": state.plan_started_at or date.today().isoformat(),
+    }
+
+
+@instrumented("plan21")
+def plan21_node(state: HabitState) -> Dict[str, Any]:
     """
-    Context-aware AI coach that uses:
-    - safety (to block out-of-scope / dangerous requests)
-    - quiz_summary
-    - plan21
-    - chat_history
-    - last_user_message
+    Generate the 21-day plan using the QuizSummary as context
+    + category-specific guidance so different habits feel truly different.
+    """
+    if not state.quiz_summary:
+        mark_fallback("no_summary")
+        return {"plan21": _fallback_plan21(None)}
+
+    local = _local_plan21(state)
+    if local is not None:
+        mark_local()
+        return _plan21_result(state, local)
+
+    prompt = _plan21_prompt(state.quiz_summary)
+
+    # 🔹 Use your JSON LLM helper, NOT MODEL_JSON, NOT _json_llm
+    data = _llm_json(prompt, max_tokens=1600, temperature=0.35, node="plan21")
+
+    return _plan21_result(state, _sanitize_plan21(data, state.quiz_summary))
+
+
+@instrumented("plan21")
+async def aplan21_node(state: HabitState) -> Dict[str, Any]:
+    """
+    Async `plan21_node`.
     """
+    if not state.quiz_summary:
+        mark_fallback("no_summary")
+        return {"plan21": _fallback_plan21(None)}
+
+    local = _local_plan21(state)
+    if local is not None:
+        mark_local()
+        return _plan21_result(state, local)
+
+    prompt = _plan21_prompt(state.quiz_summary)
+    data = await _allm_json(prompt, max_tokens=1600, temperature=0.35, node="plan21")
+
+    return _plan21_result(state, _sanitize_plan21(data, state.quiz_summary))
+
+
+
+# ---------- Coach Node ----------
+
+_COACH_BLOCKED_REPLY = (
+    "I’m here only for habit and behavior coaching, so I can’t help with medical, legal, "
+    "explicit, or illegal requests. If this is about your health, safety, or a serious "
+    "situation, please talk to a qualified professional or someone you trust in real life."
+)
+
+_COACH_FALLBACK_REPLY = "Let’s focus on one small step you can do today that matches your plan."
+
+# Coach turns have a user waiting on them: first in line at the rate limiter.
+_COACH_PRIORITY = "coach"
+
+# Each new coach message gets its own safety screen, run alongside the reply.
+COACH_SCREEN_TURNS = os.getenv("UNHABIT_COACH_SCREEN_TURNS", "1") != "0"
+
+COACH_TURNS_BLOCKED = counter(
+    "unhabit_coach_turns_blocked_total",
+    "Coach turns answered with the safety message because the turn's screen blocked it.",
+    labelnames=("risk",),
+)
+
+# The sync coach generates on the calling thread while the screen runs here.
+_screen_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="coach-screen")
 
-    # 1) Hard safety block for medical / illegal / minors / self-harm / violence / etc.
+
+def _coach_user_message(state: HabitState) -> str:
+    return state.last_user_message or state.habit_description or ""
+
+
+def _is_block(safety: Optional[SafetyResult]) -> bool:
     # With the new SafetyResult, we check `action`, not `status`.
-    safety = state.safety
-    if safety is not None and getattr(safety, "action", None) == "block_and_escalate":
-        reply = (
-            "I’m here only for habit and behavior coaching, so I can’t help with medical, legal, "
-            "explicit, or illegal requests. If this is about your health, safety, or a serious "
-            "situation, please talk to a qualified professional or someone you trust in real life."
-        )
-
-        # update chat history even on blocked replies
-        new_history = list(state.chat_history or [])
-        user_message = state.last_user_message or state.habit_description or ""
-        if user_message:
-            new_history.append({"role": "user", "content": user_message})
-        new_history.append({"role": "assistant", "content": reply})
-
-        return {
-            "coach_reply": reply,
-            "chat_history": new_history,
-        }
-
-    # 2) Normal coaching flow (safe content)
-    quiz_json = state.quiz_summary.model_dump() if state.quiz_summary else {}
-    plan_json = state.plan21.model_dump() if state.plan21 else {}
-
-    # Format history
-    history_lines = []
-    for msg in state.chat_history or []:
-        role = msg.get("role", "user")
-        content = msg.get("content", "")
-        history_lines.append(f"{role}: {content}")
-    history_text = "\n".join(history_lines)
-
-    user_message = state.last_user_message or state.habit_description or ""
-
-    base_prompt = COACH_PROMPT + "\n\n"
-    base_prompt += f"quiz_summary_json:\n{json.dumps(quiz_json, ensure_ascii=False)}\n\n"
-    base_prompt += f"plan_21d_json:\n{json.dumps(plan_json, ensure_ascii=False)}\n\n"
-    base_prompt += f"history_text:\n{history_text}\n\n"
-    base_prompt += f"user_message:\n{user_message}\n"
+    return safety is not None and getattr(safety, "action", None) == "block_and_escalate"
+
+
+def _coach_is_blocked(state: HabitState) -> bool:
+    # Hard safety block for medical / illegal / minors / self-harm / violence / etc.
+    return _is_block(state.safety)
 
-    llm = _text_llm()
-    try:
-        reply = llm.invoke(base_prompt).content.strip()
-    except Exception:
-        reply = "Let’s focus on one small step you can do today that matches your plan."
 
-    # update chat history
+def _screen_turn(state: HabitState) -> "Optional[Future[SafetyResult]]":
+    """
+    Start the safety screen of this turn's message. Pre-filter decisions are
+    resolved at once; anything else is classified on `_screen_executor`
+    (in the caller's context, so it counts towards the coach span).
+    """
+    text = state.last_user_message
+    if not (COACH_SCREEN_TURNS and text):
+        return None
+    local = prefilter(text)
+    if local is not None:
+        future: Future = Future()
+        future.set_result(local)
+        return future
+    context = contextvars.copy_context()
+    return _screen_executor.submit(context.run, lambda: _classify_safety(text)[0])
+
+
+async def _aclassify_turn(text: str) -> SafetyResult:
+    safety, _ = await _aclassify_safety(text)
+    return safety
+
+
+def _ascreen_turn(state: HabitState) -> "Optional[asyncio.Future[SafetyResult]]":
+    """
+    Async `_screen_turn`: the screen runs as a task on the current loop.
+    """
+    text = state.last_user_message
+    if not (COACH_SCREEN_TURNS and text):
+        return None
+    local = prefilter(text)
+    if local is not None:
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(local)
+        return future
+    return asyncio.ensure_future(_aclassify_turn(text))
+
+
+def _screen_blocked(screen: Optional[Any]) -> bool:
+    # True once a finished screen has blocked the message.
+    return screen is not None and screen.done() and _is_block(screen.result())
+
+
+def _coach_result(
+    state: HabitState,
+    reply: str,
+    turn_safety: Optional[SafetyResult] = None,
+) -> Dict[str, Any]:
+    # update chat history (also on blocked replies)
     new_history = list(state.chat_history or [])
+    user_message = _coach_user_message(state)
     if user_message:
         new_history.append({"role": "user", "content": user_message})
     new_history.append({"role": "assistant", "content": reply})
@@ -614,5 +788,491 @@ def coach_node(state: HabitState) -> Dict[str, Any]:
     return {
         "coach_reply": reply,
         "chat_history": new_history,
+        "turn_safety": turn_safety,
+    }
+
+
+def _turn_blocked_result(
+    state: HabitState,
+    turn_safety: SafetyResult,
+) -> Dict[str, Any]:
+    # The generated reply (if any) is dropped for the screen's own safe message.
+    COACH_TURNS_BLOCKED.inc(risk=turn_safety.risk)
+    return _coach_result(state, turn_safety.message or _COACH_BLOCKED_REPLY, turn_safety)
+
+
+def _summary_prompt(previous: Optional[str], messages: List[Dict[str, str]]) -> List[BaseMessage]:
+    return CHAT_SUMMARY_MESSAGES.format_messages(
+        previous_summary=previous or "(none yet)",
+        messages=format_messages(messages),
+    )
+
+
+# The summary fold is an extra LLM call, so it never runs inside a turn: the
+# caller runs `fold_coach_summary` once the reply has gone out and saves the
+# update with the session. The result lives in the state, so whichever worker
+# serves the next turn sees it; until then the turns it covers stay verbatim.
+_FOLD_PRIORITY = "batch"
+
+
+def _fold_result(summary: str, previous: Optional[str], messages: List[Dict[str, str]], upto: int) -> Dict[str, Any]:
+    summary = truncate_tokens(summary.strip(), COACH_SUMMARY_MAX_TOKENS)
+    return {
+        "chat_summary": summary or extractive_summary(previous, messages),
+        "chat_summary_upto": upto,
     }
 
+
+def fold_coach_summary(state: HabitState) -> Dict[str, Any]:
+    """
+    Fold turns that left the verbatim window into the running summary.
+
+    Returns the {"chat_summary", "chat_summary_upto"} update, or {} when no
+    batch is due. Call it after the reply has been sent, then save the state.
+    """
+    messages, upto = pending_fold(state)
+    if not messages:
+        return {}
+    llm = _text_llm(temperature=0.2)
+    prompt = _summary_prompt(state.chat_summary, messages)
+    try:
+        summary = call_with_retry(
+            "chat_summary", lambda a: llm.invoke(prompt, llm_priority=_FOLD_PRIORITY, timeout=a.timeout)
+        ).content
+    except Exception as exc:
+        summary = ""
+        mark_fallback(classify(exc), node="chat_summary")
+    return _fold_result(summary, state.chat_summary, messages, upto)
+
+
+async def afold_coach_summary(state: HabitState) -> Dict[str, Any]:
+    """
+    Async `fold_coach_summary`.
+    """
+    messages, upto = pending_fold(state)
+    if not messages:
+        return {}
+    llm = _text_llm(temperature=0.2)
+    prompt = _summary_prompt(state.chat_summary, messages)
+    try:
+        summary = (await acall_with_retry(
+            "chat_summary", lambda a: llm.ainvoke(prompt, llm_priority=_FOLD_PRIORITY, timeout=a.timeout)
+        )).content
+    except Exception as exc:
+        summary = ""
+        mark_fallback(classify(exc), node="chat_summary")
+    return _fold_result(summary, state.chat_summary, messages, upto)
+
+
+def _coach_prompt(state: HabitState, summary: Optional[str], summary_upto: int) -> List[BaseMessage]:
+    return render_coach_messages(state, summary, summary_upto)
+
+
+@instrumented("coach")
+def coach_node(state: HabitState) -> Dict[str, Any]:
+    """
+    Context-aware AI coach that uses:
+    - safety (to block out-of-scope / dangerous requests)
+    - quiz_summary
+    - plan21
+    - chat_history
+    - last_user_message (screened for safety while the reply is generated)
+    """
+    if _coach_is_blocked(state):
+        return _coach_result(state, _COACH_BLOCKED_REPLY)
+
+    screen = _screen_turn(state)
+    if _screen_blocked(screen):
+        return _turn_blocked_result(state, screen.result())
+
+    summary, summary_upto = state.chat_summary, state.chat_summary_upto or 0
+
+    llm = _text_llm()
+    prompt = _coach_prompt(state, summary, summary_upto)
+    try:
+        reply = call_with_retry(
+            "coach", lambda a: llm.invoke(prompt, llm_priority=_COACH_PRIORITY, timeout=a.timeout)
+        ).content.strip()
+    except Exception as exc:
+        reply = _COACH_FALLBACK_REPLY
+        mark_fallback(classify(exc))
+
+    turn_safety = screen.result() if screen is not None else None
+    if _is_block(turn_safety):
+        return _turn_blocked_result(state, turn_safety)
+    return _coach_result(state, reply, turn_safety)
+
+
+@instrumented("coach")
+async def acoach_node(state: HabitState) -> Dict[str, Any]:
+    """
+    Async `coach_node`.
+    """
+    if _coach_is_blocked(state):
+        return _coach_result(state, _COACH_BLOCKED_REPLY)
+
+    screen = _ascreen_turn(state)
+    if _screen_blocked(screen):
+        return _turn_blocked_result(state, screen.result())
+
+    summary, summary_upto = state.chat_summary, state.chat_summary_upto or 0
+
+    llm = _text_llm()
+    prompt = _coach_prompt(state, summary, summary_upto)
+    try:
+        reply = (await acall_with_retry(
+            "coach", lambda a: llm.ainvoke(prompt, llm_priority=_COACH_PRIORITY, timeout=a.timeout)
+        )).content.strip()
+    except Exception as exc:
+        reply = _COACH_FALLBACK_REPLY
+        mark_fallback(classify(exc))
+
+    turn_safety = await screen if screen is not None else None
+    if _is_block(turn_safety):
+        return _turn_blocked_result(state, turn_safety)
+    return _coach_result(state, reply, turn_safety)
+
+
+def _apply_update(state: HabitState, update: Dict[str, Any]) -> None:
+    for key, value in update.items():
+        setattr(state, key, value)
+
+
+@instrumented("coach")
+def stream_coach_node(state: HabitState) -> Iterator[str]:
+    """
+    Streaming `coach_node`: yields reply text as tokens arrive.
+
+    Once the reply is complete, the usual {"coach_reply", "chat_history"}
+    update is applied to `state` in place (there is no return value to carry it).
+
+    Chunks are held back until the turn's safety screen has cleared the
+    message; if it blocks, nothing of the reply is sent and the screen's
+    safe message is yielded instead.
+    """
+    if _coach_is_blocked(state):
+        yield _COACH_BLOCKED_REPLY
+        _apply_update(state, _coach_result(state, _COACH_BLOCKED_REPLY))
+        return
+
+    screen = _screen_turn(state)
+    if _screen_blocked(screen):
+        update = _turn_blocked_result(state, screen.result())
+        yield update["coach_reply"]
+        _apply_update(state, update)
+        return
+
+    summary, summary_upto = state.chat_summary, state.chat_summary_upto or 0
+
+    prompt = _coach_prompt(state, summary, summary_upto)
+    parts, held, error = [], [], None
+    attempt, started = 0, time.monotonic()
+    deadline = started + deadline_for("coach")
+    while True:
+        attempt += 1
+        # For a stream the SDK timeout bounds each wait for data, not the whole reply.
+        timeout = max(deadline - time.monotonic(), 0.001)
+        try:
+            for chunk in _text_llm().stream(
+                prompt, llm_priority=_COACH_PRIORITY, llm_node="coach", timeout=timeout
+            ):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    held.append(chunk.content)
+                    if _screen_blocked(screen):
+                        break
+                    if screen is None or screen.done():
+                        yield "".join(held)
+                        held.clear()
+            break
+        except Exception as exc:
+            # Keep whatever already reached the user; a stream is only retried
+            # before its first chunk, and falls back only if nothing arrived.
+            error = exc
+            delay = None if parts else retry_delay("coach", exc, attempt, started)
+            if delay is None:
+                break
+            time.sleep(delay)
+
+    turn_safety = screen.result() if screen is not None else None
+    if _is_block(turn_safety):
+        update = _turn_blocked_result(state, turn_safety)
+        yield update["coach_reply"]
+        _apply_update(state, update)
+        return
+    if held:
+        yield "".join(held)
+
+    reply = "".join(parts).strip()
+    if not reply:
+        reply = _COACH_FALLBACK_REPLY
+        mark_fallback(classify(error) if error else "empty_response")
+        yield reply
+
+    _apply_update(state, _coach_result(state, reply, turn_safety))
+
+
+@instrumented("coach")
+async def astream_coach_node(state: HabitState) -> AsyncIterator[str]:
+    """
+    Async `stream_coach_node`.
+    """
+    if _coach_is_blocked(state):
+        yield _COACH_BLOCKED_REPLY
+        _apply_update(state, _coach_result(state, _COACH_BLOCKED_REPLY))
+        return
+
+    screen = _ascreen_turn(state)
+    if _screen_blocked(screen):
+        update = _turn_blocked_result(state, screen.result())
+        yield update["coach_reply"]
+        _apply_update(state, update)
+        return
+
+    summary, summary_upto = state.chat_summary, state.chat_summary_upto or 0
+
+    prompt = _coach_prompt(state, summary, summary_upto)
+    parts, held, error = [], [], None
+    attempt, started = 0, time.monotonic()
+    deadline = started + deadline_for("coach")
+    while True:
+        attempt += 1
+        timeout = max(deadline - time.monotonic(), 0.001)
+        try:
+            async for chunk in _text_llm().astream(
+                prompt, llm_priority=_COACH_PRIORITY, llm_node="coach", timeout=timeout
+            ):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    held.append(chunk.content)
+                    if _screen_blocked(screen):
+                        break
+                    if screen is None or screen.done():
+                        yield "".join(held)
+                        held.clear()
+            break
+        except Exception as exc:
+            error = exc
+            delay = None if parts else retry_delay("coach", exc, attempt, started)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+
+    turn_safety = await screen if screen is not None else None
+    if _is_block(turn_safety):
+        update = _turn_blocked_result(state, turn_safety)
+        yield update["coach_reply"]
+        _apply_update(state, update)
+        return
+    if held:
+        yield "".join(held)
+
+    reply = "".join(parts).strip()
+    if not reply:
+        reply = _COACH_FALLBACK_REPLY
+        mark_fallback(classify(error) if error else "empty_response")
+        yield reply
+
+    _apply_update(state, _coach_result(state, reply, turn_safety))
+
+
+# ---------- Batch (offline) ----------
+#
+# Stage-at-a-time variants of the onboarding nodes for many states at once.
+# Cache hits are served locally; misses go out through the model's `abatch`
+# (duplicate prompts collapsed to one call) and failures get the same
+# fallbacks as the single-state nodes.
+
+async def _abatch_llm(
+    llm: Runnable,
+    prompts: List[List[BaseMessage]],
+    max_concurrency: int,
+    node: str,
+) -> List[Any]:
+    """
+    `llm.abatch(prompts)` with exceptions returned in place.
+
+    Items that fail retryably are re-sent in further rounds under `node`'s
+    retry policy; a round with rate-limited items halves the concurrency.
+    """
+    results: List[Any] = [None] * len(prompts)
+    pending = list(range(len(prompts)))
+    concurrency = max(1, max_concurrency)
+    started = time.monotonic()
+    attempt = 0
+
+    while pending:
+        attempt += 1
+        with llm_node(node):
+            outputs = await llm.abatch(
+                [prompts[i] for i in pending],
+                config={"max_concurrency": concurrency},
+                return_exceptions=True,
+            )
+        retry, delays = [], []
+        for i, output in zip(pending, outputs):
+            results[i] = output
+            if not isinstance(output, Exception):
+                continue
+            # Offline work has no user waiting: bounded by attempts, not time.
+            delay = retry_delay(node, output, attempt, started, budget=math.inf)
+            if delay is not None:
+                retry.append(i)
+                delays.append(delay)
+                if classify(output) == RATE_LIMIT:
+                    concurrency = max(1, max_concurrency >> attempt)
+        if retry:
+            await asyncio.sleep(max(delays))
+        pending = retry
+
+    return results
+
+
+async def _abatch_unique(
+    llm: Runnable,
+    prompts: List[List[BaseMessage]],
+    max_concurrency: int,
+    node: str,
+) -> List[Any]:
+    # Identical prompts (same habit text in one batch) share a single call.
+    keys = [tuple(message.content for message in prompt) for prompt in prompts]
+    unique = dict(zip(keys, prompts))
+    outputs = dict(zip(unique, await _abatch_llm(llm, list(unique.values()), max_concurrency, node)))
+    return [outputs[key] for key in keys]
+
+
+async def abatch_safety(states: List[HabitState], max_concurrency: int = 8) -> List[Dict[str, Any]]:
+    """
+    `safety_node` for many states.
+    """
+    texts = [_safety_user_text(state) for state in states]
+    local = [prefilter(text) for text in texts]
+    lookups = [
+        (None, result) if result is not None else lookup(SAFETY_TEMPLATE_ID, MODEL_JSON, 0.1, text, SafetyResult)
+        for text, result in zip(texts, local)
+    ]
+    results = [cached for _, cached in lookups]
+
+    misses = [i for i, cached in enumerate(results) if cached is None]
+    outputs = await _abatch_unique(
+        _structured_llm(SafetyResult, temperature=0.1),
+        [SAFETY_MESSAGES.format_messages(user_text=texts[i]) for i in misses],
+        max_concurrency,
+        "safety",
+    )
+    for i, output in zip(misses, outputs):
+        if isinstance(output, Exception):
+            results[i] = _safety_fallback()
+            mark_fallback(classify(output), node="safety")
+        else:
+            store(lookups[i][0], output)
+            results[i] = output
+
+    return [{"safety": safety} for safety in results]
+
+
+async def abatch_quiz_form(states: List[HabitState], max_concurrency: int = 8) -> List[Dict[str, Any]]:
+    """
+    `quiz_form_node` for many states (exact cache, then similarity cache, then LLM).
+    """
+    descriptions = [state.habit_description or "" for state in states]
+    lookups = [
+        lookup(QUIZ_FORM_TEMPLATE_ID, MODEL_QUIZ, 0.4, description, QuizForm)
+        for description in descriptions
+    ]
+    results = [cached for _, cached in lookups]
+
+    similar_cache = get_quiz_form_cache()
+    if similar_cache is not None:
+        for i, cached in enumerate(results):
+            if cached is None:
+                results[i] = similar_cache.get(descriptions[i])
+
+    misses = [i for i, cached in enumerate(results) if cached is None]
+    outputs = await _abatch_unique(
+        _structured_llm(QuizForm, temperature=0.4, model=MODEL_QUIZ),
+        [QUIZ_GENERATOR_MESSAGES.format_messages(habit_description=descriptions[i]) for i in misses],
+        max_concurrency,
+        "quiz_form",
+    )
+    for i, output in zip(misses, outputs):
+        if isinstance(output, Exception):
+            results[i] = _quiz_form_fallback(descriptions[i])
+            mark_fallback(classify(output), node="quiz_form")
+            continue
+        store(lookups[i][0], output)
+        if similar_cache is not None:
+            similar_cache.put(descriptions[i], output)
+        results[i] = output
+
+    return [{"quiz_form": quiz_form} for quiz_form in results]
+
+
+async def abatch_quiz_summary(states: List[HabitState], max_concurrency: int = 8) -> List[Dict[str, Any]]:
+    """
+    `quiz_summary_node` for many states.
+    """
+    outputs = await _abatch_llm(
+        _structured_llm(QuizSummary, temperature=0.3, model=MODEL_QUIZ),
+        [_quiz_summary_prompt(state) for state in states],
+        max_concurrency,
+        "quiz_summary",
+    )
+    results = []
+    for state, output in zip(states, outputs):
+        if isinstance(output, Exception):
+            mark_fallback(classify(output), node="quiz_summary")
+            output = _quiz_summary_fallback(state.habit_description or "")
+        results.append({"quiz_summary": output})
+    return results
+
+
+async def abatch_plan21(states: List[HabitState], max_concurrency: int = 8) -> List[Dict[str, Any]]:
+    """
+    `plan21_node` for many states.
+
+    Items whose batch rounds ended in an error get the fallback plan: the
+    retries are already spent. Replies that came back but aren't valid JSON
+    go through `_allm_json` (stricter JSON instruction), concurrently.
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(states)
+    todo = []
+    for i, state in enumerate(states):
+        if not state.quiz_summary:
+            results[i] = {"plan21": _fallback_plan21(None)}
+            mark_fallback("no_summary", node="plan21")
+            continue
+        local = _local_plan21(state)
+        if local is not None:
+            results[i] = _plan21_result(state, local)
+        else:
+            todo.append(i)
+
+    prompts = [_plan21_prompt(states[i].quiz_summary) for i in todo]
+    llm = get_chat_model(MODEL_JSON, 0.35, response_format={"type": "json_object"}).bind(max_tokens=1600)
+    outputs = await _abatch_llm(llm, prompts, max_concurrency, "plan21")
+
+    repairs = []
+    for i, prompt, output in zip(todo, prompts, outputs):
+        if isinstance(output, Exception):
+            mark_fallback(classify(output), node="plan21")
+            results[i] = _plan21_result(states[i], _fallback_plan21(states[i].quiz_summary))
+            continue
+        try:
+            data = json.loads(output.content)
+        except Exception:
+            repairs.append((i, prompt))
+            continue
+        results[i] = _plan21_result(states[i], _sanitize_plan21(data, states[i].quiz_summary))
+
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def repair(prompt: List[BaseMessage]) -> Dict[str, Any]:
+        async with semaphore:
+            return await _allm_json(prompt, max_tokens=1600, temperature=0.35, node="plan21")
+
+    repaired = await asyncio.gather(*(repair(prompt) for _, prompt in repairs))
+    for (i, _), data in zip(repairs, repaired):
+        results[i] = _plan21_result(states[i], _sanitize_plan21(data, states[i].quiz_summary))
+
+    return results
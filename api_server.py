@@ -0,0 +1,297 @@
+# api_server.py
+"""
+Headless ASGI service for the onboarding + coach pipeline.
+
+Runs the same checkpointed onboarding graph as the Streamlit app (async
+nodes, paused at the quiz_answers interrupt) so the AI backend can be
+scaled on its own, independent of any UI.
+
+Endpoints:
+- POST /v1/onboarding/start               safety + quiz_form, then pause for answers
+- POST /v1/onboarding/{user_id}/answers   quiz_summary + plan21 + first coach reply
+- POST /v1/coach/{user_id}                one coach turn
+- POST /v1/coach/{user_id}/stream         one coach turn, reply streamed as plain text
+- GET  /v1/sessions/{user_id}             current HabitState
+- GET  /healthz
+- GET  /metrics                           Prometheus text format (see instrumentation.py)
+- GET  /v1/metrics/summary                per-node aggregates of recent runs
+- GET  /v1/health                         rolling fallback rates per node (see health.py)
+
+Sessions live in the session store (UNHABIT_SESSION_STORE, defaulting to a
+local SQLite file) and graph checkpoints in UNHABIT_CHECKPOINT_DB, so
+workers behind a load balancer must share both. The coach's running
+summary is folded after each reply has gone out and saved with the session,
+so it is shared the same way.
+
+Configuration (env):
+- UNHABIT_API_SESSION_STORE_DEFAULT=sqlite:///unhabit_sessions.sqlite
+- UNHABIT_API_SPECULATIVE=1   run safety and quiz_form in parallel
+- UNHABIT_API_HOST=0.0.0.0, UNHABIT_API_PORT=8000
+
+Run with `uvicorn api_server:app` or `python api_server.py`.
+"""
+import asyncio
+import json
+import os
+import uuid
+import weakref
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Union
+
+from fastapi import BackgroundTasks, FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, field_validator
+
+from ai_nodes import acoach_node, afold_coach_summary, astream_coach_node
+from graphs import (
+    CHECKPOINT_DB,
+    aanswer_stored_quiz,
+    astart_onboarding,
+    asubmit_quiz_answers,
+    build_checkpointed_onboarding_graph,
+    pending_quiz,
+    state_from_result,
+    thread_config,
+)
+from health import health_summary
+from instrumentation import summary
+from metrics import render_prometheus
+from schemas import HabitState
+from session_store import SessionStore, store_from_url
+
+DEFAULT_SESSION_STORE = os.getenv(
+    "UNHABIT_API_SESSION_STORE_DEFAULT", "sqlite:///unhabit_sessions.sqlite"
+)
+API_SPECULATIVE = os.getenv("UNHABIT_API_SPECULATIVE", "1") != "0"
+
+
+# ---------- Request bodies ----------
+
+def _not_blank(value: str) -> str:
+    # Whitespace-only text passes min_length; reject it (422) after stripping.
+    value = value.strip()
+    if not value:
+        raise ValueError("must not be blank")
+    return value
+
+
+class StartRequest(BaseModel):
+    habit_description: str = Field(..., min_length=1)
+    user_id: Optional[str] = None
+
+    _strip_description = field_validator("habit_description")(_not_blank)
+
+
+class AnswersRequest(BaseModel):
+    # {question_id: answer}, or an already-serialized answers string.
+    answers: Union[Dict[str, str], str]
+
+
+class CoachRequest(BaseModel):
+    message: str = Field(..., min_length=1)
+
+    _strip_message = field_validator("message")(_not_blank)
+
+
+# ---------- Runtime ----------
+
+class Runtime:
+    """
+    Per-process resources: the compiled graph, the session store and a lock
+    per user so concurrent requests for one session don't interleave writes.
+    """
+
+    def __init__(self, graph: Any, store: SessionStore):
+        self.graph = graph
+        self.store = store
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def lock(self, user_id: str) -> asyncio.Lock:
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[user_id] = lock
+        return lock
+
+    async def load(self, user_id: str) -> HabitState:
+        state = await asyncio.to_thread(self.store.load, user_id)
+        if state is None:
+            raise HTTPException(status_code=404, detail=f"Unknown session: {user_id}")
+        return state
+
+    async def save(self, state: HabitState) -> None:
+        await asyncio.to_thread(self.store.save, state)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Built inside the running loop: the async checkpointer binds to it.
+    graph = build_checkpointed_onboarding_graph(
+        path=CHECKPOINT_DB,
+        async_nodes=True,
+        speculative=API_SPECULATIVE,
+        quiz_interrupt=True,
+    )
+    store = store_from_url(os.getenv("UNHABIT_SESSION_STORE") or DEFAULT_SESSION_STORE)
+    app.state.runtime = Runtime(graph, store)
+    try:
+        yield
+    finally:
+        conn = getattr(graph.checkpointer, "conn", None)
+        if conn is not None:
+            await conn.close()
+
+
+app = FastAPI(title="Unhabit AI", lifespan=lifespan)
+
+
+def _runtime() -> Runtime:
+    return app.state.runtime
+
+
+def _blocked(state: HabitState) -> bool:
+    return bool(state.safety and state.safety.action == "block_and_escalate")
+
+
+def _dump(model: Any) -> Optional[Dict[str, Any]]:
+    return model.model_dump() if model is not None else None
+
+
+async def _fold_and_save(runtime: Runtime, state: HabitState) -> None:
+    # The fold is a separate LLM call, so it runs once the reply is out.
+    update = await afold_coach_summary(state)
+    if update:
+        for key, value in update.items():
+            setattr(state, key, value)
+        await runtime.save(state)
+
+
+async def _fold_session(runtime: Runtime, user_id: str) -> None:
+    async with runtime.lock(user_id):
+        await _fold_and_save(runtime, await runtime.load(user_id))
+
+
+# ---------- Endpoints ----------
+
+@app.get("/healthz")
+async def healthz() -> Dict[str, str]:
+    return {"status": "ok"}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/v1/metrics/summary")
+async def metrics_summary() -> Dict[str, Any]:
+    return summary()
+
+
+@app.get("/v1/health")
+async def health() -> Dict[str, Any]:
+    # Unlike /healthz this reports degradation, not liveness: always 200.
+    return health_summary()
+
+
+@app.post("/v1/onboarding/start")
+async def start(body: StartRequest) -> Dict[str, Any]:
+    runtime = _runtime()
+    user_id = body.user_id or uuid.uuid4().hex
+    state = HabitState(user_id=user_id, habit_description=body.habit_description)
+
+    async with runtime.lock(user_id):
+        result = await astart_onboarding(runtime.graph, state)
+        state = state_from_result(result)
+        await runtime.save(state)
+
+    blocked = _blocked(state)
+    return {
+        "user_id": user_id,
+        "blocked": blocked,
+        "safety": _dump(state.safety),
+        "quiz_form": None if blocked else _dump(state.quiz_form),
+        "awaiting_answers": pending_quiz(result) is not None,
+    }
+
+
+@app.post("/v1/onboarding/{user_id}/answers")
+async def submit_answers(user_id: str, body: AnswersRequest) -> Dict[str, Any]:
+    runtime = _runtime()
+    answers = body.answers
+    if isinstance(answers, dict):
+        answers = json.dumps({"answers": answers}, ensure_ascii=False)
+
+    async with runtime.lock(user_id):
+        state = await runtime.load(user_id)
+        if _blocked(state):
+            raise HTTPException(status_code=409, detail="Session was blocked by the safety check")
+
+        if (await runtime.graph.aget_state(thread_config(user_id))).next:
+            result = await asubmit_quiz_answers(runtime.graph, user_id, answers)
+        elif state.quiz_form is not None:
+            # No paused run (checkpoint lost, or the run already finished): answer
+            # the stored quiz rather than generate a different one.
+            result = await aanswer_stored_quiz(runtime.graph, state, answers)
+        else:
+            raise HTTPException(status_code=409, detail="No quiz to answer; start onboarding first")
+        state = state_from_result(result)
+        await runtime.save(state)
+
+    return {
+        "user_id": user_id,
+        "quiz_summary": _dump(state.quiz_summary),
+        "plan21": _dump(state.plan21),
+        "coach_reply": state.coach_reply,
+    }
+
+
+@app.post("/v1/coach/{user_id}")
+async def coach(user_id: str, body: CoachRequest, background: BackgroundTasks) -> Dict[str, Any]:
+    runtime = _runtime()
+    async with runtime.lock(user_id):
+        state = await runtime.load(user_id)
+        state.last_user_message = body.message
+        for key, value in (await acoach_node(state)).items():
+            setattr(state, key, value)
+        await runtime.save(state)
+
+    # Reloaded under the lock, so a turn that got in first is folded too.
+    background.add_task(_fold_session, runtime, user_id)
+    return {"user_id": user_id, "coach_reply": state.coach_reply, "turn_safety": _dump(state.turn_safety)}
+
+
+@app.post("/v1/coach/{user_id}/stream")
+async def coach_stream(user_id: str, body: CoachRequest) -> StreamingResponse:
+    runtime = _runtime()
+    await runtime.load(user_id)  # 404 before the response starts
+    message = body.message
+
+    async def tokens() -> AsyncIterator[str]:
+        # The lock is taken inside the body so a client that disconnects
+        # before streaming starts can't leave it held.
+        async with runtime.lock(user_id):
+            state = await runtime.load(user_id)
+            state.last_user_message = message
+            async for chunk in astream_coach_node(state):
+                yield chunk
+            # astream_coach_node has applied the reply to `state` by now.
+            await runtime.save(state)
+            await _fold_and_save(runtime, state)
+
+    return StreamingResponse(tokens(), media_type="text/plain; charset=utf-8")
+
+
+@app.get("/v1/sessions/{user_id}")
+async def get_session(user_id: str) -> Dict[str, Any]:
+    return (await _runtime().load(user_id)).model_dump()
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        app,
+        host=os.getenv("UNHABIT_API_HOST", "0.0.0.0"),
+        port=int(os.getenv("UNHABIT_API_PORT", "8000")),
+    )
@@ -1,14 +1,26 @@
 import json
+import os
+import uuid
+from typing import Optional
+
 import streamlit as st
 
 from schemas import HabitState, QuizForm, QuizSummary, Plan21D
-from ai_nodes import (
-    safety_node,
-    quiz_form_node,
-    quiz_summary_node,
-    plan21_node,
-    coach_node,
+from ai_nodes import fold_coach_summary, stream_coach_node
+from coach_context import current_plan_day
+from graphs import (
+    answer_stored_quiz,
+    build_checkpointed_onboarding_graph,
+    start_onboarding,
+    state_from_result,
+    stream_quiz_answers,
+    thread_config,
 )
+from health import health_summary
+from instrumentation import recent, summary
+from metrics import start_metrics_server
+from plan_templates import template_plan21
+from session_store import SessionStore, get_session_store
 
 # --------------------- Streamlit setup --------------------- #
 
@@ -24,9 +36,31 @@ st.caption("AI-powered habit reduction with personalized quiz, 21-day plan, and
 
 # --------------------- Session State helpers --------------------- #
 
+@st.cache_resource
+def session_store() -> Optional[SessionStore]:
+    # Configured via UNHABIT_SESSION_STORE; None keeps everything in the browser session only.
+    return get_session_store()
+
+
+@st.cache_resource
+def onboarding_graph(speculative: bool):
+    # One checkpointed graph per mode; it pauses after quiz_form until answers arrive.
+    return build_checkpointed_onboarding_graph(speculative=speculative, quiz_interrupt=True)
+
+
+@st.cache_resource
+def metrics_server():
+    # Streamlit has no HTTP routes of its own; serve /metrics on a side port if asked.
+    port = os.getenv("UNHABIT_METRICS_PORT")
+    return start_metrics_server(int(port)) if port else None
+
+
+metrics_server()
+
+
 def init_state():
     if "habit_state" not in st.session_state:
-        st.session_state.habit_state = HabitState()
+        st.session_state.habit_state = HabitState(user_id=uuid.uuid4().hex)
     if "quiz_answers_cache" not in st.session_state:
         st.session_state.quiz_answers_cache = {}  # {question_id: answer}
 
@@ -44,6 +78,35 @@ def update_state(partial: dict):
     st.session_state.habit_state = state
 
 
+def persist_state():
+    """
+    Save the current HabitState so a refresh or restart can resume it.
+    """
+    store = session_store()
+    if store is not None:
+        store.save(st.session_state.habit_state)
+
+
+def resume_session(user_id: str) -> bool:
+    store = session_store()
+    loaded = store.load(user_id) if store is not None else None
+    if loaded is None:
+        return False
+    st.session_state.habit_state = loaded
+    return True
+
+
+def show_draft_plan(plan: Plan21D):
+    """
+    The local template plan, shown while the generated plan is on its way.
+    """
+    st.info("Draft plan while your personalised plan is generated:")
+    st.write(plan.plan_summary)
+    with st.expander("Draft daily tasks"):
+        for day_key, task in plan.day_tasks.items():
+            st.markdown(f"**{day_key.replace('_', ' ').title()}**: {task}")
+
+
 def reset_app():
     st.session_state.clear()
     init_state()
@@ -57,6 +120,23 @@ with st.sidebar:
         reset_app()
         st.experimental_rerun()
 
+    if session_store() is not None:
+        session_id = st.text_input(
+            "Session ID",
+            value=st.session_state.habit_state.user_id or "",
+            help="Keep this to resume later; paste an earlier one to restore that session.",
+        ).strip()
+        if session_id and session_id != st.session_state.habit_state.user_id:
+            if resume_session(session_id):
+                st.rerun()
+            st.session_state.habit_state.user_id = session_id
+
+    speculative_mode = st.checkbox(
+        "⚡ Generate quiz alongside safety check",
+        value=True,
+        help="Runs the safety check and quiz generation in parallel; the quiz is discarded if the input is blocked.",
+    )
+
     st.markdown("### Debug info")
     state: HabitState = st.session_state.habit_state
     st.json(
@@ -70,6 +150,16 @@ with st.sidebar:
         expanded=False,
     )
 
+    if st.checkbox("📈 LLM metrics", value=False, help="Latency, tokens and cost per node in this process."):
+        st.json(summary(), expanded=True)
+        health = health_summary()
+        if health["status"] != "ok":
+            st.warning(f"Fallback rate {health['status']}: upstream may be throttling or slow.")
+        with st.expander("Fallback health"):
+            st.json(health, expanded=False)
+        with st.expander("Recent node runs"):
+            st.json(recent(10), expanded=False)
+
 # Main layout: 3 columns
 col_left, col_mid, col_right = st.columns([1.2, 1.5, 1.5])
 
@@ -99,9 +189,9 @@ with col_left:
             # Update habit description in state
             state.habit_description = habit_text.strip()
 
-            # 1) Safety check
-            safety_result = safety_node(state)
-            update_state(safety_result)
+            # Safety + quiz_form run in the graph, which then pauses for the answers.
+            result = start_onboarding(onboarding_graph(speculative_mode), state)
+            st.session_state.habit_state = state_from_result(result)
             state = st.session_state.habit_state
 
             # 🔴 NEW: use `.action` instead of `.status` and hard-stop if blocked
@@ -111,11 +201,9 @@ with col_left:
                     "illegal, explicit, or harmful requests. If this is about your health, safety, or a "
                     "serious situation, please reach out to a trusted person or a local professional."
                 )
-                st.stop()  # do NOT generate quiz or anything else for this input
+                st.stop()  # do NOT show the quiz or anything else for this input
 
-            # 2) Generate quiz form (only for safe, in-scope content)
-            quiz_result = quiz_form_node(state)
-            update_state(quiz_result)
+            persist_state()
             st.success("✅ Quiz generated. Scroll to step 2 to answer the questions.")
 
 
@@ -170,19 +258,27 @@ with col_mid:
                 {"answers": answers_dict}, ensure_ascii=False
             )
 
-            # 1) Summarize quiz
-            summary_result = quiz_summary_node(st.session_state.habit_state)
-            update_state(summary_result)
-
-            # 2) Generate plan
-            plan_result = plan21_node(st.session_state.habit_state)
-            update_state(plan_result)
-
-            # 3) Generate first coach reply
-            # We treat this as the initial welcome message, with last_user_message = None
-            st.session_state.habit_state.last_user_message = None
-            coach_result = coach_node(st.session_state.habit_state)
-            update_state(coach_result)
+            # Resume the paused graph: quiz_summary -> plan21 -> first coach reply.
+            graph = onboarding_graph(speculative_mode)
+            state = st.session_state.habit_state
+            config = thread_config(state.user_id)
+            if graph.get_state(config).next:
+                # As soon as the quiz summary is in, show a template draft of the plan;
+                # it's cleared when the generated plan arrives.
+                draft_slot = st.empty()
+                for update in stream_quiz_answers(graph, state.user_id, state.user_quiz_answers):
+                    quiz_summary = (update.get("quiz_summary") or {}).get("quiz_summary")
+                    if quiz_summary is not None:
+                        with draft_slot.container():
+                            show_draft_plan(template_plan21(QuizSummary.model_validate(quiz_summary)))
+                draft_slot.empty()
+                result = graph.get_state(config).values
+            else:
+                # No paused run for this session (e.g. restored from the session store):
+                # answer the stored quiz instead of generating a new one.
+                result = answer_stored_quiz(graph, state, state.user_quiz_answers)
+            st.session_state.habit_state = state_from_result(result)
+            persist_state()
 
             st.success(
     f"Safety status: OK ✅  \n"
@@ -206,6 +302,18 @@ with col_right:
         st.markdown("#### 📋 Plan summary")
         st.write(plan.plan_summary)
 
+        # The coach only sees today's and neighbouring days, so keep "today" accurate.
+        current_day = current_plan_day(state) or 1
+        picked_day = st.number_input(
+            "Which plan day are you on?",
+            min_value=1,
+            max_value=21,
+            value=current_day,
+            key="current_day_input",
+        )
+        if picked_day != current_day:
+            state.current_day = int(picked_day)
+
         st.markdown("#### 📅 Daily tasks")
         # Nice table-like rendering
         for day_key in sorted(plan.day_tasks.keys(), key=lambda x: int(x.split("_")[1])):
@@ -239,8 +347,18 @@ with col_right:
                 st.warning("Please type a message for the coach.")
             else:
                 state.last_user_message = user_msg.strip()
-                coach_result = coach_node(state)
-                update_state(coach_result)
+                st.markdown(f"**You:** {state.last_user_message}")
+                st.markdown("**Coach:**")
+                # Tokens render as they arrive; chat_history is updated when the stream ends.
+                st.write_stream(stream_coach_node(state))
+                st.session_state.habit_state = state
+                persist_state()
+                # Fold older turns into the running summary now the reply is on screen.
+                summary_update = fold_coach_summary(state)
+                if summary_update:
+                    for key, value in summary_update.items():
+                        setattr(state, key, value)
+                    persist_state()
                 st.success(
     f"Safety status: OK ✅  \n"
     f"Risk classification: {state.safety.risk}"
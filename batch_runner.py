@@ -0,0 +1,252 @@
+# batch_runner.py
+"""
+Offline batch onboarding: habit descriptions in, quizzes (and optionally
+summaries + 21-day plans) out. Used for content QA and cache warming.
+
+Input is JSONL, one object per line:
+    {"id": "optional-id", "habit_description": "...", "answers": {...optional...}}
+Output is JSONL, one result per input id, appended chunk by chunk. Re-running
+with the same output file skips ids already written, so an interrupted run
+picks up where it stopped.
+
+Each stage runs for a whole chunk through the model's `abatch` with bounded
+concurrency, at "batch" priority in the shared rate limiter so live coach
+and onboarding calls go first; rate-limited calls are re-queued with
+backoff (see `ai_nodes._abatch_llm`). Point OPENAI_BASE_URL at a local fake server to
+run it without a real provider.
+
+    python batch_runner.py habits.jsonl results.jsonl [--plans] [--chunk-size 50] [--concurrency 8]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from ai_nodes import abatch_plan21, abatch_quiz_form, abatch_quiz_summary, abatch_safety
+from llm_clients import ClientRegistry, get_registry, use_registry
+from rate_limiter import llm_priority
+from schemas import HabitState, QuizForm
+
+BATCH_CHUNK_SIZE = int(os.getenv("UNHABIT_BATCH_CHUNK_SIZE", "50"))
+BATCH_CONCURRENCY = int(os.getenv("UNHABIT_BATCH_CONCURRENCY", "8"))
+
+# Plausible answers for plan sampling, picked by what the question asks.
+# First match wins: "where" goes before "when" ("Where are you when it happens?").
+SYNTHETIC_ANSWERS: List[Tuple[Tuple[str, ...], str]] = [
+    (("how often", "how many", "how much"), "Most days, around 6-10 times a day."),
+    (("where",), "At my desk and in bed before sleeping."),
+    (("what time", "times of day", "when"), "Mostly late evening and right after work."),
+    (("feel", "mood", "emotion"), "Usually stressed, bored or tired."),
+    (("trigger",), "Stress, boredom and having it within reach."),
+    (("tried", "before", "attempt"), "I tried quitting cold turkey once; it lasted three days."),
+    (("why", "motivat", "matter"), "I want more energy and to feel in control again."),
+    (("hardest", "difficult", "situation"), "Late at night when I'm alone."),
+]
+DEFAULT_SYNTHETIC_ANSWER = "It depends on the day, but it happens most days."
+
+
+def synthetic_answers(quiz_form: QuizForm) -> str:
+    """
+    Answer every quiz question with a canned, question-appropriate reply.
+    """
+    answers = {}
+    for question in quiz_form.questions:
+        text = question.question.lower()
+        answers[question.id] = next(
+            (answer for keywords, answer in SYNTHETIC_ANSWERS if any(k in text for k in keywords)),
+            DEFAULT_SYNTHETIC_ANSWER,
+        )
+    return json.dumps({"answers": answers}, ensure_ascii=False)
+
+
+# ---------- JSONL io ----------
+
+def read_items(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as fh:
+        for line_no, line in enumerate(fh, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if isinstance(item, str):
+                item = {"habit_description": item}
+            item.setdefault("id", f"line-{line_no}")
+            yield item
+
+
+def completed_ids(path: str) -> Set[str]:
+    """
+    Ids already present in the output file. A torn last line (killed mid-write) is ignored.
+    """
+    done: Set[str] = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            try:
+                done.add(str(json.loads(line)["id"]))
+            except (ValueError, KeyError, TypeError):
+                continue
+    return done
+
+
+def _trim_torn_tail(path: str) -> None:
+    # Drop a partial last line so new results don't get glued onto it.
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as fh:
+        data = fh.read()
+        if data and not data.endswith(b"\n"):
+            fh.truncate(data.rfind(b"\n") + 1)
+
+
+def _chunks(items: List[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    for start in range(0, len(items), max(1, size)):
+        yield items[start:start + size]
+
+
+def _dump(model: Any) -> Optional[Dict[str, Any]]:
+    return model.model_dump() if model is not None else None
+
+
+# ---------- Pipeline ----------
+
+def _apply(states: List[HabitState], updates: List[Dict[str, Any]]) -> None:
+    for state, update in zip(states, updates):
+        for key, value in update.items():
+            setattr(state, key, value)
+
+
+async def process_chunk(
+    items: List[Dict[str, Any]],
+    plans: bool = False,
+    max_concurrency: int = BATCH_CONCURRENCY,
+) -> List[Dict[str, Any]]:
+    """
+    safety -> quiz_form (-> quiz_summary -> plan21) for one chunk of input items.
+    """
+    states = [HabitState(habit_description=item.get("habit_description") or "") for item in items]
+
+    _apply(states, await abatch_safety(states, max_concurrency))
+    allowed = [s for s in states if not (s.safety and s.safety.action == "block_and_escalate")]
+
+    _apply(allowed, await abatch_quiz_form(allowed, max_concurrency))
+
+    if plans and allowed:
+        allowed_ids = {id(state) for state in allowed}
+        for item, state in zip(items, states):
+            if id(state) in allowed_ids:
+                answers = item.get("answers")
+                if isinstance(answers, dict):
+                    answers = json.dumps({"answers": answers}, ensure_ascii=False)
+                state.user_quiz_answers = answers or synthetic_answers(state.quiz_form)
+        _apply(allowed, await abatch_quiz_summary(allowed, max_concurrency))
+        _apply(allowed, await abatch_plan21(allowed, max_concurrency))
+
+    results = []
+    for item, state in zip(items, states):
+        result = {
+            "id": item["id"],
+            "habit_description": state.habit_description,
+            "safety": _dump(state.safety),
+            "quiz_form": _dump(state.quiz_form),
+        }
+        if plans:
+            result["user_quiz_answers"] = state.user_quiz_answers
+            result["quiz_summary"] = _dump(state.quiz_summary)
+            result["plan21"] = _dump(state.plan21)
+        results.append(result)
+    return results
+
+
+async def arun_batch(
+    input_path: str,
+    output_path: str,
+    plans: bool = False,
+    chunk_size: int = BATCH_CHUNK_SIZE,
+    max_concurrency: int = BATCH_CONCURRENCY,
+    log=sys.stderr,
+) -> Dict[str, Any]:
+    """
+    Process every input item not yet in output_path. Returns run stats.
+
+    Models come from a registry private to this run, closed at the end: the
+    shared async HTTP pool belongs to whichever loop used it first (the API
+    server's, or an earlier `run_batch`'s, already closed).
+    """
+    shared = get_registry()
+    registry = ClientRegistry(transport=shared.transport, async_transport=shared.async_transport)
+    try:
+        with use_registry(registry):
+            return await _arun_batch(input_path, output_path, plans, chunk_size, max_concurrency, log)
+    finally:
+        await registry.aclose()
+
+
+async def _arun_batch(
+    input_path: str,
+    output_path: str,
+    plans: bool,
+    chunk_size: int,
+    max_concurrency: int,
+    log,
+) -> Dict[str, Any]:
+    _trim_torn_tail(output_path)
+    done = completed_ids(output_path)
+    todo = [item for item in read_items(input_path) if str(item["id"]) not in done]
+
+    started = time.perf_counter()
+    written = 0
+    with open(output_path, "a", encoding="utf-8") as out:
+        for chunk in _chunks(todo, chunk_size):
+            for result in await process_chunk(chunk, plans=plans, max_concurrency=max_concurrency):
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            # Flushed per chunk: a crash loses at most the chunk in flight.
+            out.flush()
+            os.fsync(out.fileno())
+            written += len(chunk)
+
+            elapsed = time.perf_counter() - started
+            if log is not None:
+                print(
+                    f"[batch] {written}/{len(todo)} done "
+                    f"({written / elapsed if elapsed else 0.0:.1f} items/s, {len(done)} skipped)",
+                    file=log,
+                )
+
+    return {
+        "skipped": len(done),
+        "processed": written,
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def run_batch(input_path: str, output_path: str, **kwargs: Any) -> Dict[str, Any]:
+    with llm_priority("batch"):
+        return asyncio.run(arun_batch(input_path, output_path, **kwargs))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file of habit descriptions")
+    parser.add_argument("output", help="JSONL results file (appended; existing ids are skipped)")
+    parser.add_argument("--plans", action="store_true", help="also run quiz_summary + plan21 with synthetic answers")
+    parser.add_argument("--chunk-size", type=int, default=BATCH_CHUNK_SIZE)
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    args = parser.parse_args(argv)
+
+    stats = run_batch(
+        args.input,
+        args.output,
+        plans=args.plans,
+        chunk_size=args.chunk_size,
+        max_concurrency=args.concurrency,
+    )
+    print(json.dumps(stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+# benchmarks/bench_canonicalize.py
+"""
+Accuracy and per-call latency of the local habit canonicalizer.
+
+Generates synthetic habit descriptions from the slang dictionary: each
+entry in a sentence frame, with case changes, leetspeak, and one- or
+two-character typos (drop, swap, double, replace), plus descriptions of
+habits the dictionary does not know. Reports how many would be answered
+locally, how accurate those answers are per confidence level, and how
+many unknown habits were wrongly claimed.
+
+    python benchmarks/bench_canonicalize.py [--variants 3000] [--seed 7] [--json]
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import string
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import habit_canonicalizer  # noqa: E402
+from habit_canonicalizer import CONFIDENCE_LEVELS, MIN_CONFIDENCE, canonicalize  # noqa: E402
+from habit_lexicon import SLANG_TO_CATEGORY  # noqa: E402
+
+FRAMES = [
+    "{}",
+    "I {} too much",
+    "I use {} all day",
+    "addicted to {}",
+    "{} every night before bed",
+    "how do I stop the {}",
+    "cant quit {} lol",
+    "my {} problem is getting worse",
+]
+LEET = {"o": "0", "i": "1", "e": "3", "a": "4", "s": "5", "t": "7"}
+UNKNOWN = [
+    "I bite my nails", "I crack my knuckles", "I pick my skin", "I hit snooze every morning",
+    "I interrupt people", "I grind my teeth", "I check the fridge when bored", "I talk negatively to myself",
+    "I stay up too late", "I spend hours reading news", "I chew my pens", "I skip the gym",
+]
+
+
+def _typo(word: str, rng: random.Random) -> str:
+    if len(word) < 4:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    kind = rng.choice(("drop", "swap", "double", "replace"))
+    if kind == "drop":
+        return word[:i] + word[i + 1:]
+    if kind == "swap":
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    if kind == "double":
+        return word[:i] + word[i] + word[i:]
+    return word[:i] + rng.choice(string.ascii_lowercase) + word[i + 1:]
+
+
+def _variant(slang: str, rng: random.Random) -> Tuple[str, str]:
+    """
+    (variant text, kind) for one slang entry.
+    """
+    kind = rng.choice(("exact", "case", "leet", "typo", "typo2"))
+    text = slang
+    if kind == "case":
+        text = rng.choice((slang.upper(), slang.title(), slang.capitalize()))
+    elif kind == "leet":
+        text = "".join(LEET.get(ch, ch) if rng.random() < 0.5 else ch for ch in slang)
+    elif kind == "typo":
+        text = _typo(slang, rng)
+    elif kind == "typo2":
+        text = _typo(_typo(slang, rng), rng)
+    return rng.choice(FRAMES).format(text), kind
+
+
+def corpus(variants: int, seed: int) -> List[Tuple[str, Optional[str], str]]:
+    """
+    (text, expected category or None, variant kind).
+    """
+    rng = random.Random(seed)
+    entries = sorted(SLANG_TO_CATEGORY.items())
+    rows: List[Tuple[str, Optional[str], str]] = []
+    for _ in range(variants):
+        slang, category = rng.choice(entries)
+        text, kind = _variant(slang, rng)
+        rows.append((text, category, kind))
+    rows += [(text, None, "unknown") for text in UNKNOWN]
+    return rows
+
+
+def run(variants: int, seed: int) -> Dict[str, Any]:
+    rows = corpus(variants, seed)
+    min_level = CONFIDENCE_LEVELS.index(MIN_CONFIDENCE)
+    by_confidence: Dict[str, Dict[str, int]] = {}
+    by_kind: Dict[str, Dict[str, int]] = {}
+    timings: List[float] = []
+    local = correct_local = false_claims = 0
+    mistakes: List[str] = []
+
+    habit_canonicalizer.fuzzy_match.cache_clear()
+    for text, expected, kind in rows:
+        started = time.perf_counter()
+        result = canonicalize(text)
+        timings.append(time.perf_counter() - started)
+
+        confidence = result["confidence"] if result else "none"
+        accepted = result is not None and CONFIDENCE_LEVELS.index(confidence) >= min_level
+        right = result is not None and result["habit_category"] == expected
+
+        bucket = by_confidence.setdefault(confidence, {"total": 0, "correct": 0})
+        bucket["total"] += 1
+        bucket["correct"] += right
+        kind_bucket = by_kind.setdefault(kind, {"total": 0, "local": 0, "local_correct": 0})
+        kind_bucket["total"] += 1
+        if accepted:
+            local += 1
+            correct_local += right
+            kind_bucket["local"] += 1
+            kind_bucket["local_correct"] += right
+            if expected is None:
+                false_claims += 1
+            if not right and len(mistakes) < 10:
+                mistakes.append(f"{text!r} -> {result['habit_category']} (expected {expected})")
+
+    ordered = sorted(timings)
+    return {
+        "texts": len(rows),
+        "min_confidence": MIN_CONFIDENCE,
+        "local_share": round(local / len(rows), 3),
+        "local_accuracy": round(correct_local / local, 4) if local else None,
+        "unknown_claimed": false_claims,
+        "by_confidence": by_confidence,
+        "by_kind": by_kind,
+        "us_per_call": {
+            "p50": round(ordered[len(ordered) // 2] * 1e6, 2),
+            "p95": round(ordered[int(0.95 * len(ordered))] * 1e6, 2),
+            "mean": round(statistics.fmean(ordered) * 1e6, 2),
+        },
+        "sample_mistakes": mistakes,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--variants", type=int, default=3000, help="synthetic variants of known slang")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", action="store_true", help="print JSON instead of a summary")
+    args = parser.parse_args()
+
+    result = run(args.variants, args.seed)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+
+    print(f"texts: {result['texts']}  (local at >= {result['min_confidence']} confidence)")
+    print(f"answered locally: {result['local_share']:.1%}  accuracy: {result['local_accuracy']:.2%}  "
+          f"unknown habits claimed: {result['unknown_claimed']}")
+    print(f"\n{'confidence':<12} {'total':>7} {'correct':>8}")
+    for confidence in ("high", "medium", "low", "none"):
+        bucket = result["by_confidence"].get(confidence, {"total": 0, "correct": 0})
+        print(f"{confidence:<12} {bucket['total']:>7} {bucket['correct']:>8}")
+    print(f"\n{'variant':<12} {'total':>7} {'local':>7} {'correct':>8}")
+    for kind, bucket in sorted(result["by_kind"].items()):
+        print(f"{kind:<12} {bucket['total']:>7} {bucket['local']:>7} {bucket['local_correct']:>8}")
+    latency = result["us_per_call"]
+    print(f"\nper call: p50 {latency['p50']} µs, p95 {latency['p95']} µs, mean {latency['mean']} µs")
+    for mistake in result["sample_mistakes"]:
+        print(f"  ! {mistake}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# benchmarks/bench_coach_context.py
+"""
+Prompt-token growth of coach turns: full history vs bounded context.
+
+Runs a synthetic 100-turn conversation offline (no LLM calls; older turns are
+folded with the deterministic extractive summarizer) and prints prompt tokens
+per turn for both layouts plus the session totals.
+
+    python benchmarks/bench_coach_context.py [--turns 100]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from coach_context import (  # noqa: E402
+    count_tokens,
+    extractive_summary,
+    format_messages,
+    pending_fold,
+    render_coach_prompt,
+)
+from prompts import COACH_PROMPT  # noqa: E402
+from schemas import HabitState, Plan21D, QuizSummary  # noqa: E402
+
+USER_LINES = [
+    "I slipped on day {day} after dinner, what should I change?",
+    "The urge was really strong around 11pm again when I was alone in my room.",
+    "I managed to delay it for 10 minutes today but then gave in.",
+    "Work stress made it harder today, I used more than usual.",
+    "Can I swap the day {day} task for something easier this week?",
+    "I felt proud that I kept the phone outside the bedroom last night.",
+]
+
+COACH_LINES = [
+    "That slip is useful data. Tonight, put the trigger out of reach before dinner ends "
+    "and plan a 5-minute walk for the moment the urge usually peaks.",
+    "Ten minutes of delay is real progress. Tomorrow aim for twelve, and pair the delay "
+    "with the breathing pattern from your plan so the wait has something to do.",
+    "Keep the original direction but shrink the step: do only the first half of the task "
+    "today and note what made it hard, so we can adjust the next one.",
+]
+
+
+def _state() -> HabitState:
+    summary = QuizSummary(
+        user_habit_raw="I use zyn all day",
+        canonical_habit_name="nicotine pouches (Zyn)",
+        habit_category="nicotine_oral",
+        category_confidence="high",
+        product_type="Zyn pouches",
+        severity_level="moderate",
+        main_trigger="stress at work and boredom in the evening",
+        peak_times="mid-morning and after 9pm",
+        common_locations="desk at work, couch, car",
+        emotional_patterns="stress, boredom, restlessness",
+        frequency_pattern="8-12 pouches per day",
+        previous_attempts="cold turkey twice, lasted 3 days",
+        motivation_reason="health and saving money",
+        risk_situations="long drives and deadline days",
+    )
+    plan = Plan21D(
+        plan_summary="21-day plan to reduce Zyn use through friction, replacement and identity work.",
+        day_tasks={
+            f"day_{i}": f"Day {i}: keep pouches in the car glovebox and log each urge with its trigger."
+            for i in range(1, 22)
+        },
+    )
+    return HabitState(habit_description="I use zyn all day", quiz_summary=summary, plan21=plan)
+
+
+def _naive_prompt(state: HabitState) -> str:
+    # The pre-bounded layout: full history every turn.
+    base = COACH_PROMPT + "\n\n"
+    base += f"quiz_summary_json:\n{json.dumps(state.quiz_summary.model_dump(), ensure_ascii=False)}\n\n"
+    base += f"plan_21d_json:\n{json.dumps(state.plan21.model_dump(), ensure_ascii=False)}\n\n"
+    base += f"history_text:\n{format_messages(state.chat_history)}\n\n"
+    base += f"user_message:\n{state.last_user_message}\n"
+    return base
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--turns", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    state = _state()
+    naive_total = bounded_total = 0
+
+    print(f"{'turn':>5} {'naive_tokens':>13} {'bounded_tokens':>15} {'verbatim_msgs':>14}")
+    for turn in range(1, args.turns + 1):
+        state.last_user_message = rng.choice(USER_LINES).format(day=rng.randint(1, 21))
+
+        naive = count_tokens(_naive_prompt(state))
+
+        messages, upto = pending_fold(state)
+        if messages:
+            state.chat_summary = extractive_summary(state.chat_summary, messages)
+            state.chat_summary_upto = upto
+        bounded = count_tokens(render_coach_prompt(state, state.chat_summary, state.chat_summary_upto))
+
+        naive_total += naive
+        bounded_total += bounded
+        if turn == 1 or turn % 10 == 0:
+            verbatim = len(state.chat_history) - state.chat_summary_upto
+            print(f"{turn:>5} {naive:>13} {bounded:>15} {verbatim:>14}")
+
+        state.chat_history = state.chat_history + [
+            {"role": "user", "content": state.last_user_message},
+            {"role": "assistant", "content": rng.choice(COACH_LINES)},
+        ]
+
+    print()
+    print(f"session prompt tokens  naive={naive_total}  bounded={bounded_total}  "
+          f"saved={1 - bounded_total / naive_total:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+# benchmarks/bench_pipeline.py
+"""
+End-to-end throughput, per-node latency and memory of the onboarding
+pipeline against the deterministic fake LLM (benchmarks/fake_llm.py).
+
+Scenarios:
+- graph:    sequential onboarding runs through the sync graph.
+- sessions: N concurrent sessions (async graph + coach turns).
+- memory:   the sessions scenario again under tracemalloc: peak memory and
+            what each finished session keeps alive.
+
+With the default zero latency the numbers are pure pipeline overhead
+(prompt building, SDK parsing, limiter, retries, graph, instrumentation).
+Caches are off unless --cache, so every session reaches the fake model.
+Save results with --json and compare a later run with --baseline.
+
+    python benchmarks/bench_pipeline.py [--runs 20] [--sessions 50] [--concurrency 10]
+        [--turns 2] [--latency "default=fixed:0.05,plan21=lognormal:0.5:0.3"]
+        [--speculative] [--json out.json] [--baseline old.json]
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_llm import install_fake_llm  # noqa: E402
+import instrumentation  # noqa: E402
+from ai_nodes import acoach_node  # noqa: E402
+from graphs import build_onboarding_graph, state_from_result  # noqa: E402
+from quiz_cache import set_quiz_form_cache  # noqa: E402
+from response_cache import set_response_cache  # noqa: E402
+from schemas import HabitState  # noqa: E402
+
+HABITS = [
+    "I use zyn all day, especially at work",
+    "I scroll tiktok in bed until 2am",
+    "I vape whenever I'm stressed",
+    "I drink too much coffee, like 6 cups",
+    "I bite my nails during meetings",
+    "I binge youtube instead of studying",
+]
+ANSWERS = json.dumps({"answers": {f"q{i}": "Most days, mostly in the evening." for i in range(1, 9)}})
+COACH_MESSAGES = ["I slipped last night after dinner.", "What should I focus on today?"]
+
+
+def _state(i: int) -> HabitState:
+    # Distinct text per session so no cache could serve it even if enabled.
+    return HabitState(
+        user_id=f"bench-{i}",
+        habit_description=f"{HABITS[i % len(HABITS)]} (session {i})",
+        user_quiz_answers=ANSWERS,
+    )
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]  # noqa: E731
+    return {
+        "p50_ms": round(pick(0.5) * 1000, 2),
+        "p95_ms": round(pick(0.95) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 2),
+    }
+
+
+def _node_latencies() -> Dict[str, Dict[str, float]]:
+    return {
+        node: {
+            "runs": stats["runs"],
+            "p50_ms": round(stats["p50_seconds"] * 1000, 2),
+            "p95_ms": round(stats["p95_seconds"] * 1000, 2),
+            "llm_calls": stats["llm_calls"],
+            "fallbacks": stats["fallbacks"],
+        }
+        for node, stats in instrumentation.summary().items()
+    }
+
+
+# ---------- Scenarios ----------
+
+def bench_graph(runs: int, speculative: bool, transport) -> Dict[str, Any]:
+    graph = build_onboarding_graph(speculative=speculative)
+    graph.invoke(_state(-1))  # warm-up: imports, client construction, first compile paths
+    instrumentation.reset()
+    simulated_before = transport.simulated_seconds
+
+    durations = []
+    started = time.perf_counter()
+    for i in range(runs):
+        t0 = time.perf_counter()
+        state_from_result(graph.invoke(_state(i)))
+        durations.append(time.perf_counter() - t0)
+    wall = time.perf_counter() - started
+
+    result = {
+        "runs": runs,
+        "runs_per_s": round(runs / wall, 2),
+        "latency": _percentiles(durations),
+        "nodes": _node_latencies(),
+    }
+    if not speculative:
+        # Calls are strictly sequential here, so the rest of the wall time is ours.
+        simulated = transport.simulated_seconds - simulated_before
+        result["overhead_ms_per_run"] = round((wall - simulated) / runs * 1000, 2)
+    return result
+
+
+async def _session(graph, i: int, turns: int) -> HabitState:
+    state = state_from_result(await graph.ainvoke(_state(i)))
+    for message in COACH_MESSAGES[:turns]:
+        state.last_user_message = message
+        for key, value in (await acoach_node(state)).items():
+            setattr(state, key, value)
+    return state
+
+
+async def _run_sessions(graph, sessions: int, concurrency: int, turns: int, offset: int):
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    durations: List[float] = []
+
+    async def one(i: int) -> HabitState:
+        async with semaphore:
+            t0 = time.perf_counter()
+            state = await _session(graph, offset + i, turns)
+            durations.append(time.perf_counter() - t0)
+            return state
+
+    started = time.perf_counter()
+    states = await asyncio.gather(*(one(i) for i in range(sessions)))
+    return states, durations, time.perf_counter() - started
+
+
+async def bench_sessions(sessions: int, concurrency: int, turns: int, speculative: bool) -> Dict[str, Any]:
+    graph = build_onboarding_graph(async_nodes=True, speculative=speculative)
+    await _session(graph, -2, turns)  # warm-up
+    instrumentation.reset()
+
+    states, durations, wall = await _run_sessions(graph, sessions, concurrency, turns, offset=0)
+    return {
+        "sessions": sessions,
+        "concurrency": concurrency,
+        "coach_turns": turns,
+        "sessions_per_s": round(sessions / wall, 2),
+        "latency": _percentiles(durations),
+        "nodes": _node_latencies(),
+        "completed": sum(1 for s in states if s.plan21 is not None),
+    }
+
+
+async def bench_memory(sessions: int, concurrency: int, turns: int, speculative: bool) -> Dict[str, Any]:
+    graph = build_onboarding_graph(async_nodes=True, speculative=speculative)
+    await _session(graph, -3, turns)  # warm-up so one-off allocations aren't counted
+    gc.collect()
+
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    states, _, _ = await _run_sessions(graph, sessions, concurrency, turns, offset=100_000)
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "sessions": len(states),
+        "peak_kib": round((peak - baseline) / 1024, 1),
+        "retained_kib": round((retained - baseline) / 1024, 1),
+        "retained_kib_per_session": round((retained - baseline) / 1024 / max(1, len(states)), 2),
+    }
+
+
+# ---------- Reporting ----------
+
+def _flatten(prefix: str, value: Any, out: Dict[str, float]) -> None:
+    if isinstance(value, dict):
+        for key, inner in value.items():
+            _flatten(f"{prefix}.{key}" if prefix else key, inner, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = value
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]) -> None:
+    now, before = {}, {}
+    _flatten("", current["results"], now)
+    _flatten("", baseline["results"], before)
+    print(f"\n{'metric':<48} {'baseline':>12} {'current':>12} {'change':>9}")
+    for key in sorted(now.keys() & before.keys()):
+        old, new = before[key], now[key]
+        change = f"{(new - old) / old:+.1%}" if old else "n/a"
+        print(f"{key:<48} {old:>12} {new:>12} {change:>9}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20, help="sequential graph runs")
+    parser.add_argument("--sessions", type=int, default=50, help="concurrent sessions")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=2, help="coach turns per session (0-2)")
+    parser.add_argument("--latency", default="fixed:0", help="fake LLM latency spec (see fake_llm.py)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--speculative", action="store_true", help="run safety and quiz_form in parallel")
+    parser.add_argument("--cache", action="store_true", help="keep the response/quiz caches on")
+    parser.add_argument("--scenarios", default="graph,sessions,memory")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="compare against an earlier --json file")
+    args = parser.parse_args()
+
+    transport = install_fake_llm(args.latency, seed=args.seed)
+    if not args.cache:
+        set_response_cache(None)
+        set_quiz_form_cache(None)
+
+    scenarios = {s.strip() for s in args.scenarios.split(",") if s.strip()}
+    results: Dict[str, Any] = {}
+    if "graph" in scenarios:
+        results["graph"] = bench_graph(args.runs, args.speculative, transport)
+
+    async def run_async() -> None:
+        # One event loop for every async scenario: pooled async clients bind to it.
+        if "sessions" in scenarios:
+            results["sessions"] = await bench_sessions(args.sessions, args.concurrency, args.turns, args.speculative)
+        if "memory" in scenarios:
+            results["memory"] = await bench_memory(args.sessions, args.concurrency, args.turns, args.speculative)
+
+    asyncio.run(run_async())
+
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("json", "baseline")},
+        "results": results,
+        "fake_llm": transport.stats(),
+    }
+    print(json.dumps(report, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fh:
+            compare(report, json.load(fh))
+
+
+if __name__ == "__main__":
+    main()
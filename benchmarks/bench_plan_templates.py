@@ -0,0 +1,104 @@
+# benchmarks/bench_plan_templates.py
+"""
+Per-plan cost and constraint coverage of the local template plan engine.
+
+Composes a plan for every habit category the quiz summarizer can emit,
+from the canned summary (and from one with every optional field empty),
+and checks each against its category's "Must include" counts: every
+required task present, 21 non-empty days, no unfilled "{field}". Reports
+the time per plan with a cold and a warm cache.
+
+    python benchmarks/bench_plan_templates.py [--repeat 2000] [--json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import plan_templates  # noqa: E402
+from benchmarks.fake_llm import CANNED_QUIZ_SUMMARY  # noqa: E402
+from category_guidance import summarizer_categories  # noqa: E402
+from plan_templates import PLAN_TEMPLATES, TASK_FIELDS, URGE_DELAY_MINUTES, task_values, template_plan21  # noqa: E402
+from schemas import QuizSummary  # noqa: E402
+
+EMPTY_FIELDS = ("product_type", "main_trigger", "peak_times", "common_locations", "emotional_patterns",
+                "motivation_reason", "risk_situations")
+
+
+def _summaries(category: str) -> List[QuizSummary]:
+    full = QuizSummary(**dict(CANNED_QUIZ_SUMMARY, habit_category=category))
+    sparse = QuizSummary(**dict(CANNED_QUIZ_SUMMARY, habit_category=category, **dict.fromkeys(EMPTY_FIELDS, "")))
+    return [full, sparse]
+
+
+def _problems(category: str, summary: QuizSummary) -> List[str]:
+    plan = template_plan21(summary)
+    problems = []
+    if sorted(plan.day_tasks) != sorted(f"day_{i}" for i in range(1, 22)):
+        problems.append("wrong days")
+    texts = list(plan.day_tasks.values())
+    if not all(text.strip() for text in texts):
+        problems.append("empty task")
+    if any("{" in text or "}" in text for text in texts + [plan.plan_summary]):
+        problems.append("unfilled field")
+
+    mapping = dict(zip(TASK_FIELDS, task_values(summary)))
+    mapping["delay"] = URGE_DELAY_MINUTES.get(mapping["severity"], URGE_DELAY_MINUTES["moderate"])
+    task_set = next(kinds for categories, _, kinds in PLAN_TEMPLATES if category in categories)
+    for kind, minimum, templates in task_set:
+        present = sum(1 for template in templates if template.format(**mapping) in texts)
+        if present < minimum:
+            problems.append(f"{kind}: {present}/{minimum}")
+    return problems
+
+
+def run(repeat: int) -> Dict[str, Any]:
+    categories = summarizer_categories()
+    coverage: Dict[str, List[str]] = {}
+    for category in categories:
+        for summary in _summaries(category):
+            coverage.setdefault(category, []).extend(_problems(category, summary))
+
+    summaries = [s for category in categories for s in _summaries(category)]
+    started = time.perf_counter()
+    for i in range(repeat):
+        plan_templates._compose.cache_clear()
+        template_plan21(summaries[i % len(summaries)])
+    cold = (time.perf_counter() - started) / repeat
+
+    started = time.perf_counter()
+    for i in range(repeat):
+        template_plan21(summaries[i % len(summaries)])
+    warm = (time.perf_counter() - started) / repeat
+
+    return {
+        "categories": len(categories),
+        "problems": {category: problems for category, problems in coverage.items() if problems},
+        "us_per_plan": {"cold": round(cold * 1e6, 2), "warm": round(warm * 1e6, 2)},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=2000, help="plans composed per timing pass")
+    parser.add_argument("--json", action="store_true", help="print JSON instead of a summary")
+    args = parser.parse_args()
+
+    result = run(args.repeat)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+
+    print(f"categories: {result['categories']}  with problems: {len(result['problems'])}")
+    for category, problems in result["problems"].items():
+        print(f"  ! {category}: {', '.join(problems)}")
+    latency = result["us_per_plan"]
+    print(f"per plan: {latency['cold']} µs cold, {latency['warm']} µs cached")
+
+
+if __name__ == "__main__":
+    main()
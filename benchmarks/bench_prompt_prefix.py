@@ -0,0 +1,143 @@
+# benchmarks/bench_prompt_prefix.py
+"""
+Cacheable prompt prefix per node.
+
+Builds each node's messages for two different users and reports how many
+leading tokens they share, i.e. what provider-side prompt caching can reuse
+across users. For the coach it also compares two consecutive turns of one
+user. OpenAI only caches prompts of 1024+ tokens, in 128-token steps; the
+"cached" column applies that rule.
+
+    python benchmarks/bench_prompt_prefix.py [--json]
+"""
+import argparse
+import json
+import os
+import sys
+from typing import Any, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.messages import BaseMessage  # noqa: E402
+
+from ai_nodes import _coach_prompt, _plan21_prompt, _quiz_summary_prompt, _summary_prompt  # noqa: E402
+from benchmarks.fake_llm import CANNED_PLAN21, CANNED_QUIZ_FORM, CANNED_QUIZ_SUMMARY  # noqa: E402
+from coach_context import _encoding, count_tokens  # noqa: E402
+from prompts import CANONICALIZE_MESSAGES, QUIZ_GENERATOR_MESSAGES, SAFETY_MESSAGES  # noqa: E402
+from schemas import HabitState, Plan21D, QuizForm, QuizSummary  # noqa: E402
+
+MIN_CACHED_TOKENS = 1024
+CACHE_STEP_TOKENS = 128
+
+
+def _users() -> Tuple[HabitState, HabitState]:
+    first = HabitState(
+        habit_description="I use zyn all day, especially at work",
+        quiz_form=QuizForm(**CANNED_QUIZ_FORM),
+        user_quiz_answers=json.dumps({"answers": {"q1": "8-12 a day", "q2": "mornings"}}),
+        quiz_summary=QuizSummary(**CANNED_QUIZ_SUMMARY),
+        plan21=Plan21D(**CANNED_PLAN21),
+        plan_started_at="2026-01-01",
+        current_day=4,
+        last_user_message="I slipped last night after dinner.",
+        chat_history=[
+            {"role": "user", "content": "Day 3 went fine."},
+            {"role": "assistant", "content": "Great, keep the pouches in the car."},
+        ],
+    )
+    summary = dict(CANNED_QUIZ_SUMMARY, user_habit_raw="I scroll tiktok in bed", canonical_habit_name="social media",
+                   habit_category="social_media", product_type="TikTok", main_trigger="boredom at night")
+    second = HabitState(
+        habit_description="I scroll tiktok in bed until 2am",
+        quiz_form=QuizForm(**dict(CANNED_QUIZ_FORM, habit_name_guess="tiktok scrolling")),
+        user_quiz_answers=json.dumps({"answers": {"q1": "3 hours a night", "q2": "after 11pm"}}),
+        quiz_summary=QuizSummary(**summary),
+        plan21=Plan21D(**CANNED_PLAN21),
+        plan_started_at="2026-01-01",
+        current_day=9,
+        last_user_message="Can I swap today's task?",
+    )
+    return first, second
+
+
+def _tokens(messages: List[BaseMessage]) -> List[Any]:
+    # What the provider tokenizes, in order: each message's role, then its content.
+    text = "".join(f"<|{m.type}|>{m.content}<|end|>" for m in messages)
+    if _encoding is not None:
+        return _encoding.encode(text)
+    return list(text)  # ~4 chars/token; the report divides by 4 below
+
+
+def _shared_prefix(a: List[BaseMessage], b: List[BaseMessage]) -> Tuple[int, int]:
+    ta, tb = _tokens(a), _tokens(b)
+    shared = 0
+    for x, y in zip(ta, tb):
+        if x != y:
+            break
+        shared += 1
+    if _encoding is None:
+        return (shared + 3) // 4, (len(ta) + 3) // 4
+    return shared, len(ta)
+
+
+def cached_tokens(prefix: int) -> int:
+    if prefix < MIN_CACHED_TOKENS:
+        return 0
+    return MIN_CACHED_TOKENS + (prefix - MIN_CACHED_TOKENS) // CACHE_STEP_TOKENS * CACHE_STEP_TOKENS
+
+
+def report() -> List[Dict[str, Any]]:
+    a, b = _users()
+    pairs = {
+        "safety": [SAFETY_MESSAGES.format_messages(user_text=s.habit_description) for s in (a, b)],
+        "canonicalize": [CANONICALIZE_MESSAGES.format_messages(user_habit_raw=s.habit_description) for s in (a, b)],
+        "quiz_form": [QUIZ_GENERATOR_MESSAGES.format_messages(habit_description=s.habit_description) for s in (a, b)],
+        "quiz_summary": [_quiz_summary_prompt(s) for s in (a, b)],
+        "plan21": [_plan21_prompt(s.quiz_summary) for s in (a, b)],
+        "chat_summary": [_summary_prompt(None, s.chat_history or [{"role": "user", "content": "hi"}]) for s in (a, b)],
+        "coach": [_coach_prompt(s, None, 0) for s in (a, b)],
+    }
+
+    # Same user, next turn: history grew by one exchange and the message changed.
+    next_turn = a.model_copy(deep=True)
+    next_turn.chat_history = a.chat_history + [
+        {"role": "user", "content": a.last_user_message},
+        {"role": "assistant", "content": "Slips are data. Tonight, pouches go in the car."},
+    ]
+    next_turn.last_user_message = "Today felt easier."
+    pairs["coach (same user, next turn)"] = [_coach_prompt(a, None, 0), _coach_prompt(next_turn, None, 0)]
+
+    rows = []
+    for node, (first, second) in pairs.items():
+        prefix, total = _shared_prefix(first, second)
+        rows.append({
+            "node": node,
+            "total_tokens": total,
+            "prefix_tokens": prefix,
+            "prefix_share": round(prefix / total, 3) if total else 0.0,
+            "cached_tokens": cached_tokens(prefix),
+            "system_tokens": count_tokens(first[0].content),
+        })
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--json", action="store_true", help="print JSON instead of a table")
+    args = parser.parse_args()
+
+    rows = report()
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+
+    print(f"{'node':<30} {'total':>7} {'prefix':>7} {'share':>7} {'cached':>7}")
+    for row in rows:
+        print(f"{row['node']:<30} {row['total_tokens']:>7} {row['prefix_tokens']:>7} "
+              f"{row['prefix_share']:>7.1%} {row['cached_tokens']:>7}")
+    if _encoding is None:
+        print("\n(tiktoken unavailable: token counts are ~4 chars/token estimates)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# benchmarks/bench_quiz_cache.py
+"""
+Hit and wrong-hit rates of the QuizForm similarity cache.
+
+Stores a quiz for one description, then looks up another: pairs that name
+the same product must hit, pairs that name a different product (or a
+different habit) must miss. Reports both, every wrong hit (must be 0), and
+the lookup latency.
+
+    python benchmarks/bench_quiz_cache.py [--json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_llm import CANNED_QUIZ_FORM  # noqa: E402
+from quiz_cache import QuizFormSimilarityCache  # noqa: E402
+from schemas import QuizForm  # noqa: E402
+
+# (stored, looked up): same product, worded differently.
+SAME = [
+    ("zyn", "Zyn pouches"),
+    ("I use zyn all day", "zyn too much"),
+    ("nicotine pouches all day", "nic pouches"),
+    ("tiktok", "I scroll tiktok too much"),
+    ("tik tok", "TikTok"),
+    ("I smoke cigarettes", "cigs every day"),
+    ("I smoke weed", "weed every night"),
+    ("I drink beer every night", "too much beer"),
+    ("my vape", "vaping all day"),
+    ("p0rn", "porn"),
+]
+# (stored, looked up): a different product or habit; the stored quiz would name the wrong one.
+DIFFERENT = [
+    ("tiktok", "I use instagram too much"),
+    ("tiktok", "twitter"),
+    ("I scroll tiktok too much", "I scroll instagram too much"),
+    ("youtube shorts", "instagram reels"),
+    ("cigarettes", "I smoke weed"),
+    ("I smoke", "I smoke weed"),
+    ("I smoke", "I smoke meth"),
+    ("I smoke meth", "I smoke"),
+    ("I smoke cigarettes", "I smoke crack"),
+    ("drinking alcohol", "drinking coffee"),
+    ("drinking beer every night", "drinking soda every night"),
+    ("I drink beer every night", "I drink wine every night"),
+    ("zyn", "snus"),
+    ("zyn", "nicotine pouches"),
+    ("my juul", "elf bar"),
+    ("sports betting", "online shopping"),
+    ("fortnite", "tiktok"),
+]
+
+
+def _quiz(description: str) -> QuizForm:
+    return QuizForm(**dict(CANNED_QUIZ_FORM, habit_name_guess=description))
+
+
+def _lookup(stored: str, looked_up: str) -> Tuple[bool, float]:
+    cache = QuizFormSimilarityCache()
+    cache.put(stored, _quiz(stored))
+    started = time.perf_counter()
+    hit = cache.get(looked_up) is not None
+    return hit, time.perf_counter() - started
+
+
+def run() -> Dict[str, Any]:
+    timings: List[float] = []
+    missed: List[str] = []
+    wrong_hits: List[str] = []
+    for stored, looked_up in SAME:
+        hit, elapsed = _lookup(stored, looked_up)
+        timings.append(elapsed)
+        if not hit:
+            missed.append(f"{stored!r} -> {looked_up!r}")
+    for stored, looked_up in DIFFERENT:
+        hit, elapsed = _lookup(stored, looked_up)
+        timings.append(elapsed)
+        if hit:
+            wrong_hits.append(f"{stored!r} -> {looked_up!r}")
+
+    return {
+        "same_pairs": len(SAME),
+        "same_hit_share": round(1 - len(missed) / len(SAME), 3),
+        "different_pairs": len(DIFFERENT),
+        "wrong_hits": wrong_hits,
+        "missed": missed,
+        "us_per_lookup": round(sum(timings) / len(timings) * 1e6, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--json", action="store_true", help="print JSON instead of a summary")
+    args = parser.parse_args()
+
+    result = run()
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+
+    print(f"same product: {result['same_hit_share']:.0%} of {result['same_pairs']} pairs hit")
+    for pair in result["missed"]:
+        print(f"  - missed {pair}")
+    print(f"different product: {len(result['wrong_hits'])} wrong hits of {result['different_pairs']} pairs")
+    for pair in result["wrong_hits"]:
+        print(f"  ! {pair}")
+    print(f"per lookup: {result['us_per_lookup']} µs")
+
+
+if __name__ == "__main__":
+    main()
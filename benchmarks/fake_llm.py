@@ -0,0 +1,256 @@
+# benchmarks/fake_llm.py
+"""
+Deterministic in-process fake of the OpenAI chat completions API.
+
+Installed as the httpx transport of a fresh client registry, so the real
+ChatOpenAI / structured-output / rate-limiter / retry / instrumentation
+stack runs on every call and only the network and the model are replaced.
+Replies are canned per output kind (SafetyResult, QuizForm, QuizSummary,
+the Plan21D JSON, canonicalization, coach text, streamed or not) and each
+call sleeps for a latency drawn from a seeded distribution.
+
+Latency specs (seconds):
+    fixed:0.2           always 0.2 (a bare number works too)
+    uniform:0.1:0.5
+    normal:0.4:0.1      mean, stddev (clamped at 0)
+    lognormal:0.4:0.5   median, sigma
+
+Per-kind specs: "default=fixed:0.05,plan21=lognormal:1.5:0.3"; kinds are
+safety, quiz_form, quiz_summary, plan21, canonicalize, coach.
+
+    from benchmarks.fake_llm import install_fake_llm
+    install_fake_llm("default=fixed:0.05,plan21=fixed:0.5", seed=1)
+"""
+import asyncio
+import json
+import math
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import httpx
+
+from coach_context import count_tokens
+from llm_clients import ClientRegistry, set_registry
+
+KINDS = ("safety", "quiz_form", "quiz_summary", "plan21", "canonicalize", "coach")
+
+CANNED_SAFETY = {"risk": "none", "action": "allow", "message": ""}
+CANNED_QUIZ_FORM = {
+    "habit_name_guess": "nicotine pouches",
+    "questions": [
+        {"id": f"q{i}", "question": question, "helper_text": None}
+        for i, question in enumerate(
+            [
+                "How many times a day does it happen?",
+                "What times of day are the hardest?",
+                "Where are you usually when it happens?",
+                "How do you feel right before?",
+                "What usually triggers it?",
+                "What have you tried before?",
+                "Why does changing this matter to you?",
+                "Which situation is the most difficult?",
+            ],
+            start=1,
+        )
+    ],
+}
+CANNED_QUIZ_SUMMARY = {
+    "user_habit_raw": "I use zyn all day",
+    "canonical_habit_name": "nicotine pouches (Zyn)",
+    "habit_category": "nicotine_oral",
+    "category_confidence": "high",
+    "product_type": "Zyn pouches",
+    "severity_level": "moderate",
+    "main_trigger": "stress at work",
+    "peak_times": "mid-morning and late evening",
+    "common_locations": "desk, car",
+    "emotional_patterns": "stress, boredom",
+    "frequency_pattern": "8-12 pouches per day",
+    "previous_attempts": "cold turkey once, three days",
+    "motivation_reason": "energy and feeling in control",
+    "risk_situations": "deadlines, driving",
+}
+CANNED_PLAN21 = {
+    "plan_summary": "A 21-day plan to cut nicotine pouches by adding friction around work stress.",
+    "day_tasks": {f"day_{i}": f"Day {i}: one small, specific step away from the habit." for i in range(1, 22)},
+}
+CANNED_CANONICAL = {
+    "canonical_habit_name": "nicotine pouches (Zyn)",
+    "habit_category": "nicotine_oral",
+    "confidence": "high",
+}
+CANNED_COACH = (
+    "That slip is useful data. Tonight, put the pouches out of reach before dinner "
+    "and plan a five-minute walk for when the urge usually peaks."
+)
+STRUCTURED = {
+    "SafetyResult": ("safety", CANNED_SAFETY),
+    "QuizForm": ("quiz_form", CANNED_QUIZ_FORM),
+    "QuizSummary": ("quiz_summary", CANNED_QUIZ_SUMMARY),
+}
+
+
+# ---------- Latency ----------
+
+def parse_distribution(spec: str) -> Callable[[random.Random], float]:
+    name, _, rest = spec.strip().partition(":")
+    if not rest:
+        value = float(name)
+        return lambda rng: value
+    args = [float(a) for a in rest.split(":")]
+    if name == "fixed":
+        return lambda rng: args[0]
+    if name == "uniform":
+        return lambda rng: rng.uniform(args[0], args[1])
+    if name == "normal":
+        return lambda rng: max(0.0, rng.gauss(args[0], args[1]))
+    if name == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(args[0]), args[1])
+    raise ValueError(f"Unknown latency distribution {name!r}")
+
+
+class LatencyModel:
+    """
+    Seeded per-kind latency sampler; thread-safe so concurrent calls stay reproducible in aggregate.
+    """
+
+    def __init__(self, spec: str = "fixed:0", seed: int = 0):
+        self.spec = spec
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._by_kind: Dict[str, Callable[[random.Random], float]] = {}
+        for part in filter(None, (p.strip() for p in spec.split(","))):
+            kind, sep, dist = part.partition("=")
+            if not sep:
+                kind, dist = "default", part
+            self._by_kind[kind.strip()] = parse_distribution(dist)
+        self._by_kind.setdefault("default", lambda rng: 0.0)
+
+    def sample(self, kind: str) -> float:
+        with self._lock:
+            return self._by_kind.get(kind, self._by_kind["default"])(self._rng)
+
+
+# ---------- Replies ----------
+
+def _classify(body: Dict[str, Any]) -> Tuple[str, str, Optional[str]]:
+    """
+    (kind, content, tool name) for a chat completions request body.
+    """
+    prompt = json.dumps(body.get("messages"), ensure_ascii=False)
+    response_format = body.get("response_format") or {}
+    if response_format.get("type") == "json_schema":
+        kind, canned = STRUCTURED[response_format["json_schema"]["name"]]
+        return kind, json.dumps(canned), None
+    if body.get("tools"):
+        name = body["tools"][0]["function"]["name"]
+        kind, canned = STRUCTURED[name]
+        return kind, json.dumps(canned), name
+    if response_format.get("type") == "json_object":
+        if "habit-name normalizer" in prompt:
+            return "canonicalize", json.dumps(CANNED_CANONICAL), None
+        return "plan21", json.dumps(CANNED_PLAN21), None
+    return "coach", CANNED_COACH, None
+
+
+def _usage(body: Dict[str, Any], content: str) -> Dict[str, int]:
+    prompt_tokens = sum(count_tokens(str(m.get("content") or "")) + 4 for m in body.get("messages") or [])
+    completion_tokens = count_tokens(content)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def _completion(body: Dict[str, Any], content: str, tool: Optional[str]) -> bytes:
+    if tool:
+        message = {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [{"id": "call_1", "type": "function", "function": {"name": tool, "arguments": content}}],
+        }
+        finish = "tool_calls"
+    else:
+        message, finish = {"role": "assistant", "content": content}, "stop"
+    return json.dumps({
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": 0,
+        "model": body.get("model", "fake"),
+        "choices": [{"index": 0, "message": message, "finish_reason": finish}],
+        "usage": _usage(body, content),
+    }).encode()
+
+
+def _stream(body: Dict[str, Any], content: str) -> bytes:
+    def event(delta: Dict[str, Any], finish: Optional[str] = None, **extra: Any) -> str:
+        chunk = {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+            **extra,
+        }
+        return f"data: {json.dumps(chunk)}\n\n"
+
+    words = content.split(" ")
+    events = [event({"content": w + (" " if i < len(words) - 1 else "")}) for i, w in enumerate(words)]
+    events.append(event({}, "stop", usage=_usage(body, content)))
+    events.append("data: [DONE]\n\n")
+    return "".join(events).encode()
+
+
+# ---------- Transport ----------
+
+class FakeLLMTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    Answers /chat/completions requests with canned replies after a sampled delay.
+    """
+
+    def __init__(self, latency: LatencyModel):
+        self.latency = latency
+        self.calls: Dict[str, int] = {kind: 0 for kind in KINDS}
+        self.simulated_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _respond(self, request: httpx.Request) -> Tuple[float, httpx.Response]:
+        body = json.loads(request.content or b"{}")
+        kind, content, tool = _classify(body)
+        delay = self.latency.sample(kind)
+        with self._lock:
+            self.calls[kind] += 1
+            self.simulated_seconds += delay
+        if body.get("stream"):
+            payload, content_type = _stream(body, content), "text/event-stream"
+        else:
+            payload, content_type = _completion(body, content, tool), "application/json"
+        return delay, httpx.Response(200, headers={"content-type": content_type}, content=payload)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        delay, response = self._respond(request)
+        time.sleep(delay)
+        return response
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        delay, response = self._respond(request)
+        await asyncio.sleep(delay)
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"calls": dict(self.calls), "simulated_seconds": round(self.simulated_seconds, 4)}
+
+
+def install_fake_llm(latency: str = "fixed:0", seed: int = 0) -> FakeLLMTransport:
+    """
+    Route every model from llm_clients through a fake transport; returns it for stats.
+    """
+    os.environ.setdefault("OPENAI_API_KEY", "fake-key")
+    transport = FakeLLMTransport(LatencyModel(latency, seed))
+    set_registry(ClientRegistry(transport=transport, async_transport=transport))
+    return transport
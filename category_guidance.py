@@ -0,0 +1,301 @@
+# category_guidance.py
+"""
+Category registry for the 21-day plan prompt.
+
+Maps every habit_category to a guidance block (the category-specific
+strategy appended to the user context in PLAN_21D_USER). The blocks are
+plain data below, compiled once at import into templates, and looked up
+by category in a dict. Import fails if a category the quiz summarizer is
+told to emit (the list in QUIZ_SUMMARY_SYSTEM) has no block, or a
+template uses a field that doesn't exist.
+
+Rendered guidance is cached per QuizSummary (keyed by the fields the
+templates use), so regenerating or hedging a plan for the same summary
+doesn't render it again.
+
+To add a category: add its name to a block's categories (or a new block)
+here, and to the list in QUIZ_SUMMARY_SYSTEM.
+"""
+import functools
+import re
+from string import Formatter
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from prompts import QUIZ_SUMMARY_SYSTEM
+from schemas import QuizSummary
+
+OTHER = "other"
+
+# Template field -> (QuizSummary attributes, first non-empty wins; value when all are empty).
+FIELDS: Dict[str, Tuple[Tuple[str, ...], str]] = {
+    "raw": (("user_habit_raw",), ""),
+    "name": (("canonical_habit_name", "user_habit_raw"), "the habit"),
+    "severity": (("severity_level",), ""),
+    "trigger": (("main_trigger",), "unclear triggers"),
+    "peak": (("peak_times",), "unclear peak times"),
+    "loc": (("common_locations",), "unclear locations"),
+    "emo": (("emotional_patterns",), "unclear emotional patterns"),
+    "freq": (("frequency_pattern",), "unclear frequency"),
+    "motive": (("motivation_reason",), "unclear motivation"),
+    "risk": (("risk_situations",), "unclear risk situations"),
+    "prev": (("previous_attempts",), "not clearly described"),
+}
+FIELD_NAMES = tuple(FIELDS)
+
+# ---------- Guidance data ----------
+
+BASE_CONTEXT = """
+User-specific context:
+- Exact wording: {raw}
+- Canonical habit name: {name}
+- Severity: {severity}
+- Main trigger: {trigger}
+- Peak times: {peak}
+- Common locations: {loc}
+- Emotional pattern: {emo}
+- Frequency pattern: {freq}
+- Motivation: {motive}
+- High-risk situations: {risk}
+- Previous attempts: {prev}
+
+Plan must explicitly reference these details across the 21 days.
+"""
+
+# (categories, block); the OTHER block also serves unknown categories.
+GUIDANCE_BLOCKS: Tuple[Tuple[Tuple[str, ...], str], ...] = (
+    (
+        ("nicotine_smoking", "nicotine_vaping", "nicotine_oral"),
+        """
+Category: Nicotine
+
+Core strategy:
+- Treat {name} as a dopamine and ritual loop, not just a chemical.
+- Emphasize routines around peak times (for example {peak}), and environments like {loc}.
+- Explicitly build friction around storage, access, purchase, and first use of the day.
+- For oral products like pouches, include mouth and hand substitution tasks.
+- For higher severity, include more aggressive environment restructuring and longer urge delays.
+
+Must include across 21 days:
+- At least 4 tasks about changing where {name} is kept or accessed.
+- At least 4 tasks about first use of the day and last use window.
+- At least 3 tasks about physical state regulation during withdrawal (sleep window, hydration, body movement).
+- At least 3 tasks that use emotional patterns like {emo} to pre-empt urges.
+""",
+    ),
+    (
+        ("pornography",),
+        """
+Category: Pornography / sexual content
+
+Core strategy:
+- Treat {name} as a privacy plus device plus emotional loop.
+- Focus on device rules, room layout, and late-night behaviour, especially around {peak}.
+- Explicitly design friction around entering high-risk locations such as {loc}.
+- Use stimulus control (lights, door, blockers, charging locations) instead of just "willpower".
+- Tie reflection tasks to shame cycles and emotion patterns like {emo}, but without using shame language.
+
+Must include across 21 days:
+- At least 4 tasks that change how and where the device is used.
+- At least 3 tasks that pre-empt late-night or alone-time triggers.
+- At least 3 tasks that redirect immediately after a strong urge into a specific alternative behaviour.
+- At least 2 tasks that review a slip in a non-judgmental, purely diagnostic way.
+""",
+    ),
+    (
+        ("screen_time", "social_media", "gaming"),
+        """
+Category: Screen-based habit (social media, scrolling, or gaming)
+
+Core strategy:
+- Treat {name} as an algorithm plus environment plus boredom loop.
+- Focus on first and last 30 minutes of the day, especially if peak times include {peak}.
+- Redesign notification logic, home screen layout, and app availability.
+- Use strong "screen zones" and "screen windows" instead of unrealistic total bans.
+- Tie replacement activities to the motivation: {motive}.
+
+Must include across 21 days:
+- At least 3 tasks modifying notifications, app positions, or app removal.
+- At least 3 tasks that change morning behaviour before the first use.
+- At least 3 tasks that change evening behaviour and pre-sleep routines.
+- At least 3 tasks that deliberately swap a high-risk scrolling window with something aligned to {motive}.
+""",
+    ),
+    (
+        ("alcohol", "cannabis"),
+        """
+Category: Substance use (alcohol or cannabis)
+
+Core strategy:
+- Treat {name} as a context plus people plus emotional regulation loop.
+- Focus on social settings, routes, and specific times like {peak}.
+- Include clear "no-use" contexts and re-routing strategies for high-risk places like {loc}.
+- Include craving delay plus alternative rituals at the exact times they usually use.
+- Tie medium-term tasks to motivation {motive} and long-term identity.
+
+Must include across 21 days:
+- At least 3 tasks that alter routes or places that usually lead to use.
+- At least 3 tasks that create explicit "no-use" rules in specific contexts.
+- At least 3 tasks focused on high-risk situations described as {risk}.
+- At least 2 tasks rehearsing what to do during a social invite or stress spike.
+""",
+    ),
+    (
+        ("sugar", "food_overeating"),
+        """
+Category: Food / sugar / overeating
+
+Core strategy:
+- Treat {name} as a kitchen plus shopping plus emotional soothing loop.
+- Focus on visibility and proximity of foods, especially around locations like {loc}.
+- Tie tasks to emotional states like {emo} and times like {peak}.
+- Include shopping list and preparation changes that reduce impulsive access.
+- Use small plate, portion, and environment tricks rather than "never eat X again" rules.
+
+Must include across 21 days:
+- At least 3 tasks about shopping or preparing alternatives in advance.
+- At least 3 tasks about changing visibility and proximity of trigger foods.
+- At least 3 tasks about emotional check-ins before eating in high-risk moments.
+- At least 2 tasks about how to handle evenings or specific risk situations like {risk}.
+""",
+    ),
+    (
+        ("shopping_spending", "gambling"),
+        """
+Category: Spending / gambling
+
+Core strategy:
+- Treat {name} as a excitement plus access plus impulse loop.
+- Focus on financial access: cards, apps, cash, sites, groups.
+- Use strong pre-commitment rules, delays, and visibility of consequences.
+- Tie specific tasks to high-risk times or contexts like {peak} and {risk}.
+- Use replacement forms of excitement or reward that are lower-risk.
+
+Must include across 21 days:
+- At least 3 tasks about restricting or delaying financial access.
+- At least 3 tasks about changing what happens in the 10–20 minutes before spending or betting.
+- At least 2 tasks about reviewing a past spending or gambling episode analytically, not emotionally.
+- At least 2 tasks that explicitly reinforce the motivation: {motive}.
+""",
+    ),
+    (
+        ("procrastination",),
+        """
+Category: Procrastination
+
+Core strategy:
+- Treat {name} as avoidance of a specific type of work or feeling.
+- Tie tasks directly to the kind of work they avoid most (for example study or deep work).
+- Use very small, clear start behaviours instead of vague discipline tasks.
+- Design environment and time box rules around the true peak avoidance windows like {peak}.
+- Link identity work to becoming someone who handles {trigger} with short, focused bursts.
+
+Must include across 21 days:
+- At least 5 tasks that define a tiny, concrete starting action (for example open document and write one sentence).
+- At least 3 tasks that reduce distractions in the main work location {loc}.
+- At least 3 tasks that handle emotional patterns like {emo} before work instead of during.
+- At least 2 tasks that rehearse what to do after a bad day without abandoning the plan.
+""",
+    ),
+    (
+        (OTHER,),
+        """
+Category: Other or unclear
+
+Core strategy:
+- The category label is not precise, so lean heavily on the user's actual patterns.
+- Design tasks explicitly around the main trigger {trigger}, peak times {peak}, and locations {loc}.
+- Use emotional pattern {emo} to time interventions before the urge becomes very strong.
+- Apply standard habit-breaking tools: friction, replacement, identity, slip recovery, environment design.
+
+Must include across 21 days:
+- At least 5 tasks that directly reference the described triggers, times, or locations.
+- At least 3 tasks that practice urge delay plus a named replacement behaviour.
+- At least 2 tasks that explicitly connect daily actions to the motivation: {motive}.
+""",
+    ),
+)
+
+
+# ---------- Registry ----------
+
+class GuidanceTemplate:
+    """
+    A block pre-split into literal text and field names; rendering is one join.
+    """
+
+    def __init__(self, text: str, fields: Mapping[str, Any] = FIELDS):
+        self.parts: List[Tuple[str, Optional[str]]] = []
+        for literal, field, spec, conversion in Formatter().parse(text):
+            if field is not None and (field not in fields or spec or conversion):
+                raise ValueError(f"Unknown template field {{{field}}}; expected one of {sorted(fields)}")
+            self.parts.append((literal, field))
+
+    def render(self, values: Mapping[str, str]) -> str:
+        return "".join(literal + (values[field] if field else "") for literal, field in self.parts)
+
+
+def summarizer_categories() -> List[str]:
+    """
+    The habit_category values QUIZ_SUMMARY_SYSTEM lists for the model.
+    """
+    listing = re.search(r"- habit_category:[^(]*\(([^)]*)\)", QUIZ_SUMMARY_SYSTEM)
+    return re.findall(r'"([a-z_]+)"', listing.group(1)) if listing else []
+
+
+def _build_registry() -> Dict[str, GuidanceTemplate]:
+    registry: Dict[str, GuidanceTemplate] = {}
+    for categories, text in GUIDANCE_BLOCKS:
+        template = GuidanceTemplate(text)
+        for category in categories:
+            if category in registry:
+                raise ValueError(f"Category {category!r} has more than one guidance block")
+            registry[category] = template
+
+    categories = summarizer_categories()
+    if not categories:
+        raise ValueError("No habit_category list found in QUIZ_SUMMARY_SYSTEM")
+    missing = [c for c in categories if c not in registry]
+    if missing or OTHER not in registry:
+        raise ValueError(f"No guidance block for categories: {missing or [OTHER]}")
+    return registry
+
+
+BASE_TEMPLATE = GuidanceTemplate(BASE_CONTEXT)
+REGISTRY = _build_registry()
+
+
+# ---------- Rendering ----------
+
+def field_values(
+    summary: QuizSummary, fields: Mapping[str, Tuple[Tuple[str, ...], str]] = FIELDS
+) -> Tuple[str, ...]:
+    """
+    One value per template field, in `fields` order. Also the cache key:
+    two summaries with the same values share one rendering.
+    """
+    attributes_by_name = vars(summary)
+    values = []
+    for attributes, default in fields.values():
+        for attribute in attributes:
+            value = attributes_by_name.get(attribute)
+            if value:
+                break
+        else:
+            value = default
+        values.append(value)
+    return tuple(values)
+
+
+@functools.lru_cache(maxsize=1024)
+def _render(category: str, values: Tuple[str, ...]) -> str:
+    mapping = dict(zip(FIELD_NAMES, values))
+    template = REGISTRY.get(category, REGISTRY[OTHER])
+    return BASE_TEMPLATE.render(mapping) + "\n" + template.render(mapping)
+
+
+def render_guidance(summary: QuizSummary) -> str:
+    """
+    Category- and user-specific guidance for the PLAN_21D_USER message.
+    """
+    category = (summary.habit_category or OTHER).lower()
+    return _render(category, field_values(summary))
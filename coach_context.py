@@ -0,0 +1,274 @@
+# coach_context.py
+"""
+Bounded context for coach turns.
+
+The coach used to serialize the whole chat_history on every turn, so prompt
+size grew linearly with the conversation. Here the last N turns stay
+verbatim, older turns are folded (a batch at a time) into a running summary
+kept on HabitState, and the rendered prompt is held to a token budget. The
+fold runs once a reply has gone out (ai_nodes.fold_coach_summary) and is
+saved with the session; until then the turns it covers stay verbatim within
+the budget.
+
+Configuration (env):
+- UNHABIT_COACH_HISTORY_TURNS=6        turns (user + assistant) kept verbatim
+- UNHABIT_COACH_SUMMARY_BATCH_TURNS=4  turns folded into the summary at once
+- UNHABIT_COACH_PROMPT_TOKEN_BUDGET=6000
+- UNHABIT_COACH_SUMMARY_MAX_TOKENS=400
+- UNHABIT_COACH_PLAN_NEIGHBOUR_DAYS=1  plan days shown either side of today
+"""
+import json
+import os
+import re
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.messages import BaseMessage, HumanMessage
+
+from prompts import COACH_SYSTEM, COACH_SYSTEM_MESSAGE
+from schemas import HabitState
+
+COACH_HISTORY_TURNS = int(os.getenv("UNHABIT_COACH_HISTORY_TURNS", "6"))
+COACH_SUMMARY_BATCH_TURNS = int(os.getenv("UNHABIT_COACH_SUMMARY_BATCH_TURNS", "4"))
+COACH_PROMPT_TOKEN_BUDGET = int(os.getenv("UNHABIT_COACH_PROMPT_TOKEN_BUDGET", "6000"))
+COACH_SUMMARY_MAX_TOKENS = int(os.getenv("UNHABIT_COACH_SUMMARY_MAX_TOKENS", "400"))
+COACH_PLAN_NEIGHBOUR_DAYS = int(os.getenv("UNHABIT_COACH_PLAN_NEIGHBOUR_DAYS", "1"))
+
+PLAN_DAYS = 21
+
+Message = Dict[str, str]
+
+try:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:  # tiktoken missing or encoding unavailable offline
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Token count for budgeting; ~4 chars/token when tiktoken is unavailable.
+    """
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+# Constant, so counted once.
+_SYSTEM_TOKENS = count_tokens(COACH_SYSTEM) + 4
+
+
+def truncate_tokens(text: str, max_tokens: int, keep: str = "end") -> str:
+    """
+    Cut text down to max_tokens, keeping its beginning or (default) its end.
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+    if _encoding is not None:
+        ids = _encoding.encode(text)
+        ids = ids[-max_tokens:] if keep == "end" else ids[:max_tokens]
+        return _encoding.decode(ids)
+    chars = max_tokens * 4
+    return text[-chars:] if keep == "end" else text[:chars]
+
+
+def format_messages(messages: List[Message]) -> str:
+    return "\n".join(
+        f"{msg.get('role', 'user')}: {msg.get('content', '')}" for msg in messages
+    )
+
+
+# ---------- Rolling window + summary ----------
+
+def pending_fold(
+    state: HabitState,
+    window_turns: int = COACH_HISTORY_TURNS,
+    batch_turns: int = COACH_SUMMARY_BATCH_TURNS,
+) -> Tuple[List[Message], int]:
+    """
+    Messages that should be folded into the running summary now, and the new
+    `chat_summary_upto` once they are.
+
+    Folding waits until a full batch has scrolled out of the verbatim window,
+    so the summarizer runs once every `batch_turns` turns rather than every turn.
+    """
+    history = state.chat_history or []
+    upto = min(state.chat_summary_upto or 0, len(history))
+    keep_from = max(len(history) - 2 * window_turns, 0)
+
+    if keep_from - upto < 2 * max(batch_turns, 1):
+        return [], upto
+    return list(history[upto:keep_from]), keep_from
+
+
+def extractive_summary(
+    previous: Optional[str],
+    messages: List[Message],
+    max_tokens: int = COACH_SUMMARY_MAX_TOKENS,
+) -> str:
+    """
+    Deterministic summarizer: appends a clipped line per user message.
+
+    Used when the LLM summarizer fails and by the context benchmark.
+    """
+    lines = [previous] if previous else []
+    for msg in messages:
+        if msg.get("role") == "user" and msg.get("content"):
+            lines.append(f"- user said: {msg['content'][:160]}")
+    return truncate_tokens("\n".join(lines), max_tokens)
+
+
+def fit_history(summary: Optional[str], messages: List[Message], budget_tokens: int) -> str:
+    """
+    Render summary + verbatim messages within budget_tokens.
+
+    The summary gets at most half the budget; verbatim messages are then added
+    newest-first until the rest is used up.
+    """
+    parts: List[str] = []
+    remaining = max(budget_tokens, 0)
+
+    if summary:
+        summary_text = truncate_tokens(summary, max(remaining // 2, 1))
+        parts.append(f"Earlier in the conversation (summary):\n{summary_text}")
+        remaining -= count_tokens(parts[0])
+
+    recent: List[str] = []
+    for msg in reversed(messages):
+        line = format_messages([msg])
+        cost = count_tokens(line) + 1
+        if cost > remaining:
+            break
+        recent.append(line)
+        remaining -= cost
+
+    if recent:
+        parts.append("\n".join(reversed(recent)))
+    return "\n\n".join(parts)
+
+
+# ---------- Plan slicing ----------
+
+_DAY_MENTION = re.compile(r"\bday[\s_#-]*(\d{1,2})\b", re.IGNORECASE)
+_RELATIVE_DAYS = {"yesterday": -1, "today": 0, "tomorrow": 1}
+
+
+def current_plan_day(state: HabitState, today: Optional[date] = None) -> Optional[int]:
+    """
+    Day of the 21-day plan the user is on: an explicit `current_day`, otherwise
+    derived from `plan_started_at`. None when neither is known.
+    """
+    if state.current_day:
+        return max(1, min(PLAN_DAYS, state.current_day))
+    if not state.plan_started_at:
+        return None
+    try:
+        started = date.fromisoformat(state.plan_started_at)
+    except ValueError:
+        return None
+    elapsed = ((today or date.today()) - started).days
+    return max(1, min(PLAN_DAYS, elapsed + 1))
+
+
+def relevant_plan_days(
+    state: HabitState,
+    neighbours: int = COACH_PLAN_NEIGHBOUR_DAYS,
+    today: Optional[date] = None,
+) -> List[int]:
+    """
+    Plan days worth showing the coach this turn: today and its neighbours,
+    any "day N" mentioned in the user message, and yesterday/tomorrow.
+    """
+    current = current_plan_day(state, today)
+    message = state.last_user_message or ""
+    days = set()
+
+    if current is not None:
+        days.update(range(current - neighbours, current + neighbours + 1))
+        lowered = message.lower()
+        for word, offset in _RELATIVE_DAYS.items():
+            if re.search(rf"\b{word}\b", lowered):
+                days.add(current + offset)
+
+    days.update(int(match) for match in _DAY_MENTION.findall(message))
+
+    if not days:
+        # Nothing to anchor on (no start date, no mention): the opening days.
+        days.update(range(1, 2 + neighbours))
+    return sorted(day for day in days if 1 <= day <= PLAN_DAYS)
+
+
+def plan_slice(state: HabitState, today: Optional[date] = None) -> Dict[str, Any]:
+    """
+    The part of Plan21D the coach needs this turn instead of all 21 days.
+    """
+    plan = state.plan21
+    if plan is None:
+        return {}
+
+    days = relevant_plan_days(state, today=today)
+    return {
+        "plan_summary": plan.plan_summary,
+        "current_day": current_plan_day(state, today),
+        "day_tasks": {
+            f"day_{day}": plan.day_tasks[f"day_{day}"]
+            for day in days
+            if f"day_{day}" in plan.day_tasks
+        },
+    }
+
+
+def render_coach_user(
+    state: HabitState,
+    summary: Optional[str],
+    summary_upto: int,
+    budget_tokens: int = COACH_PROMPT_TOKEN_BUDGET,
+) -> str:
+    """
+    The per-turn part of the coach prompt, with history bounded by the token budget.
+
+    The system prompt and everything except the history are fixed cost; the
+    history gets whatever budget is left. Sections run from most to least
+    stable (profile, plan slice, history, message) so consecutive turns of
+    one user share as long a prefix as possible.
+    """
+    quiz_json = state.quiz_summary.model_dump() if state.quiz_summary else {}
+    plan_json = plan_slice(state)
+    user_message = state.last_user_message or state.habit_description or ""
+
+    head = f"quiz_summary_json:\n{json.dumps(quiz_json, ensure_ascii=False)}\n\n"
+    head += f"plan_21d_json:\n{json.dumps(plan_json, ensure_ascii=False)}\n\n"
+    tail = f"user_message:\n{user_message}\n"
+
+    history_budget = budget_tokens - _SYSTEM_TOKENS - count_tokens(head) - count_tokens(tail)
+    recent = (state.chat_history or [])[summary_upto:]
+    history_text = fit_history(summary, recent, history_budget)
+
+    return head + f"history_text:\n{history_text}\n\n" + tail
+
+
+def render_coach_messages(
+    state: HabitState,
+    summary: Optional[str],
+    summary_upto: int,
+    budget_tokens: int = COACH_PROMPT_TOKEN_BUDGET,
+) -> List[BaseMessage]:
+    """
+    [static system message, per-turn user message] for one coach turn.
+    """
+    return [COACH_SYSTEM_MESSAGE, HumanMessage(content=render_coach_user(state, summary, summary_upto, budget_tokens))]
+
+
+def render_coach_prompt(
+    state: HabitState,
+    summary: Optional[str],
+    summary_upto: int,
+    budget_tokens: int = COACH_PROMPT_TOKEN_BUDGET,
+) -> str:
+    """
+    `render_coach_messages` as one text (token accounting, benchmarks).
+    """
+    return COACH_SYSTEM + "\n\n" + render_coach_user(state, summary, summary_upto, budget_tokens)
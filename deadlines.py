@@ -0,0 +1,197 @@
+# deadlines.py
+"""
+Per-node deadlines and hedged requests.
+
+Every node call gets a wall-clock deadline. Retries share it, and each
+attempt passes what is left to the OpenAI SDK as its request timeout, so
+one slow completion can no longer stall an onboarding step indefinitely.
+
+Nodes listed in UNHABIT_HEDGE_NODES are hedged: if the first request hasn't
+answered after the node's recent p95 latency, an identical second request
+is fired and whichever finishes first wins. On the async path the loser is
+cancelled (its HTTP request is aborted). Sync threads can't be cancelled,
+so there the loser is abandoned and its result discarded.
+
+Configuration (env):
+- UNHABIT_NODE_DEADLINE=30                  seconds, default for every node
+- UNHABIT_NODE_DEADLINES="plan21=60,safety=15"
+- UNHABIT_HEDGE_NODES="plan21"              comma-separated; empty disables hedging
+- UNHABIT_HEDGE_PERCENTILE=0.95
+- UNHABIT_HEDGE_MIN_SAMPLES=20              latencies needed before p95 is trusted
+- UNHABIT_HEDGE_DELAY=10                    seconds, hedge delay until then
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+from metrics import counter
+
+T = TypeVar("T")
+
+NODE_DEADLINE_DEFAULT = float(os.getenv("UNHABIT_NODE_DEADLINE", "30"))
+HEDGE_NODES = frozenset(
+    n.strip() for n in os.getenv("UNHABIT_HEDGE_NODES", "").split(",") if n.strip()
+)
+HEDGE_PERCENTILE = float(os.getenv("UNHABIT_HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("UNHABIT_HEDGE_MIN_SAMPLES", "20"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("UNHABIT_HEDGE_DELAY", "10"))
+
+# plan21 writes 21 days of tasks and is by far the slowest call.
+NODE_DEADLINES: Dict[str, float] = {
+    "safety": 15.0,
+    "canonicalize": 15.0,
+    "quiz_form": 30.0,
+    "quiz_summary": 30.0,
+    "plan21": 60.0,
+    "coach": 30.0,
+    "chat_summary": 20.0,
+}
+for _part in filter(None, (p.strip() for p in os.getenv("UNHABIT_NODE_DEADLINES", "").split(","))):
+    _node, _, _seconds = _part.partition("=")
+    NODE_DEADLINES[_node.strip()] = float(_seconds)
+
+HEDGES_FIRED = counter(
+    "unhabit_llm_hedges_total",
+    "Hedge requests fired because the first request outlived the hedge delay.",
+    labelnames=("node",),
+)
+HEDGES_WON = counter(
+    "unhabit_llm_hedges_won_total",
+    "Hedged calls where the second request answered first.",
+    labelnames=("node",),
+)
+
+# Hedge requests need their own threads: the caller's thread is blocked waiting.
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedge")
+
+
+def deadline_for(node: str) -> float:
+    return NODE_DEADLINES.get(node, NODE_DEADLINE_DEFAULT)
+
+
+# ---------- Latency tracking ----------
+
+class LatencyTracker:
+    """
+    Rolling window of successful call latencies per node.
+    """
+
+    def __init__(self, window: int = 500):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, node: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(node, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, node: str, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(node, ()))
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def count(self, node: str) -> int:
+        with self._lock:
+            return len(self._samples.get(node, ()))
+
+
+LATENCIES = LatencyTracker()
+
+
+def hedge_delay(node: str) -> Optional[float]:
+    """
+    Seconds to wait before hedging `node`, or None if it isn't hedged.
+    """
+    if node not in HEDGE_NODES:
+        return None
+    if LATENCIES.count(node) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY
+    return LATENCIES.percentile(node, HEDGE_PERCENTILE)
+
+
+# ---------- Hedged calls ----------
+
+def _time_left(deadline: Optional[float]) -> Optional[float]:
+    return None if deadline is None else max(deadline - time.monotonic(), 0.001)
+
+
+def hedged(node: str, fn: Callable[[Optional[float]], T], deadline: Optional[float] = None) -> T:
+    """
+    Call `fn(timeout)`, firing a second call after the node's hedge delay if
+    the first hasn't returned. Each call gets the time left before `deadline`
+    (a time.monotonic() value; None passes None), so the hedge can't outlive
+    it. First success wins; if both fail, the first error is raised.
+    """
+    delay = hedge_delay(node)
+    if delay is None:
+        return fn(_time_left(deadline))
+
+    # Copy the context so priority and other contextvars follow the call into the pool.
+    futures = [_executor.submit(contextvars.copy_context().run, fn, _time_left(deadline))]
+    done, _ = wait(futures, timeout=delay)
+    if not done:
+        HEDGES_FIRED.inc(node=node)
+        futures.append(_executor.submit(contextvars.copy_context().run, fn, _time_left(deadline)))
+
+    pending = set(futures)
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is not futures[0]:
+                    HEDGES_WON.inc(node=node)
+                # A running loser can't be stopped; its result is simply dropped.
+                return future.result()
+            error = error or future.exception()
+    raise error
+
+
+async def ahedged(
+    node: str,
+    fn: Callable[[Optional[float]], Awaitable[T]],
+    deadline: Optional[float] = None,
+) -> T:
+    """
+    Async `hedged`; the losing request is cancelled.
+    """
+    delay = hedge_delay(node)
+    if delay is None:
+        return await fn(_time_left(deadline))
+
+    tasks = [asyncio.ensure_future(fn(_time_left(deadline)))]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            HEDGES_FIRED.inc(node=node)
+            tasks.append(asyncio.ensure_future(fn(_time_left(deadline))))
+
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not tasks[0]:
+                        HEDGES_WON.inc(node=node)
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+def record_latency(node: str, seconds: float) -> None:
+    """
+    Feed a successful call's latency into the node's hedge delay.
+    """
+    LATENCIES.record(node, seconds)
@@ -1,15 +1,92 @@
-from langgraph.graph import StateGraph, END
-from schemas import HabitState
+import hashlib
+import os
+import sqlite3
+from typing import Any, Dict, Iterator, Optional
+
+from langgraph.graph import StateGraph, START, END
+from langgraph.types import Command, interrupt
+from schemas import HabitState, QuizForm
 from ai_nodes import (
     safety_node,
     quiz_form_node,
     quiz_summary_node,
     plan21_node,
     coach_node,
+    asafety_node,
+    aquiz_form_node,
+    aquiz_summary_node,
+    aplan21_node,
+    acoach_node,
 )
+from speculative import speculative_gate_node, route_after_gate
+
+
+CHECKPOINT_DB = os.getenv("UNHABIT_CHECKPOINT_DB", "onboarding_checkpoints.sqlite")
+
 
+SYNC_NODES = {
+    "safety": safety_node,
+    "quiz_form": quiz_form_node,
+    "quiz_summary": quiz_summary_node,
+    "plan21": plan21_node,
+    "coach": coach_node,
+}
 
-def build_onboarding_graph():
+ASYNC_NODES = {
+    "safety": asafety_node,
+    "quiz_form": aquiz_form_node,
+    "quiz_summary": aquiz_summary_node,
+    "plan21": aplan21_node,
+    "coach": acoach_node,
+}
+
+
+def quiz_fingerprint(quiz_form: Optional[QuizForm]) -> Optional[str]:
+    """
+    Identifies a quiz, so answers can be tied to the questions they answer.
+    """
+    if quiz_form is None:
+        return None
+    return hashlib.sha256(quiz_form.model_dump_json().encode("utf-8")).hexdigest()[:16]
+
+
+def quiz_answers_node(state: HabitState) -> Dict[str, Any]:
+    """
+    Human-input step 3: pause the graph until the frontend submits answers.
+
+    The interrupt payload carries the quiz to show. The run resumes with
+    `Command(resume=<answers string>)`. The interrupt is skipped only when
+    the state already holds answers to this run's quiz (retries, resuming
+    from a stored quiz); answers to any other quiz are never reused.
+    """
+    fingerprint = quiz_fingerprint(state.quiz_form)
+    if state.user_quiz_answers and fingerprint and state.quiz_answers_for == fingerprint:
+        return {"user_quiz_answers": state.user_quiz_answers}
+
+    answers = interrupt(
+        {
+            "quiz_form": state.quiz_form.model_dump() if state.quiz_form else None,
+            "safety": state.safety.model_dump() if state.safety else None,
+        }
+    )
+    return {"user_quiz_answers": answers, "quiz_answers_for": fingerprint}
+
+
+def route_after_safety(state: HabitState) -> str:
+    """
+    Sequential graph: no quiz for blocked input.
+    """
+    if state.safety is not None and state.safety.action == "block_and_escalate":
+        return END
+    return "quiz_form"
+
+
+def build_onboarding_graph(
+    async_nodes: bool = False,
+    speculative: bool = False,
+    checkpointer: Optional[Any] = None,
+    quiz_interrupt: bool = False,
+):
     """
     Full onboarding flow:
 
@@ -19,21 +96,253 @@ def build_onboarding_graph():
     4) quiz_summary– compress description + quiz + answers.
     5) plan21      – generate personalized 21-day plan.
     6) coach       – first coach message.
+
+    With async_nodes=True every node awaits its LLM call (`ainvoke`), so the
+    compiled graph must be driven with `ainvoke` / `astream` and many sessions
+    can share one event loop.
+
+    Without speculative, a "block_and_escalate" safety result ends the run
+    before quiz_form. With speculative=True, safety and quiz_form fan out from the start in
+    parallel and join at `speculative_gate`, which discards the quiz and ends
+    the run if safety returned "block_and_escalate".
+
+    With a checkpointer, state is saved after every node per thread id, so
+    a failed or interrupted run resumes from the node that did not finish.
+
+    With quiz_interrupt=True (requires a checkpointer), step 3 is a real
+    `quiz_answers` node that pauses the run after quiz_form; see
+    `start_onboarding` / `submit_quiz_answers`.
     """
+    nodes = ASYNC_NODES if async_nodes else SYNC_NODES
+
     graph = StateGraph(HabitState)
 
-    graph.add_node("safety", safety_node)
-    graph.add_node("quiz_form", quiz_form_node)
-    graph.add_node("quiz_summary", quiz_summary_node)
-    graph.add_node("plan21", plan21_node)
-    graph.add_node("coach", coach_node)
+    graph.add_node("safety", nodes["safety"])
+    graph.add_node("quiz_form", nodes["quiz_form"])
+    graph.add_node("quiz_summary", nodes["quiz_summary"])
+    graph.add_node("plan21", nodes["plan21"])
+    graph.add_node("coach", nodes["coach"])
 
-    graph.set_entry_point("safety")
+    # Where the run goes once a quiz exists.
+    after_quiz = "quiz_summary"
+    if quiz_interrupt:
+        graph.add_node("quiz_answers", quiz_answers_node)
+        graph.add_edge("quiz_answers", "quiz_summary")
+        after_quiz = "quiz_answers"
+
+    if speculative:
+        graph.add_node("speculative_gate", speculative_gate_node)
+        graph.add_edge(START, "safety")
+        graph.add_edge(START, "quiz_form")
+        graph.add_edge(["safety", "quiz_form"], "speculative_gate")
+        graph.add_conditional_edges(
+            "speculative_gate",
+            route_after_gate,
+            {"quiz_summary": after_quiz, END: END},
+        )
+    else:
+        graph.set_entry_point("safety")
+        graph.add_conditional_edges("safety", route_after_safety, {"quiz_form": "quiz_form", END: END})
+        graph.add_edge("quiz_form", after_quiz)
 
-    graph.add_edge("safety", "quiz_form")
-    graph.add_edge("quiz_form", "quiz_summary")
     graph.add_edge("quiz_summary", "plan21")
     graph.add_edge("plan21", "coach")
     graph.add_edge("coach", END)
 
-    return graph.compile()
+    return graph.compile(checkpointer=checkpointer)
+
+
+def build_async_onboarding_graph(speculative: bool = False, checkpointer: Optional[Any] = None):
+    """
+    Onboarding graph with async nodes; use `await graph.ainvoke(state)`.
+    """
+    return build_onboarding_graph(async_nodes=True, speculative=speculative, checkpointer=checkpointer)
+
+
+# ---------- Checkpointing ----------
+
+# State models the checkpointer may deserialize (LangGraph warns on, and will
+# eventually refuse, types that are not allow-listed).
+CHECKPOINT_TYPES = [
+    ("schemas", "HabitState"),
+    ("schemas", "SafetyResult"),
+    ("schemas", "QuizForm"),
+    ("schemas", "QuizQuestion"),
+    ("schemas", "QuizSummary"),
+    ("schemas", "Plan21D"),
+]
+
+
+def _checkpoint_serde():
+    from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+    return JsonPlusSerializer(allowed_msgpack_modules=CHECKPOINT_TYPES)
+
+
+def sqlite_checkpointer(path: str = CHECKPOINT_DB):
+    """
+    SQLite-backed LangGraph saver for the sync graph.
+    """
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    return SqliteSaver(sqlite3.connect(path, check_same_thread=False), serde=_checkpoint_serde())
+
+
+def async_sqlite_checkpointer(path: str = CHECKPOINT_DB):
+    """
+    SQLite-backed saver for the async graph; the connection opens on first use
+    inside the running event loop.
+    """
+    import aiosqlite
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+    return AsyncSqliteSaver(aiosqlite.connect(path), serde=_checkpoint_serde())
+
+
+def build_checkpointed_onboarding_graph(
+    path: str = CHECKPOINT_DB,
+    async_nodes: bool = False,
+    speculative: bool = False,
+    quiz_interrupt: bool = False,
+):
+    checkpointer = async_sqlite_checkpointer(path) if async_nodes else sqlite_checkpointer(path)
+    return build_onboarding_graph(
+        async_nodes=async_nodes,
+        speculative=speculative,
+        checkpointer=checkpointer,
+        quiz_interrupt=quiz_interrupt,
+    )
+
+
+def _fresh_input(state: HabitState, keep_answers: bool = True) -> Dict[str, Any]:
+    # Every field, None included: a HabitState input only writes the fields that
+    # were explicitly set, so answers/plans from the thread's previous run would leak in.
+    # Only the run's inputs carry over; everything the nodes produce starts empty.
+    fresh = HabitState(user_id=state.user_id, habit_description=state.habit_description)
+    if keep_answers:
+        fresh.user_quiz_answers = state.user_quiz_answers
+        fresh.quiz_answers_for = state.quiz_answers_for
+    return fresh.model_dump()
+
+
+def state_from_result(result: Dict[str, Any]) -> HabitState:
+    """
+    Rebuild a HabitState from graph output values (drops `__interrupt__` etc.).
+    """
+    return HabitState.model_validate(
+        {key: value for key, value in result.items() if key in HabitState.model_fields}
+    )
+
+
+def thread_config(user_id: Optional[str]) -> Dict[str, Any]:
+    """
+    One checkpoint thread per user.
+    """
+    if not user_id:
+        raise ValueError("HabitState.user_id is required for checkpointed runs")
+    return {"configurable": {"thread_id": user_id}}
+
+
+def run_onboarding(graph, state: HabitState) -> Dict[str, Any]:
+    """
+    Run or resume onboarding for `state.user_id` on a checkpointed graph.
+
+    If the thread's last run stopped before END (an exception or a killed
+    worker), it is resumed from the pending node instead of re-running
+    safety / quiz_form / quiz_summary. Otherwise a fresh run starts from state.
+    """
+    config = thread_config(state.user_id)
+    if graph.get_state(config).next:
+        return graph.invoke(None, config)
+    return graph.invoke(_fresh_input(state), config)
+
+
+async def arun_onboarding(graph, state: HabitState) -> Dict[str, Any]:
+    """
+    Async `run_onboarding` for graphs built with async_nodes=True.
+    """
+    config = thread_config(state.user_id)
+    if (await graph.aget_state(config)).next:
+        return await graph.ainvoke(None, config)
+    return await graph.ainvoke(_fresh_input(state), config)
+
+
+# ---------- Interrupt-driven runtime ----------
+
+def pending_quiz(result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    The quiz_answers interrupt payload from an invoke result, if the run paused there.
+    """
+    interrupts = result.get("__interrupt__") or ()
+    return interrupts[0].value if interrupts else None
+
+
+def start_onboarding(graph, state: HabitState) -> Dict[str, Any]:
+    """
+    First half on a quiz_interrupt graph: safety + quiz_form, then pause.
+
+    Returns the state values; `pending_quiz(result)` holds the quiz to show,
+    or None if the run ended early (blocked input). A new quiz gets new
+    answers: answers, summary, plan and chat from earlier runs are dropped.
+    """
+    return graph.invoke(_fresh_input(state, keep_answers=False), thread_config(state.user_id))
+
+
+def submit_quiz_answers(graph, user_id: str, answers: str) -> Dict[str, Any]:
+    """
+    Second half: resume the paused thread with the user's answers and run
+    quiz_summary -> plan21 -> coach.
+    """
+    return graph.invoke(Command(resume=answers), thread_config(user_id))
+
+
+def stream_quiz_answers(graph, user_id: str, answers: str) -> Iterator[Dict[str, Any]]:
+    """
+    `submit_quiz_answers`, yielding each node's update as it finishes
+    ({node: {field: value}}), so a frontend can show the quiz summary (and a
+    draft plan from it) while plan21 runs. Read the final values with
+    `graph.get_state(thread_config(user_id)).values` afterwards.
+    """
+    yield from graph.stream(Command(resume=answers), thread_config(user_id), stream_mode="updates")
+
+
+def _stored_quiz_input(graph, state: HabitState, answers: str) -> Dict[str, Any]:
+    if "quiz_answers" not in graph.nodes:
+        raise ValueError("Answering a stored quiz needs a graph built with quiz_interrupt=True")
+    if state.quiz_form is None:
+        raise ValueError("No stored quiz_form to answer")
+    values = _fresh_input(state, keep_answers=False)
+    values.update(
+        safety=state.safety,
+        quiz_form=state.quiz_form,
+        user_quiz_answers=answers,
+        quiz_answers_for=quiz_fingerprint(state.quiz_form),
+    )
+    return values
+
+
+def answer_stored_quiz(graph, state: HabitState, answers: str) -> Dict[str, Any]:
+    """
+    Answer the quiz stored on `state` when the thread has no paused run
+    (a restored session, a lost checkpoint, a finished run): the thread is
+    rewritten as if quiz_answers had just taken the answers, so only
+    quiz_summary -> plan21 -> coach run and the user keeps the quiz they
+    answered. Raises ValueError when there is no stored quiz.
+    """
+    config = thread_config(state.user_id)
+    graph.update_state(config, _stored_quiz_input(graph, state, answers), as_node="quiz_answers")
+    return graph.invoke(None, config)
+
+
+async def astart_onboarding(graph, state: HabitState) -> Dict[str, Any]:
+    return await graph.ainvoke(_fresh_input(state, keep_answers=False), thread_config(state.user_id))
+
+
+async def asubmit_quiz_answers(graph, user_id: str, answers: str) -> Dict[str, Any]:
+    return await graph.ainvoke(Command(resume=answers), thread_config(user_id))
+
+
+async def aanswer_stored_quiz(graph, state: HabitState, answers: str) -> Dict[str, Any]:
+    config = thread_config(state.user_id)
+    await graph.aupdate_state(config, _stored_quiz_input(graph, state, answers), as_node="quiz_answers")
+    return await graph.ainvoke(None, config)
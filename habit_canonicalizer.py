@@ -0,0 +1,228 @@
+# habit_canonicalizer.py
+"""
+Local habit-name canonicalization.
+
+Does what CANONICALIZE_PROMPT asks the model to do for the common cases:
+the description is folded (case, leetspeak) and tokenized with
+habit_lexicon, slang phrases are matched exactly, and remaining words are
+matched against a trie of the slang dictionary within a small edit
+distance ("tiktk", "cigarets", "procrastinaton").
+
+Confidence:
+- high:   exact slang match(es), and every matched word agrees;
+- medium: single-typo fuzzy matches backed by a second signal (two or more
+          typo'd words agreeing), or words that disagree where exact
+          matches give one category a clear majority;
+- low:    a lone fuzzy match (one typo'd word is too easily another
+          habit: "sports ebtting" -> "shorts"), a two-edit fuzzy match,
+          or a tie between categories.
+
+Results below UNHABIT_CANONICALIZE_MIN_CONFIDENCE (default "medium") and
+descriptions with no match at all go to the LLM as before.
+
+Configuration (env):
+- UNHABIT_LOCAL_CANONICALIZE=1             set to 0 to always ask the LLM
+- UNHABIT_CANONICALIZE_MIN_CONFIDENCE=medium
+"""
+import functools
+import os
+from collections import Counter as TermCounter
+from typing import Dict, List, Optional, Tuple
+
+from habit_lexicon import FILLER_WORDS, SLANG_TO_CATEGORY, match_slang, tokenize
+from metrics import counter
+
+LOCAL_CANONICALIZE_ENABLED = os.getenv("UNHABIT_LOCAL_CANONICALIZE", "1") != "0"
+CONFIDENCE_LEVELS = ("low", "medium", "high")
+MIN_CONFIDENCE = os.getenv("UNHABIT_CANONICALIZE_MIN_CONFIDENCE", "medium")
+
+LOCAL_CANONICALIZATIONS = counter(
+    "unhabit_local_canonicalize_total",
+    "Local canonicalization results by confidence (none = no match); "
+    "results below the minimum confidence go to the LLM.",
+    labelnames=("confidence",),
+)
+
+# Category -> canonical habit name.
+CANONICAL_NAMES: Dict[str, str] = {
+    "pornography": "pornography",
+    "nicotine_smoking": "smoking cigarettes",
+    "nicotine_vaping": "vaping",
+    "nicotine_oral": "nicotine pouches",
+    "social_media": "social media scrolling",
+    "gaming": "video gaming",
+    "food_overeating": "overeating",
+    "shopping_spending": "impulse shopping",
+    "gambling": "gambling",
+    "alcohol": "drinking alcohol",
+    "cannabis": "cannabis use",
+    "procrastination": "procrastination",
+}
+
+# Slang that names a product; kept in the canonical name ("nicotine pouches (Zyn)").
+BRANDS: Dict[str, str] = {
+    "zyn": "Zyn",
+    "zyns": "Zyn",
+    "velo": "Velo",
+    "snus": "snus",
+    "juul": "Juul",
+    "elf bar": "Elf Bar",
+    "tiktok": "TikTok",
+    "tik tok": "TikTok",
+    "instagram": "Instagram",
+    "insta": "Instagram",
+    "reels": "Reels",
+    "youtube": "YouTube",
+    "shorts": "YouTube Shorts",
+    "twitter": "Twitter",
+    "fortnite": "Fortnite",
+}
+
+# Fuzzy matching only for words at least this long, so short everyday words
+# ("been", "nice") can't drift onto slang ("beer", "nic").
+FUZZY_MIN_LENGTH = 5
+FUZZY_TWO_EDITS_MIN_LENGTH = 8
+
+
+# ---------- Trie ----------
+
+class _Node:
+    __slots__ = ("children", "word")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, "_Node"] = {}
+        self.word: Optional[str] = None
+
+
+class SlangTrie:
+    """
+    Trie over single-word slang entries with a bounded edit-distance search
+    (insert, delete, replace, swap of neighbours): one DP row per trie edge,
+    and branches whose best cell already exceeds the bound are pruned.
+    Typos rarely hit the first letter, so only entries sharing it are searched;
+    that also keeps "getting" from matching "betting".
+    """
+
+    def __init__(self, words: List[str]):
+        self.root = _Node()
+        for word in words:
+            node = self.root
+            for ch in word:
+                node = node.children.setdefault(ch, _Node())
+            node.word = word
+
+    def search(self, word: str, max_distance: int) -> List[Tuple[int, str]]:
+        """
+        (distance, entry) for every entry within `max_distance` edits, nearest first.
+        """
+        found: List[Tuple[int, str]] = []
+        child = self.root.children.get(word[:1])
+        if child is not None:
+            first_row = list(range(len(word) + 1))
+            self._walk(child, word[0], "", word, first_row, first_row, max_distance, found)
+        return sorted(found)
+
+    def _walk(
+        self,
+        node: _Node,
+        ch: str,
+        previous_ch: str,
+        word: str,
+        previous: List[int],
+        before_previous: List[int],
+        max_distance: int,
+        found: List[Tuple[int, str]],
+    ) -> None:
+        row = [previous[0] + 1]
+        for i in range(1, len(word) + 1):
+            cost = min(
+                row[i - 1] + 1,
+                previous[i] + 1,
+                previous[i - 1] + (word[i - 1] != ch),
+            )
+            if i > 1 and word[i - 1] == previous_ch and word[i - 2] == ch:
+                cost = min(cost, before_previous[i - 2] + 1)
+            row.append(cost)
+        if node.word is not None and row[-1] <= max_distance:
+            found.append((row[-1], node.word))
+        if min(row) <= max_distance:
+            for next_ch, child in node.children.items():
+                self._walk(child, next_ch, ch, word, row, previous, max_distance, found)
+
+
+TRIE = SlangTrie([slang for slang in SLANG_TO_CATEGORY if " " not in slang and len(slang) >= FUZZY_MIN_LENGTH - 1])
+
+
+@functools.lru_cache(maxsize=4096)
+def fuzzy_match(token: str) -> Optional[Tuple[int, str]]:
+    """
+    Nearest slang entry for a word as (distance, entry), or None. A tie between
+    entries of different categories counts as no match.
+    """
+    if len(token) < FUZZY_MIN_LENGTH or token in FILLER_WORDS:
+        return None
+    max_distance = 2 if len(token) >= FUZZY_TWO_EDITS_MIN_LENGTH else 1
+    matches = TRIE.search(token, max_distance)
+    if not matches:
+        return None
+    best = matches[0][0]
+    nearest = [entry for distance, entry in matches if distance == best]
+    if len({SLANG_TO_CATEGORY[entry] for entry in nearest}) > 1:
+        return None
+    return best, nearest[0]
+
+
+# ---------- Canonicalization ----------
+
+def _result(category: str, slang: List[str], confidence: str) -> Dict[str, str]:
+    name = CANONICAL_NAMES.get(category, category.replace("_", " "))
+    brand = next((BRANDS[s] for s in slang if s in BRANDS and SLANG_TO_CATEGORY[s] == category), None)
+    if brand and brand.lower() not in name:
+        name = f"{name} ({brand})"
+    return {"canonical_habit_name": name, "habit_category": category, "confidence": confidence}
+
+
+def canonicalize(text: str) -> Optional[Dict[str, str]]:
+    """
+    {"canonical_habit_name", "habit_category", "confidence"} in the shape the
+    LLM returns, or None when nothing in the text looks like known slang.
+    """
+    tokens = tokenize(text)
+    spans = match_slang(tokens)
+    covered = {i for start, end, _ in spans for i in range(start, end)}
+    fuzzy = [match for i, match in enumerate(map(fuzzy_match, tokens)) if match is not None and i not in covered]
+
+    votes = [category for _, _, category in spans] + [SLANG_TO_CATEGORY[entry] for _, entry in fuzzy]
+    if not votes:
+        return None
+    ranked = TermCounter(votes).most_common()
+    category = ranked[0][0]
+    slang = [" ".join(tokens[start:end]) for start, end, _ in spans] + [entry for _, entry in fuzzy]
+
+    if len(ranked) > 1:
+        # Conflicting words: a majority from exact matches alone is still fairly
+        # safe; one carried by fuzzy guesses is not.
+        exact = sum(1 for _, _, c in spans if c == category)
+        clear = exact > ranked[1][1]
+        return _result(category, slang, "medium" if clear else "low")
+    if spans:
+        return _result(category, slang, "high")
+    # Fuzzy only: one word is a guess; two distinct words agreeing is a second signal.
+    corroborated = len({entry for _, entry in fuzzy}) > 1
+    distance = max(distance for distance, _ in fuzzy)
+    return _result(category, slang, "medium" if corroborated and distance <= 1 else "low")
+
+
+def local_canonical(text: str) -> Optional[Dict[str, str]]:
+    """
+    `canonicalize` when it clears MIN_CONFIDENCE, else None (ask the LLM).
+    """
+    if not LOCAL_CANONICALIZE_ENABLED:
+        return None
+    result = canonicalize(text)
+    LOCAL_CANONICALIZATIONS.inc(confidence=result["confidence"] if result else "none")
+    if result is None:
+        return None
+    if CONFIDENCE_LEVELS.index(result["confidence"]) < CONFIDENCE_LEVELS.index(MIN_CONFIDENCE):
+        return None
+    return result
@@ -0,0 +1,260 @@
+# habit_lexicon.py
+"""
+Local slang / spelling normalization for habit descriptions.
+
+Mirrors the slang table in CANONICALIZE_PROMPT so that "zyn", "Zyn pouches"
+and "nicotine pouches all day" fold to the same normalized text without an
+LLM call.
+"""
+import re
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+# Leetspeak / symbol substitutions users use to dodge filters ("p0rn", "$moking").
+LEET_MAP = str.maketrans({
+    "0": "o",
+    "1": "i",
+    "3": "e",
+    "4": "a",
+    "5": "s",
+    "7": "t",
+    "$": "s",
+    "@": "a",
+    "!": "i",
+    "*": "",
+})
+
+# Phrase or token -> habit category (categories as emitted by QUIZ_SUMMARY_PROMPT).
+SLANG_TO_CATEGORY: Dict[str, str] = {
+    # pornography
+    "prn": "pornography",
+    "porn": "pornography",
+    "phn": "pornography",
+    "fap": "pornography",
+    "fapping": "pornography",
+    "hub": "pornography",
+    "nsfw": "pornography",
+    "pornography": "pornography",
+    "adult videos": "pornography",
+    # smoking
+    "smoking": "nicotine_smoking",
+    "smokin": "nicotine_smoking",
+    "smoke": "nicotine_smoking",
+    "smk": "nicotine_smoking",
+    "smok": "nicotine_smoking",
+    "cig": "nicotine_smoking",
+    "cigs": "nicotine_smoking",
+    "cigarette": "nicotine_smoking",
+    "cigarettes": "nicotine_smoking",
+    "loosie": "nicotine_smoking",
+    "loosies": "nicotine_smoking",
+    # vaping
+    "vape": "nicotine_vaping",
+    "vaping": "nicotine_vaping",
+    "vapes": "nicotine_vaping",
+    "juul": "nicotine_vaping",
+    "elf bar": "nicotine_vaping",
+    "e-cig": "nicotine_vaping",
+    # oral nicotine
+    "zyn": "nicotine_oral",
+    "zyns": "nicotine_oral",
+    "pouch": "nicotine_oral",
+    "pouches": "nicotine_oral",
+    "nicotine pouches": "nicotine_oral",
+    "nic pouches": "nicotine_oral",
+    "oral nic": "nicotine_oral",
+    "nic": "nicotine_oral",
+    "nk": "nicotine_oral",
+    "snus": "nicotine_oral",
+    "velo": "nicotine_oral",
+    # social media / screens
+    "tiktok": "social_media",
+    "tik tok": "social_media",
+    "reels": "social_media",
+    "shorts": "social_media",
+    "instagram": "social_media",
+    "insta": "social_media",
+    "doomscrolling": "social_media",
+    "doom scrolling": "social_media",
+    "scrolling": "social_media",
+    "scroll": "social_media",
+    "social media": "social_media",
+    "youtube": "social_media",
+    "twitter": "social_media",
+    "gaming": "gaming",
+    "video games": "gaming",
+    "fortnite": "gaming",
+    # food
+    "overeating": "food_overeating",
+    "binge eating": "food_overeating",
+    "late-night eating": "food_overeating",
+    "late night eating": "food_overeating",
+    "junk cravings": "food_overeating",
+    "junk food": "food_overeating",
+    "snacking": "food_overeating",
+    "sugar": "food_overeating",
+    "sweets": "food_overeating",
+    # spending / gambling
+    "online shopping": "shopping_spending",
+    "shopping": "shopping_spending",
+    "impulse buying": "shopping_spending",
+    "gambling": "gambling",
+    "betting": "gambling",
+    "sports betting": "gambling",
+    "casino": "gambling",
+    # substances
+    # Not bare "drinking": "drinking coffee" / "drinking soda" aren't alcohol.
+    "alcohol": "alcohol",
+    "drinking alcohol": "alcohol",
+    "drinking beer": "alcohol",
+    "drinking wine": "alcohol",
+    "binge drinking": "alcohol",
+    "beer": "alcohol",
+    "wine": "alcohol",
+    "booze": "alcohol",
+    "weed": "cannabis",
+    "cannabis": "cannabis",
+    "marijuana": "cannabis",
+    "smoking weed": "cannabis",
+    "thc": "cannabis",
+    "edibles": "cannabis",
+    # procrastination
+    "procrastination": "procrastination",
+    "procrastinating": "procrastination",
+    "procrastinate": "procrastination",
+}
+
+# Slang -> the product it names, where several entries name the same one.
+# Anything not listed names itself ("beer", "wine", "tiktok", "twitter").
+SLANG_TO_PRODUCT: Dict[str, str] = {
+    "prn": "porn", "phn": "porn", "fap": "porn", "fapping": "porn", "hub": "porn", "nsfw": "porn",
+    "pornography": "porn", "adult videos": "porn",
+    "smoking": "cigarettes", "smokin": "cigarettes", "smoke": "cigarettes", "smk": "cigarettes",
+    "smok": "cigarettes", "cig": "cigarettes", "cigs": "cigarettes", "cigarette": "cigarettes",
+    "loosie": "cigarettes", "loosies": "cigarettes",
+    "vaping": "vape", "vapes": "vape", "e-cig": "vape",
+    "zyns": "zyn",
+    "pouch": "nicotine pouches", "pouches": "nicotine pouches", "nic pouches": "nicotine pouches",
+    "oral nic": "nicotine pouches", "nic": "nicotine pouches", "nk": "nicotine pouches",
+    "tik tok": "tiktok",
+    "insta": "instagram", "reels": "instagram",
+    "shorts": "youtube",
+    "doomscrolling": "scrolling", "doom scrolling": "scrolling", "scroll": "scrolling",
+    "video games": "gaming",
+    "binge eating": "overeating", "late-night eating": "overeating", "late night eating": "overeating",
+    "junk cravings": "junk food", "sweets": "sugar",
+    "online shopping": "shopping", "impulse buying": "shopping",
+    "betting": "gambling", "sports betting": "gambling", "casino": "gambling",
+    "drinking alcohol": "alcohol", "binge drinking": "alcohol", "booze": "alcohol",
+    "drinking beer": "beer", "drinking wine": "wine",
+    "weed": "cannabis", "marijuana": "cannabis", "smoking weed": "cannabis", "thc": "cannabis",
+    "procrastinating": "procrastination", "procrastinate": "procrastination",
+}
+
+# Generic verbs that only name a habit when nothing more specific does:
+# "I smoke" is cigarettes, "I smoke weed" is cannabis.
+AMBIGUOUS_SLANG = frozenset({"smoke", "smoking", "smokin", "smk", "smok"})
+
+# Products that name a whole category; a brand or platform next to one wins.
+GENERIC_PRODUCTS = frozenset({
+    "porn", "cigarettes", "vape", "nicotine pouches", "scrolling", "social media", "gaming",
+    "overeating", "shopping", "gambling", "alcohol", "cannabis", "procrastination",
+})
+
+# Words that carry no habit identity ("I use zyn too much all day").
+FILLER_WORDS = frozenset({
+    "i", "im", "i'm", "me", "my", "a", "an", "the", "to", "too", "much", "many",
+    "all", "day", "days", "every", "really", "so", "very", "addicted", "addiction",
+    "habit", "use", "using", "do", "doing", "want", "stop", "quit", "reduce", "cant",
+    "can't", "and", "of", "on", "in", "it", "is", "am", "way", "lot", "always",
+    "constantly", "keep", "problem", "with", "about", "need", "help",
+    "night", "nights", "daily", "everyday", "often",
+})
+
+_TOKEN = re.compile(r"[a-z][a-z'\-]*")
+_MAX_PHRASE_WORDS = max(len(k.split()) for k in SLANG_TO_CATEGORY)
+
+
+def fold(text: str) -> str:
+    """
+    Lowercase and undo leetspeak substitutions.
+    """
+    return (text or "").lower().translate(LEET_MAP)
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(fold(text))
+
+
+def match_slang(tokens: List[str]) -> List[Tuple[int, int, str]]:
+    """
+    Greedy longest-phrase matching of slang entries.
+    Returns (start, end, category) spans over `tokens`.
+    """
+    spans: List[Tuple[int, int, str]] = []
+    i = 0
+    while i < len(tokens):
+        for size in range(min(_MAX_PHRASE_WORDS, len(tokens) - i), 0, -1):
+            phrase = " ".join(tokens[i:i + size])
+            category = SLANG_TO_CATEGORY.get(phrase)
+            if category is not None:
+                spans.append((i, i + size, category))
+                i += size
+                break
+        else:
+            i += 1
+    return spans
+
+
+def product_of(slang: str) -> str:
+    return SLANG_TO_PRODUCT.get(slang, slang)
+
+
+def normalize_habit(text: str) -> Tuple[str, Optional[str], FrozenSet[str]]:
+    """
+    Normalize a habit description to (normalized_text, detected_category, products).
+
+    Slang phrases are replaced by the product they name, filler words are
+    dropped and duplicate tokens collapsed, so "nic pouches" and "nicotine
+    pouches all day" both become "nicotine pouches", while "zyn", "tiktok"
+    and "instagram" stay distinct. A generic verb like "smoke" is dropped
+    when a more specific habit word is present, and a generic product
+    ("nicotine pouches") when a brand of the same category is ("zyn").
+    """
+    tokens = tokenize(text)
+    spans = match_slang(tokens)
+    skipped: Set[int] = set()
+    specific = [span for span in spans if " ".join(tokens[span[0]:span[1]]) not in AMBIGUOUS_SLANG]
+    if specific and len(specific) < len(spans):
+        skipped = {i for span in spans if span not in specific for i in range(span[0], span[1])}
+        spans = specific
+
+    out: List[str] = []
+    categories: List[str] = []
+    product_category: Dict[str, str] = {}
+    span_at = {start: (end, category) for start, end, category in spans}
+    i = 0
+    while i < len(tokens):
+        if i in span_at:
+            end, category = span_at[i]
+            categories.append(category)
+            product = product_of(" ".join(tokens[i:end]))
+            product_category[product] = category
+            if product not in out:
+                out.append(product)
+            i = end
+            continue
+        token = tokens[i]
+        if i not in skipped and token not in FILLER_WORDS and token not in out:
+            out.append(token)
+        i += 1
+
+    # "Zyn pouches" is Zyn: a generic product yields to a specific one of its category.
+    subsumed = {
+        product for product, category in product_category.items()
+        if product in GENERIC_PRODUCTS
+        and any(other != product and c == category for other, c in product_category.items())
+    }
+    out = [word for word in out if word not in subsumed]
+
+    category = max(categories, key=categories.count) if categories else None
+    return " ".join(out), category, frozenset(product_category.keys() - subsumed)
@@ -0,0 +1,192 @@
+# health.py
+"""
+Fallback-rate tracking.
+
+Every node swallows LLM failures into a canned answer, so an upstream
+problem (throttling, timeouts, a model returning junk) shows up first as a
+rising fallback rate rather than as errors. This module counts each
+fallback path by node and reason, counts the day_tasks backfilled into
+21-day plans, and keeps a rolling window of node runs for a health summary.
+Runs answered locally (pre-filter, template plan) are counted apart: they
+say nothing about the LLM, and would otherwise dilute the rate that
+decides when plan21 switches to templates.
+
+Reasons are the retry_policy error classes (timeout, rate_limit, server,
+connection, parse, fatal) where an exception caused the fallback, or a
+node-specific reason such as "empty_response" or "no_summary".
+
+A node whose fallback rate crosses a threshold logs a warning on the
+"unhabit.health" logger once, when its status worsens.
+
+Configuration (env):
+- UNHABIT_HEALTH_WINDOW=300         seconds covered by the rolling summary
+- UNHABIT_HEALTH_MIN_RUNS=10        runs needed before a node can leave "ok"
+- UNHABIT_FALLBACK_WARN_RATE=0.05
+- UNHABIT_FALLBACK_CRITICAL_RATE=0.2
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from metrics import counter, histogram
+
+HEALTH_WINDOW = float(os.getenv("UNHABIT_HEALTH_WINDOW", "300"))
+HEALTH_MIN_RUNS = int(os.getenv("UNHABIT_HEALTH_MIN_RUNS", "10"))
+FALLBACK_WARN_RATE = float(os.getenv("UNHABIT_FALLBACK_WARN_RATE", "0.05"))
+FALLBACK_CRITICAL_RATE = float(os.getenv("UNHABIT_FALLBACK_CRITICAL_RATE", "0.2"))
+
+OK, WARN, CRITICAL = "ok", "warn", "critical"
+_SEVERITY = {OK: 0, WARN: 1, CRITICAL: 2}
+
+logger = logging.getLogger("unhabit.health")
+
+FALLBACKS = counter(
+    "unhabit_fallbacks_total",
+    "Node outputs replaced by a canned fallback, by node and reason.",
+    labelnames=("node", "reason"),
+)
+PLAN_DAYS_BACKFILLED = counter(
+    "unhabit_plan21_days_backfilled_total",
+    "day_tasks entries the plan sanitizer filled in from the fallback plan.",
+)
+PLAN_DAYS_BACKFILLED_PER_PLAN = histogram(
+    "unhabit_plan21_days_backfilled",
+    "day_tasks entries backfilled per generated plan (21 = nothing usable).",
+    buckets=(0, 1, 2, 3, 5, 10, 20, 21),
+)
+
+
+def record_fallback(node: str, reason: str) -> None:
+    FALLBACKS.inc(node=node, reason=reason)
+
+
+def record_backfill(days: int) -> None:
+    PLAN_DAYS_BACKFILLED_PER_PLAN.observe(days)
+    if days:
+        PLAN_DAYS_BACKFILLED.inc(days)
+
+
+def fallback_status(rate: float, runs: int) -> str:
+    if runs < HEALTH_MIN_RUNS:
+        return OK
+    if rate >= FALLBACK_CRITICAL_RATE:
+        return CRITICAL
+    if rate >= FALLBACK_WARN_RATE:
+        return WARN
+    return OK
+
+
+# ---------- Rolling window ----------
+
+class HealthWindow:
+    """
+    Node runs from the last `window` seconds: (time, fell back?, reason).
+    """
+
+    def __init__(self, window: float = HEALTH_WINDOW, max_events: int = 10_000):
+        self.window = window
+        self.max_events = max_events
+        self._events: Dict[str, Deque[Tuple[float, bool, Optional[str]]]] = {}
+        self._local: Dict[str, Deque[Tuple[float, bool, Optional[str]]]] = {}
+        self._status: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def _prune(self, events: Deque[Tuple[float, bool, Optional[str]]], now: float) -> None:
+        while events and events[0][0] < now - self.window:
+            events.popleft()
+
+    def record(self, node: str, fallback: bool, reason: Optional[str] = None, local: bool = False) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if local:
+                events = self._local.setdefault(node, deque(maxlen=self.max_events))
+                events.append((now, False, None))
+                self._prune(events, now)
+                return
+            events = self._events.setdefault(node, deque(maxlen=self.max_events))
+            events.append((now, fallback, reason))
+            self._prune(events, now)
+            if not fallback:
+                return
+            # Only a fallback can make things worse; check then.
+            runs = len(events)
+            rate = sum(1 for _, fell_back, _ in events if fell_back) / runs
+            status = fallback_status(rate, runs)
+            previous = self._status.get(node, OK)
+            self._status[node] = status
+        if _SEVERITY[status] > _SEVERITY[previous]:
+            logger.warning(
+                "fallback rate for %s is %.1f%% over the last %.0fs (%d runs): %s",
+                node, rate * 100, self.window, runs, status,
+            )
+
+    def status(self, node: str) -> str:
+        """
+        The node's current status over the window (OK when it has no runs).
+        """
+        now = time.monotonic()
+        with self._lock:
+            events = self._events.get(node)
+            if not events:
+                return OK
+            self._prune(events, now)
+            runs = len(events)
+            if not runs:
+                return OK
+            rate = sum(1 for _, fell_back, _ in events if fell_back) / runs
+        return fallback_status(rate, runs)
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        {"status": worst node status, "window_seconds": ..., "nodes": {node: {...}}}.
+        """
+        now = time.monotonic()
+        nodes: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            for node, events in sorted(self._events.items()):
+                self._prune(events, now)
+                runs = len(events)
+                if not runs:
+                    continue
+                reasons: Dict[str, int] = {}
+                for _, fell_back, reason in events:
+                    if fell_back:
+                        reasons[reason or "unknown"] = reasons.get(reason or "unknown", 0) + 1
+                fallbacks = sum(reasons.values())
+                rate = fallbacks / runs
+                status = fallback_status(rate, runs)
+                self._status[node] = status
+                nodes[node] = {
+                    "runs": runs,
+                    "fallbacks": fallbacks,
+                    "fallback_rate": round(rate, 4),
+                    "reasons": reasons,
+                    "status": status,
+                }
+
+            local_runs = {}
+            for node, events in sorted(self._local.items()):
+                self._prune(events, now)
+                if events:
+                    local_runs[node] = len(events)
+
+        worst = max((n["status"] for n in nodes.values()), key=_SEVERITY.get, default=OK)
+        return {"status": worst, "window_seconds": self.window, "nodes": nodes, "local_runs": local_runs}
+
+
+HEALTH = HealthWindow()
+
+
+def record_run(node: str, fallback: bool, reason: Optional[str] = None, local: bool = False) -> None:
+    HEALTH.record(node, fallback, reason, local)
+
+
+def health_summary() -> Dict[str, Any]:
+    return HEALTH.summary()
+
+
+def node_status(node: str) -> str:
+    return HEALTH.status(node)
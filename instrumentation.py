@@ -0,0 +1,469 @@
+# instrumentation.py
+"""
+Per-node latency, token and cost instrumentation for LLM calls.
+
+Two levels are recorded:
+- every LLM request (by GovernedChatOpenAI in llm_clients): wall time,
+  time to first token for streams, prompt/completion tokens, model, cost;
+- every node run (`@instrumented("plan21")` in ai_nodes): wall time, the
+  LLM calls it made, retries, and whether it was served from cache,
+  answered by local rules, or fell back to a canned answer.
+
+Both are exported as Prometheus counters/histograms through metrics.py
+(GET /metrics on the API, or `metrics.start_metrics_server()`) and as one
+JSON log line each on the "unhabit.llm" logger. `summary()` aggregates the
+recent node runs for the Streamlit sidebar; fallbacks also feed the rolling
+health window in health.py.
+
+The node label of an LLM call comes from an `llm_node="coach"` call kwarg,
+else from the `llm_node()` context (set by the retry wrappers).
+
+Configuration (env):
+- UNHABIT_INSTRUMENTATION_LOG=1    print the JSON lines to stderr
+- UNHABIT_LLM_PRICES="gpt-4.1=2/8,gpt-4.1-mini=0.4/1.6"  USD per 1M input/output tokens
+"""
+import functools
+import inspect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from health import record_fallback, record_run
+from metrics import counter, histogram
+
+logger = logging.getLogger("unhabit.llm")
+if os.getenv("UNHABIT_INSTRUMENTATION_LOG", "0") == "1" and not logger.handlers:
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+# USD per 1M tokens (input, output); models not listed are costed at 0.
+LLM_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4.1": (2.0, 8.0),
+    "gpt-4.1-mini": (0.4, 1.6),
+    "gpt-4.1-nano": (0.1, 0.4),
+}
+for _part in filter(None, (p.strip() for p in os.getenv("UNHABIT_LLM_PRICES", "").split(","))):
+    _model, _, _prices = _part.partition("=")
+    _input, _, _output = _prices.partition("/")
+    LLM_PRICES[_model.strip()] = (float(_input or 0), float(_output or 0))
+
+# TTFT is much shorter than a full reply; finer low buckets.
+_TTFT_BUCKETS = (0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0)
+
+LLM_CALLS = counter(
+    "unhabit_llm_calls_total",
+    "LLM requests by node, model and status (ok, error, cancelled).",
+    labelnames=("node", "model", "status"),
+)
+LLM_CALL_SECONDS = histogram(
+    "unhabit_llm_call_seconds",
+    "Wall time of one LLM request, rate-limiter queueing included.",
+    labelnames=("node", "model"),
+)
+LLM_TTFT_SECONDS = histogram(
+    "unhabit_llm_ttft_seconds",
+    "Time to the first streamed token.",
+    labelnames=("node", "model"),
+    buckets=_TTFT_BUCKETS,
+)
+LLM_TOKENS = counter(
+    "unhabit_llm_tokens_total",
+    "LLM tokens by node, model and kind (prompt, completion).",
+    labelnames=("node", "model", "kind"),
+)
+LLM_COST = counter(
+    "unhabit_llm_cost_usd_total",
+    "Estimated LLM spend in USD (see UNHABIT_LLM_PRICES).",
+    labelnames=("node", "model"),
+)
+NODE_SECONDS = histogram(
+    "unhabit_node_seconds",
+    "Wall time of one node run.",
+    labelnames=("node",),
+)
+NODE_RUNS = counter(
+    "unhabit_node_runs_total",
+    "Node runs by outcome (llm, cache_hit, local, fallback, error).",
+    labelnames=("node", "outcome"),
+)
+
+
+def cost_usd(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    input_price, output_price = LLM_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+def _log(event: str, **fields: Any) -> None:
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({"event": event, "ts": round(time.time(), 3), **fields}, default=str))
+
+
+# ---------- Node spans ----------
+
+class NodeSpan:
+    """
+    What one node run did. Filled in by the LLM calls and mark_* helpers
+    that run inside it.
+    """
+
+    def __init__(self, node: str):
+        self.node = node
+        self.started = time.monotonic()
+        self.seconds = 0.0
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = 0.0
+        self.retries = 0
+        self.ttft: Optional[float] = None
+        self.models: List[str] = []
+        self.cache_hit = False
+        self.local = False
+        self.fallback = False
+        self.fallback_reason: Optional[str] = None
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def add_call(
+        self,
+        model: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        cost: float,
+        first_token_at: Optional[float] = None,
+    ) -> None:
+        # Hedged and speculative calls can finish on other threads.
+        with self._lock:
+            self.llm_calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cost_usd += cost
+            if model not in self.models:
+                self.models.append(model)
+            if first_token_at is not None and self.ttft is None:
+                # From the start of the node: what the user actually waited.
+                self.ttft = first_token_at - self.started
+
+    @property
+    def outcome(self) -> str:
+        if self.error:
+            return "error"
+        if self.fallback:
+            return "fallback"
+        if self.cache_hit and not self.llm_calls:
+            return "cache_hit"
+        if self.local and not self.llm_calls:
+            return "local"
+        return "llm"
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "node": self.node,
+            "outcome": self.outcome,
+            "seconds": round(self.seconds, 4),
+            "ttft": None if self.ttft is None else round(self.ttft, 4),
+            "llm_calls": self.llm_calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost_usd": round(self.cost_usd, 6),
+            "retries": self.retries,
+            "models": list(self.models),
+            "cache_hit": self.cache_hit,
+            "local": self.local,
+            "fallback": self.fallback,
+            "fallback_reason": self.fallback_reason,
+            "error": self.error,
+        }
+
+
+_span: ContextVar[Optional[NodeSpan]] = ContextVar("unhabit_node_span", default=None)
+_node: ContextVar[Optional[str]] = ContextVar("unhabit_llm_node", default=None)
+
+# Recent node runs for summary(); Prometheus keeps the long-run totals.
+_recent: Deque[Dict[str, Any]] = deque(maxlen=int(os.getenv("UNHABIT_INSTRUMENTATION_RECENT", "500")))
+_recent_lock = threading.Lock()
+
+
+def current_span() -> Optional[NodeSpan]:
+    return _span.get()
+
+
+def current_node() -> str:
+    span = _span.get()
+    return _node.get() or (span.node if span else "unknown")
+
+
+@contextmanager
+def llm_node(name: str) -> Iterator[None]:
+    """
+    Label LLM calls in this block (and tasks started from it) as node `name`.
+    """
+    token = _node.set(name)
+    try:
+        yield
+    finally:
+        _node.reset(token)
+
+
+def mark_cache_hit() -> None:
+    span = _span.get()
+    if span is not None:
+        span.cache_hit = True
+
+
+def mark_local() -> None:
+    """
+    The node answered from local rules (e.g. the safety pre-filter) without an LLM call.
+    """
+    span = _span.get()
+    if span is not None:
+        span.local = True
+
+
+def mark_fallback(reason: str, node: Optional[str] = None) -> None:
+    """
+    Count a fallback path. Without `node` it belongs to the current span's
+    node; a different `node` (e.g. chat_summary inside coach, or a batch
+    stage with no span) is counted without marking the span.
+    """
+    span = _span.get()
+    if node is None or (span is not None and node == span.node):
+        if span is not None:
+            span.fallback = True
+            span.fallback_reason = span.fallback_reason or reason
+        node = current_node()
+    record_fallback(node, reason)
+
+
+def mark_retry() -> None:
+    span = _span.get()
+    if span is not None:
+        with span._lock:
+            span.retries += 1
+
+
+def _finish(span: NodeSpan, error: Optional[BaseException] = None) -> None:
+    span.seconds = time.monotonic() - span.started
+    if error is not None:
+        span.error = type(error).__name__
+    NODE_SECONDS.observe(span.seconds, node=span.node)
+    NODE_RUNS.inc(node=span.node, outcome=span.outcome)
+    record_run(span.node, span.fallback or bool(span.error), span.fallback_reason or span.error,
+               local=span.outcome == "local")
+    record = span.as_dict()
+    with _recent_lock:
+        _recent.append(record)
+    _log("node", **record)
+
+
+def instrumented(node: str) -> Callable:
+    """
+    Decorator: record a span for every run of a node function. Works on plain
+    and async functions and on (async) generators, where the span covers the
+    whole iteration.
+    """
+    def decorate(fn: Callable) -> Callable:
+        if inspect.isasyncgenfunction(fn):
+            @functools.wraps(fn)
+            async def agen_wrapper(*args, **kwargs):
+                span = NodeSpan(node)
+                agen = fn(*args, **kwargs)
+                try:
+                    while True:
+                        # The span is current only while the generator body runs,
+                        # so it never leaks into the consumer between items.
+                        token = _span.set(span)
+                        try:
+                            item = await agen.__anext__()
+                        except StopAsyncIteration:
+                            break
+                        finally:
+                            _span.reset(token)
+                        yield item
+                except GeneratorExit:
+                    # The consumer stopped early (e.g. client went away).
+                    _finish(span)
+                    raise
+                except BaseException as exc:
+                    _finish(span, exc)
+                    raise
+                finally:
+                    await agen.aclose()
+                _finish(span)
+            return agen_wrapper
+
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def gen_wrapper(*args, **kwargs):
+                span = NodeSpan(node)
+                gen = fn(*args, **kwargs)
+                try:
+                    while True:
+                        token = _span.set(span)
+                        try:
+                            item = next(gen)
+                        except StopIteration:
+                            break
+                        finally:
+                            _span.reset(token)
+                        yield item
+                except GeneratorExit:
+                    # The consumer stopped early (e.g. client went away).
+                    _finish(span)
+                    raise
+                except BaseException as exc:
+                    _finish(span, exc)
+                    raise
+                finally:
+                    gen.close()
+                _finish(span)
+            return gen_wrapper
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                span = NodeSpan(node)
+                token = _span.set(span)
+                try:
+                    result = await fn(*args, **kwargs)
+                except BaseException as exc:
+                    _finish(span, exc)
+                    raise
+                finally:
+                    _span.reset(token)
+                _finish(span)
+                return result
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            span = NodeSpan(node)
+            token = _span.set(span)
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as exc:
+                _finish(span, exc)
+                raise
+            finally:
+                _span.reset(token)
+            _finish(span)
+            return result
+        return wrapper
+
+    return decorate
+
+
+# ---------- LLM calls ----------
+
+class LLMCall:
+    """
+    Timer for one LLM request; created by GovernedChatOpenAI around the SDK call.
+    """
+
+    def __init__(self, model: str, node: Optional[str] = None):
+        self.model = model
+        self.node = node or current_node()
+        self.span = _span.get()
+        self.started = time.monotonic()
+        self.ttft: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+
+    def first_token(self) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+            self.ttft = self.first_token_at - self.started
+            LLM_TTFT_SECONDS.observe(self.ttft, node=self.node, model=self.model)
+
+    def finish(self, prompt_tokens: int, completion_tokens: int, estimated: bool = False) -> None:
+        seconds = time.monotonic() - self.started
+        cost = cost_usd(self.model, prompt_tokens, completion_tokens)
+        labels = {"node": self.node, "model": self.model}
+        LLM_CALLS.inc(status="ok", **labels)
+        LLM_CALL_SECONDS.observe(seconds, **labels)
+        LLM_TOKENS.inc(prompt_tokens, kind="prompt", **labels)
+        LLM_TOKENS.inc(completion_tokens, kind="completion", **labels)
+        LLM_COST.inc(cost, **labels)
+        if self.span is not None:
+            self.span.add_call(self.model, prompt_tokens, completion_tokens, cost, self.first_token_at)
+        _log(
+            "llm_call",
+            status="ok",
+            seconds=round(seconds, 4),
+            ttft=None if self.ttft is None else round(self.ttft, 4),
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            tokens_estimated=estimated,
+            cost_usd=round(cost, 6),
+            **labels,
+        )
+
+    def fail(self, exc: BaseException) -> None:
+        # CancelledError is a BaseException: the losing half of a hedge.
+        status = "error" if isinstance(exc, Exception) else "cancelled"
+        seconds = time.monotonic() - self.started
+        LLM_CALLS.inc(node=self.node, model=self.model, status=status)
+        _log(
+            "llm_call",
+            status=status,
+            error=type(exc).__name__,
+            seconds=round(seconds, 4),
+            node=self.node,
+            model=self.model,
+        )
+
+
+# ---------- Summary ----------
+
+def recent(limit: int = 20) -> List[Dict[str, Any]]:
+    with _recent_lock:
+        return list(_recent)[-limit:]
+
+
+def reset() -> None:
+    """
+    Forget recent runs (Prometheus totals are kept); used between benchmark scenarios.
+    """
+    with _recent_lock:
+        _recent.clear()
+
+
+def summary() -> Dict[str, Dict[str, Any]]:
+    """
+    Per-node aggregates over the recent runs (for the sidebar panel).
+    """
+    with _recent_lock:
+        records = list(_recent)
+
+    by_node: Dict[str, List[Dict[str, Any]]] = {}
+    for record in records:
+        by_node.setdefault(record["node"], []).append(record)
+
+    out: Dict[str, Dict[str, Any]] = {}
+    for node, runs in sorted(by_node.items()):
+        seconds = sorted(r["seconds"] for r in runs)
+        ttfts = [r["ttft"] for r in runs if r["ttft"] is not None]
+        out[node] = {
+            "runs": len(runs),
+            "p50_seconds": seconds[len(seconds) // 2],
+            "p95_seconds": seconds[min(len(seconds) - 1, int(0.95 * len(seconds)))],
+            "avg_ttft": round(sum(ttfts) / len(ttfts), 4) if ttfts else None,
+            "llm_calls": sum(r["llm_calls"] for r in runs),
+            "prompt_tokens": sum(r["prompt_tokens"] for r in runs),
+            "completion_tokens": sum(r["completion_tokens"] for r in runs),
+            "cost_usd": round(sum(r["cost_usd"] for r in runs), 6),
+            "retries": sum(r["retries"] for r in runs),
+            "cache_hits": sum(1 for r in runs if r["cache_hit"]),
+            "local": sum(1 for r in runs if r["local"]),
+            "fallbacks": sum(1 for r in runs if r["fallback"]),
+            "errors": sum(1 for r in runs if r["error"]),
+        }
+    return out
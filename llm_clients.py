@@ -0,0 +1,441 @@
+# llm_clients.py
+"""
+Process-wide registry of reusable chat model clients.
+
+Building a ChatOpenAI (and its `with_structured_output` wrapper) per call
+re-creates the underlying OpenAI SDK client and its HTTP connection pool.
+The registry hands out cached runnables keyed by
+(model, temperature, response_format, schema), all sharing one pooled
+httpx client per process, with a bounded LRU so unusual parameter
+combinations cannot grow it forever.
+
+Every model is a GovernedChatOpenAI, so all calls (invoke, stream, batch,
+structured output) queue through the shared rate limiter in rate_limiter.py
+and are timed and costed by instrumentation.py.
+
+To run against a local OpenAI-compatible server, point the OpenAI SDK at it
+with OPENAI_BASE_URL (or OPENAI_API_BASE) and any non-empty OPENAI_API_KEY.
+For in-process fakes (benchmarks), build a registry with custom httpx
+transports and install it with `set_registry`; everything above the HTTP
+layer (SDK, rate limiter, retries, instrumentation) still runs. Work that
+runs on an event loop of its own (batch_runner) uses `use_registry` with a
+private registry, since the shared async pool is bound to its first loop.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, Hashable, Iterator, List, Optional, Tuple, Type
+
+import httpx
+import openai
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_core.runnables import Runnable
+from langchain_openai import ChatOpenAI
+from pydantic import BaseModel
+
+from coach_context import count_tokens
+from instrumentation import LLMCall
+from rate_limiter import COMPLETION_ESTIMATE, Lease, ModelLimiter, get_rate_limiter
+
+MAX_CLIENTS = int(os.getenv("UNHABIT_LLM_CLIENT_CACHE_SIZE", "32"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("UNHABIT_HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("UNHABIT_HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("UNHABIT_HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_TIMEOUT = float(os.getenv("UNHABIT_HTTP_TIMEOUT", "120"))
+SDK_MAX_RETRIES = int(os.getenv("UNHABIT_SDK_MAX_RETRIES", "0"))
+
+
+def _format_key(response_format: Optional[Dict[str, Any]]) -> Optional[str]:
+    """
+    Dicts are not hashable, so response_format is keyed by its canonical JSON.
+    """
+    if response_format is None:
+        return None
+    return json.dumps(response_format, sort_keys=True)
+
+
+# ---------- Rate-limited model ----------
+
+def _prompt_tokens(messages: List[BaseMessage]) -> int:
+    return sum(
+        count_tokens(m.content if isinstance(m.content, str) else str(m.content)) + 4
+        for m in messages
+    )
+
+
+def _result_tokens(result: ChatResult) -> Optional[int]:
+    usage = (result.llm_output or {}).get("token_usage") or {}
+    if usage.get("total_tokens"):
+        return int(usage["total_tokens"])
+    for generation in result.generations:
+        metadata = getattr(generation.message, "usage_metadata", None)
+        if metadata:
+            return int(metadata["total_tokens"])
+    return None
+
+
+def _chunk_tokens(chunk: ChatGenerationChunk) -> Optional[int]:
+    metadata = getattr(chunk.message, "usage_metadata", None)
+    return int(metadata["total_tokens"]) if metadata else None
+
+
+def _usage_split(result: ChatResult) -> Optional[Tuple[int, int]]:
+    """
+    (prompt, completion) tokens reported by the provider, if any.
+    """
+    usage = (result.llm_output or {}).get("token_usage") or {}
+    if usage.get("total_tokens"):
+        return int(usage.get("prompt_tokens") or 0), int(usage.get("completion_tokens") or 0)
+    for generation in result.generations:
+        metadata = getattr(generation.message, "usage_metadata", None)
+        if metadata:
+            return int(metadata.get("input_tokens") or 0), int(metadata.get("output_tokens") or 0)
+    return None
+
+
+def _finish_call(call: LLMCall, messages: List[BaseMessage], usage: Optional[Tuple[int, int]], text: str) -> None:
+    # Streams only carry usage when the provider sends it; estimate otherwise.
+    if usage is not None:
+        call.finish(*usage)
+    else:
+        call.finish(_prompt_tokens(messages), count_tokens(text), estimated=True)
+
+
+def _chunk_usage(chunk: ChatGenerationChunk) -> Optional[Tuple[int, int]]:
+    metadata = getattr(chunk.message, "usage_metadata", None)
+    if not metadata:
+        return None
+    return int(metadata.get("input_tokens") or 0), int(metadata.get("output_tokens") or 0)
+
+
+class GovernedChatOpenAI(ChatOpenAI):
+    """
+    ChatOpenAI whose requests wait for a grant from the shared rate limiter.
+
+    Priority comes from an `llm_priority="coach"` call kwarg
+    (`llm.invoke(prompt, llm_priority="coach")`, also accepted by stream and
+    batch) or else from the `rate_limiter.llm_priority()` context. The
+    instrumentation node label works the same way (`llm_node=` kwarg or
+    `instrumentation.llm_node()`).
+
+    A `timeout=` kwarg (the attempt's time left) also bounds the wait for a
+    grant, and the request gets whatever is left after queueing.
+    """
+
+    def _limiter(self) -> Optional[ModelLimiter]:
+        return get_rate_limiter().for_model(self.model_name)
+
+    def _estimate(self, messages: List[BaseMessage], max_tokens: Optional[int] = None) -> int:
+        # `max_tokens` is the per-call cap (`llm.bind(max_tokens=...)`), if any.
+        return _prompt_tokens(messages) + (max_tokens or self.max_tokens or COMPLETION_ESTIMATE)
+
+    @staticmethod
+    def _after_queue(lease: Lease, kwargs: Dict[str, Any]) -> None:
+        if kwargs.get("timeout") is not None:
+            kwargs["timeout"] = max(kwargs["timeout"] - lease.waited, 0.001)
+
+    @staticmethod
+    def _failed(limiter: ModelLimiter, lease: Lease, exc: BaseException) -> None:
+        if isinstance(exc, openai.RateLimitError):
+            limiter.throttled()
+        limiter.release(lease)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        priority = kwargs.pop("llm_priority", None)
+        call = LLMCall(self.model_name, kwargs.pop("llm_node", None))
+        try:
+            result = self._generate_limited(messages, stop, run_manager, priority, **kwargs)
+        except BaseException as exc:
+            call.fail(exc)
+            raise
+        _finish_call(call, messages, _usage_split(result), result.generations[0].text if result.generations else "")
+        return result
+
+    def _generate_limited(self, messages, stop, run_manager, priority, **kwargs) -> ChatResult:
+        limiter = self._limiter()
+        if limiter is None:
+            return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+        lease = limiter.acquire(self._estimate(messages, kwargs.get("max_tokens")), priority, kwargs.get("timeout"))
+        self._after_queue(lease, kwargs)
+        try:
+            result = super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        except BaseException as exc:
+            self._failed(limiter, lease, exc)
+            raise
+        limiter.release(lease, _result_tokens(result))
+        return result
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        priority = kwargs.pop("llm_priority", None)
+        call = LLMCall(self.model_name, kwargs.pop("llm_node", None))
+        try:
+            result = await self._agenerate_limited(messages, stop, run_manager, priority, **kwargs)
+        except BaseException as exc:
+            call.fail(exc)
+            raise
+        _finish_call(call, messages, _usage_split(result), result.generations[0].text if result.generations else "")
+        return result
+
+    async def _agenerate_limited(self, messages, stop, run_manager, priority, **kwargs) -> ChatResult:
+        limiter = self._limiter()
+        if limiter is None:
+            return await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+        lease = await limiter.aacquire(self._estimate(messages, kwargs.get("max_tokens")), priority, kwargs.get("timeout"))
+        self._after_queue(lease, kwargs)
+        try:
+            result = await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        except BaseException as exc:
+            self._failed(limiter, lease, exc)
+            raise
+        limiter.release(lease, _result_tokens(result))
+        return result
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        priority = kwargs.pop("llm_priority", None)
+        call = LLMCall(self.model_name, kwargs.pop("llm_node", None))
+        parts, usage = [], None
+        try:
+            for chunk in self._stream_limited(messages, stop, run_manager, priority, **kwargs):
+                if chunk.text:
+                    call.first_token()
+                    parts.append(chunk.text)
+                usage = _chunk_usage(chunk) or usage
+                yield chunk
+        except BaseException as exc:
+            call.fail(exc)
+            raise
+        _finish_call(call, messages, usage, "".join(parts))
+
+    def _stream_limited(self, messages, stop, run_manager, priority, **kwargs) -> Iterator[ChatGenerationChunk]:
+        limiter = self._limiter()
+        if limiter is None:
+            yield from super()._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+            return
+
+        lease = limiter.acquire(self._estimate(messages, kwargs.get("max_tokens")), priority, kwargs.get("timeout"))
+        self._after_queue(lease, kwargs)
+        used = None
+        try:
+            for chunk in super()._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                used = _chunk_tokens(chunk) or used
+                yield chunk
+        except BaseException as exc:
+            self._failed(limiter, lease, exc)
+            raise
+        limiter.release(lease, used)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        priority = kwargs.pop("llm_priority", None)
+        call = LLMCall(self.model_name, kwargs.pop("llm_node", None))
+        parts, usage = [], None
+        try:
+            async for chunk in self._astream_limited(messages, stop, run_manager, priority, **kwargs):
+                if chunk.text:
+                    call.first_token()
+                    parts.append(chunk.text)
+                usage = _chunk_usage(chunk) or usage
+                yield chunk
+        except BaseException as exc:
+            call.fail(exc)
+            raise
+        _finish_call(call, messages, usage, "".join(parts))
+
+    async def _astream_limited(self, messages, stop, run_manager, priority, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        limiter = self._limiter()
+        if limiter is None:
+            async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                yield chunk
+            return
+
+        lease = await limiter.aacquire(self._estimate(messages, kwargs.get("max_tokens")), priority, kwargs.get("timeout"))
+        self._after_queue(lease, kwargs)
+        used = None
+        try:
+            async for chunk in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                used = _chunk_tokens(chunk) or used
+                yield chunk
+        except BaseException as exc:
+            self._failed(limiter, lease, exc)
+            raise
+        limiter.release(lease, used)
+
+
+class ClientRegistry:
+    """
+    Bounded LRU of ChatOpenAI / structured-output runnables sharing one HTTP pool.
+    """
+
+    def __init__(
+        self,
+        max_size: int = MAX_CLIENTS,
+        transport: Optional[httpx.BaseTransport] = None,
+        async_transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.max_size = max(1, max_size)
+        self.transport = transport
+        self.async_transport = async_transport
+        self._entries: "OrderedDict[Tuple[Hashable, ...], Runnable]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._http_client: Optional[httpx.Client] = None
+        self._http_async_client: Optional[httpx.AsyncClient] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # ---------- HTTP pool ----------
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        )
+
+    def http_client(self) -> httpx.Client:
+        if self._http_client is None:
+            self._http_client = httpx.Client(
+                limits=self._limits(), timeout=HTTP_TIMEOUT, transport=self.transport
+            )
+        return self._http_client
+
+    def http_async_client(self) -> httpx.AsyncClient:
+        """
+        Shared async pool. Like any httpx.AsyncClient it belongs to the event loop
+        that first uses it, so a process should drive async calls from one loop.
+        """
+        if self._http_async_client is None:
+            self._http_async_client = httpx.AsyncClient(
+                limits=self._limits(), timeout=HTTP_TIMEOUT, transport=self.async_transport
+            )
+        return self._http_async_client
+
+    # ---------- LRU ----------
+
+    def _get_or_create(self, key: Tuple[Hashable, ...], factory) -> Runnable:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+            self.misses += 1
+            entry = factory()
+            self._entries[key] = entry
+            while len(self._entries) > self.max_size:
+                # Evicted clients share the pool, so there is nothing to close here.
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            return entry
+
+    def get_chat_model(
+        self,
+        model: str,
+        temperature: float,
+        response_format: Optional[Dict[str, Any]] = None,
+    ) -> ChatOpenAI:
+        """
+        Cached ChatOpenAI for this (model, temperature, response_format).
+        """
+        key = ("chat", model, round(temperature, 4), _format_key(response_format))
+
+        def factory() -> ChatOpenAI:
+            return GovernedChatOpenAI(
+                model=model,
+                temperature=temperature,
+                http_client=self.http_client(),
+                http_async_client=self.http_async_client(),
+                # Retries are owned by retry_policy; SDK retries would multiply them.
+                max_retries=SDK_MAX_RETRIES,
+                model_kwargs={"response_format": response_format} if response_format else {},
+            )
+
+        return self._get_or_create(key, factory)
+
+    def get_structured_model(
+        self,
+        model: str,
+        temperature: float,
+        schema: Type[BaseModel],
+    ) -> Runnable:
+        """
+        Cached `with_structured_output(schema)` runnable on top of a pooled chat model.
+        """
+        key = ("structured", model, round(temperature, 4), None, schema)
+        # Resolved before taking the lock for the wrapper; the lock is not re-entrant.
+        base = self.get_chat_model(model, temperature)
+        return self._get_or_create(key, lambda: base.with_structured_output(schema))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def close(self) -> None:
+        """
+        Drop cached runnables and close the shared sync pool.
+        The async pool must be closed from its own loop via `aclose()`.
+        """
+        self.clear()
+        if self._http_client is not None:
+            self._http_client.close()
+            self._http_client = None
+
+    async def aclose(self) -> None:
+        self.close()
+        if self._http_async_client is not None:
+            await self._http_async_client.aclose()
+            self._http_async_client = None
+
+
+_registry = ClientRegistry()
+_registry_override: ContextVar[Optional[ClientRegistry]] = ContextVar("unhabit_llm_registry", default=None)
+
+
+def get_registry() -> ClientRegistry:
+    override = _registry_override.get()
+    return _registry if override is None else override
+
+
+@contextmanager
+def use_registry(registry: ClientRegistry) -> Iterator[ClientRegistry]:
+    """
+    Route model lookups in this block (and tasks started from it) through `registry`.
+    """
+    token = _registry_override.set(registry)
+    try:
+        yield registry
+    finally:
+        _registry_override.reset(token)
+
+
+def set_registry(registry: ClientRegistry) -> None:
+    global _registry
+    _registry = registry
+
+
+def get_chat_model(
+    model: str,
+    temperature: float,
+    response_format: Optional[Dict[str, Any]] = None,
+) -> ChatOpenAI:
+    return get_registry().get_chat_model(model, temperature, response_format)
+
+
+def get_structured_model(model: str, temperature: float, schema: Type[BaseModel]) -> Runnable:
+    return get_registry().get_structured_model(model, temperature, schema)
@@ -0,0 +1,245 @@
+# metrics.py
+"""
+Small in-process metrics registry (labelled counters and histograms).
+
+Kept dependency-free so nodes, the graph and the UI can record events
+without caring how (or whether) they are exported. `render_prometheus()`
+produces the Prometheus text format; the API serves it at /metrics and
+`start_metrics_server()` exposes it from any other process (e.g. Streamlit).
+"""
+import bisect
+import math
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+# Seconds; spans a cached lookup up to a slow 21-day plan.
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+
+class Counter:
+    """
+    Monotonic counter with optional string labels.
+    """
+
+    def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def total(self) -> float:
+        with self._lock:
+            return sum(self._values.values())
+
+    def samples(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram with optional string labels.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Iterable[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts (+inf last), sum, count]
+        self._values: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self._values[key] = entry
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return entry[2] if entry else 0
+
+    def sum(self, **labels: str) -> float:
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return entry[1] if entry else 0.0
+
+    def samples(self) -> Dict[Tuple[str, ...], Tuple[List[int], float, int]]:
+        """
+        {labels: (cumulative bucket counts incl. +Inf, sum, count)}.
+        """
+        with self._lock:
+            out = {}
+            for key, (counts, total, n) in self._values.items():
+                cumulative, running = [], 0
+                for c in counts:
+                    running += c
+                    cumulative.append(running)
+                out[key] = (cumulative, total, n)
+            return out
+
+
+Metric = Union[Counter, Histogram]
+
+
+class MetricsRegistry:
+    """
+    Get-or-create registry so modules can declare their metrics at import time.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str, labelnames: Iterable[str] = ()) -> Counter:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = Counter(name, help_text, labelnames)
+                self._metrics[name] = metric
+            return metric
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Iterable[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = Histogram(name, help_text, labelnames, buckets)
+                self._metrics[name] = metric
+            return metric
+
+    def metrics(self) -> Dict[str, Metric]:
+        with self._lock:
+            return dict(self._metrics)
+
+    def snapshot(self) -> Dict[str, float]:
+        """
+        Flat {name{labels}: value} view, handy for debug panels.
+        """
+        out: Dict[str, float] = {}
+        for name, metric in self.metrics().items():
+            for key, value in metric.samples().items():
+                labels = ",".join(f"{k}={v}" for k, v in zip(metric.labelnames, key))
+                suffix = f"{{{labels}}}" if labels else ""
+                if isinstance(metric, Histogram):
+                    _, total, count = value
+                    out[f"{name}_count{suffix}"] = count
+                    out[f"{name}_sum{suffix}"] = total
+                else:
+                    out[f"{name}{suffix}"] = value
+        return out
+
+    def render_prometheus(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format (0.0.4).
+        """
+        lines: List[str] = []
+        for name, metric in sorted(self.metrics().items()):
+            kind = "histogram" if isinstance(metric, Histogram) else "counter"
+            lines.append(f"# HELP {name} {metric.help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, value in sorted(metric.samples().items()):
+                pairs = list(zip(metric.labelnames, key))
+                if isinstance(metric, Histogram):
+                    cumulative, total, count = value
+                    for bound, n in zip(list(metric.buckets) + [math.inf], cumulative):
+                        le = "+Inf" if bound == math.inf else repr(float(bound))
+                        lines.append(f"{name}_bucket{_labels(pairs + [('le', le)])} {n}")
+                    lines.append(f"{name}_sum{_labels(pairs)} {total}")
+                    lines.append(f"{name}_count{_labels(pairs)} {count}")
+                else:
+                    lines.append(f"{name}{_labels(pairs)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(pairs: List[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name: str, help_text: str, labelnames: Iterable[str] = ()) -> Counter:
+    return REGISTRY.counter(name, help_text, labelnames)
+
+
+def histogram(
+    name: str,
+    help_text: str,
+    labelnames: Iterable[str] = (),
+    buckets: Sequence[float] = DEFAULT_BUCKETS,
+) -> Histogram:
+    return REGISTRY.histogram(name, help_text, labelnames, buckets)
+
+
+def render_prometheus() -> str:
+    return REGISTRY.render_prometheus()
+
+
+# ---------- Scrape endpoint ----------
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serve /metrics from a daemon thread (for processes without the ASGI API).
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    return server
@@ -0,0 +1,387 @@
+# plan_templates.py
+"""
+Local 21-day plans composed from category task templates.
+
+Every category group from category_guidance has a task set that mirrors
+its "Must include across 21 days" list: one kind per bullet, with at
+least that many templates. A plan takes exactly the required number of
+each kind, interleaved across the three weeks, fills the free days left
+over with generic tasks, and pins five anchor days (baseline, two weekly
+reviews, life after day 21, final review). Templates are filled with QuizSummary
+fields, so the plan names the user's product, times, places and reasons.
+
+Composition is a few dict lookups and string joins, cached per summary
+values; the plan serves as an instant draft while the LLM plan is
+generated and as the fallback when the LLM fails or is shed.
+
+Import fails if a guidance category has no task set, a kind has fewer
+templates than it requires, the required tasks don't fit the free days,
+or a template uses an unknown field.
+"""
+import functools
+from typing import Dict, List, Tuple
+
+from category_guidance import OTHER, REGISTRY, GuidanceTemplate, field_values
+from schemas import Plan21D, QuizSummary
+
+# Template field -> (QuizSummary attributes, first non-empty wins; value when all are empty).
+# Defaults read naturally inside a task sentence, unlike the prompt's "unclear ...".
+# The raw description is no fallback for the name: "cut back on I use zyn all day".
+TASK_FIELDS: Dict[str, Tuple[Tuple[str, ...], str]] = {
+    "name": (("canonical_habit_name",), "your habit"),
+    "product": (("product_type", "canonical_habit_name"), "it"),
+    "severity": (("severity_level",), "moderate"),
+    "trigger": (("main_trigger",), "your main trigger"),
+    "peak": (("peak_times",), "your usual peak times"),
+    "loc": (("common_locations",), "the places it usually happens"),
+    "emo": (("emotional_patterns",), "the feelings that come before it"),
+    "motive": (("motivation_reason",), "your reasons for change"),
+    "risk": (("risk_situations",), "your riskiest situations"),
+}
+# Placeholders a fallback QuizSummary (ai_nodes._quiz_summary_fallback) fills
+# fields with; they count as empty here ("Tasks target unknown during unknown").
+MISSING_VALUES = frozenset({"unknown", "unclear", "unspecified", "not_clear", "user_wants_change", "user habit"})
+
+# Derived from severity: minutes to delay an urge before acting on it.
+URGE_DELAY_MINUTES = {"mild": "5", "moderate": "10", "severe": "15"}
+TEMPLATE_FIELDS = tuple(TASK_FIELDS) + ("delay",)
+
+DAYS = 21
+
+# ---------- Task data ----------
+
+ANCHOR_TASKS: Dict[int, str] = {
+    1: "Baseline: log every urge or episode of {name} today with the time, the place and what you felt. Change nothing yet.",
+    7: "Week 1 review: look back at your notes and any slips without judgement. How often did {trigger} come first? "
+       "Keep what worked and change one thing.",
+    14: "Week 2 review: list three things that went well and one slip or close call. Write what came right before it "
+        "and one adjustment for next week.",
+    20: "Plan life after day 21: which rules and routines stay, and what you'll do the first time you slip.",
+    21: "Final review: compare today with your day 1 notes, rewrite your reason ({motive}) in one sentence, "
+        "and choose the two rules you'll keep from now on.",
+}
+
+# Fill free days the category tasks leave over, in this order.
+GENERIC_TASKS: Tuple[str, ...] = (
+    "Urge surfing: the next time an urge hits, set a {delay}-minute timer and breathe slowly until it rings. Then decide.",
+    "Write a short note on why this matters ({motive}) and put it where you'll see it around {peak}.",
+    "Write an if-then plan for {risk}: \"If that happens, then I will ...\". Read it once in the morning.",
+    "Tell one person you trust what you're working on and one specific way they can help.",
+    "Plan tomorrow tonight: pick its hardest hour ({peak}) and write down what you'll do instead.",
+    "When an urge comes today, rate it from 1 to 10, wait {delay} minutes, and rate it again.",
+    "Write a two-sentence identity statement about who you're becoming without {name}.",
+)
+
+# (categories, plan summary focus, ((kind, minimum, templates), ...)); the
+# categories match category_guidance.GUIDANCE_BLOCKS and the kinds its
+# "Must include" bullets. Templates within a kind go from easier to harder.
+PLAN_TEMPLATES: Tuple[Tuple[Tuple[str, ...], str, Tuple[Tuple[str, int, Tuple[str, ...]], ...]], ...] = (
+    (
+        ("nicotine_smoking", "nicotine_vaping", "nicotine_oral"),
+        "friction around where you keep {product}, your first and last use of the day, and riding out withdrawal",
+        (
+            ("access", 4, (
+                "Keep {product} somewhere that takes two minutes to reach, not in your pocket or at {loc}.",
+                "Carry only today's amount of {product}. Leave the rest at home, out of sight.",
+                "Clear {product} out of one spot where you always have it close ({loc}) and leave a substitute there "
+                "for your hands and mouth (gum, water, a toothpick).",
+                "Add a purchase rule: before buying more {product}, wait {delay} minutes and write down why.",
+            )),
+            ("first_last", 4, (
+                "Note the exact time you first use {product} today. From tomorrow you'll push it back.",
+                "Push your first use of the day back by {delay} minutes. Water, a shower or a short walk comes first.",
+                "Set a last-use time an hour before bed tonight and put {product} away once it passes.",
+                "Keep the first hour of the day free of {product}: plan exactly what you'll do instead.",
+            )),
+            ("body", 3, (
+                "Withdrawal support: keep a water bottle with you and drink whenever an urge shows up.",
+                "Move for 10 minutes (a brisk walk or stairs) when cravings usually peak: {peak}.",
+                "Protect your sleep: same bedtime tonight, nothing in the last hour before bed, and a short wind-down.",
+            )),
+            ("emotion", 3, (
+                "When you notice {emo} today, name it out loud and wait {delay} minutes before reaching for {product}.",
+                "List three situations where {emo} usually leads to {product}, and one thing to do before each starts.",
+                "Before {trigger} comes up today, take five slow breaths and have your hand-and-mouth substitute ready.",
+            )),
+        ),
+    ),
+    (
+        ("pornography",),
+        "device rules, late-night and alone-time triggers, and a plan for the moment an urge hits",
+        (
+            ("device", 4, (
+                "Charge your phone outside the bedroom tonight, and keep devices out of {loc} after dark.",
+                "Install a content blocker on every device you use alone; ask someone else to set its password if you can.",
+                "Use devices only in shared or well-lit spaces today, with the door open.",
+                "Log out of or remove the apps and sites you use for it, and remove private-browsing shortcuts.",
+            )),
+            ("late_night", 3, (
+                "Set a device curfew for tonight and plan what you'll do between then and sleep.",
+                "Write down when you'll be alone today, especially around {peak}, and fill that window with something specific.",
+                "Build a 20-minute wind-down (lights down, a book or music, no screens in bed) and do it tonight.",
+            )),
+            ("redirect", 3, (
+                "Pick one alternative for strong urges (cold water on your face, 20 push-ups, leaving the room) "
+                "and use it the moment an urge starts.",
+                "When an urge hits, stand up, leave the room and do your alternative for {delay} minutes before deciding anything.",
+                "The next time an urge follows {emo}, text or call someone, or go outside.",
+            )),
+            ("slip_review", 2, (
+                "If you slipped, write down only the facts: time, place, what you felt, what happened right before.",
+                "Look at your last slip or close call: which link (device, place, time, feeling) is easiest to break? "
+                "Change that one.",
+            )),
+        ),
+    ),
+    (
+        ("screen_time", "social_media", "gaming"),
+        "notifications and app layout, the first and last 30 minutes of the day, and better uses of your riskiest windows",
+        (
+            ("notifications", 3, (
+                "Turn off every non-essential notification from {product}.",
+                "Move {product} off your home screen into a folder on the last page.",
+                "Log out of or delete the app that pulls you in most; use the browser version if you really need it.",
+            )),
+            ("morning", 3, (
+                "Don't check your phone for the first 30 minutes after waking; use a separate alarm clock if you can.",
+                "Write down your top priority for the day before opening any app.",
+                "Start the morning with 10 minutes offline (stretching, breakfast, a walk) before opening {product}.",
+            )),
+            ("evening", 3, (
+                "Charge your phone outside the bedroom tonight.",
+                "Set a screen curfew an hour before bed and plan what you'll do in that hour instead.",
+                "Turn on grayscale or an app limit for the evening, especially around {peak}.",
+            )),
+            ("swap", 3, (
+                "List five short activities that move you toward {motive}, and do one in place of {product} today.",
+                "Pick your riskiest scrolling window ({peak}) and replace it today with something that serves {motive}.",
+                "Swap one full session of {product} for a planned activity tied to {motive}, start to finish.",
+            )),
+        ),
+    ),
+    (
+        ("alcohol", "cannabis"),
+        "the routes and places that lead to use, clear no-use rules, and rehearsed answers for invites and stress",
+        (
+            ("routes", 3, (
+                "Map the route or place that usually leads to use ({loc}) and plan a different one for today.",
+                "Skip one place where you usually use this week, or arrive later and after eating.",
+                "Make {product} harder to reach at home: don't restock, and keep what's left out of sight.",
+            )),
+            ("no_use", 3, (
+                "Pick one context where {product} is off-limits (for example weekdays, or alone at home) and write it down.",
+                "Add a second no-use rule for a specific time of day, such as {peak}.",
+                "Have an alternative drink or ritual ready for the exact time you'd normally use.",
+            )),
+            ("risk", 3, (
+                "Write an if-then plan for {risk}: what you'll say, what you'll hold, and when you'll leave.",
+                "Before your next high-risk situation, decide your limit and tell someone who'll be there.",
+                "When a craving comes today, wait {delay} minutes and do your alternative ritual first.",
+            )),
+            ("rehearse", 2, (
+                "Rehearse turning down an invite or a drink: write the sentence you'll use and say it out loud twice.",
+                "Plan your response to a stress spike: three things you'll do instead, in order.",
+            )),
+        ),
+    ),
+    (
+        ("sugar", "food_overeating"),
+        "shopping and preparing ahead, keeping trigger foods out of sight, and checking in before eating",
+        (
+            ("shopping", 3, (
+                "Write a shopping list before you go and buy only what's on it, including two snacks you're happy with.",
+                "Prepare a ready-to-eat alternative (cut fruit, yoghurt, nuts) for the time you usually snack: {peak}.",
+                "Plan tomorrow's meals tonight so you aren't deciding while hungry.",
+            )),
+            ("visibility", 3, (
+                "Move trigger foods out of sight: back of the cupboard, opaque containers, or away from {loc}.",
+                "Put fruit or a water jug where trigger foods used to be.",
+                "Use a smaller plate and serve portions in the kitchen instead of eating from the package.",
+            )),
+            ("check_in", 3, (
+                "Before eating outside mealtimes today, ask: am I hungry, or feeling {emo}? Write down the answer.",
+                "Rate your hunger from 1 to 10 before and after each meal today.",
+                "When the urge to eat comes with {emo}, wait {delay} minutes and do something soothing that isn't food.",
+            )),
+            ("evenings", 2, (
+                "Plan your evening: a set time when eating ends and one thing to do after dinner.",
+                "Write an if-then plan for {risk}: what and how much you'll eat, decided before you get there.",
+            )),
+        ),
+    ),
+    (
+        ("shopping_spending", "gambling"),
+        "cutting off easy access to money, the minutes before you spend or bet, and what you're saving for",
+        (
+            ("access", 3, (
+                "Remove saved cards from shopping or betting apps and sites, and log out everywhere.",
+                "Set a daily spending limit with your bank, or deposit limits and self-exclusion for betting.",
+                "Leave cards at home today and carry only the cash you need.",
+            )),
+            ("before", 3, (
+                "Add a waiting rule: anything you want to buy or bet on goes on a list for 24 hours first.",
+                "Plan a different activity for the 10-20 minutes before you usually spend or bet ({peak}).",
+                "When the urge comes, wait {delay} minutes and write down what you expect to feel afterwards.",
+            )),
+            ("review", 2, (
+                "Review one past episode like a report: date, amount, trigger, and how you felt afterwards.",
+                "Add up what {name} cost you last month and write the number where you'll see it.",
+            )),
+            ("motive", 2, (
+                "Write down how much money and time you'll save in 21 days, and what that means for {motive}.",
+                "Put the money you didn't spend today toward something tied to {motive}, even a small amount.",
+            )),
+        ),
+    ),
+    (
+        ("procrastination",),
+        "tiny concrete starts, a distraction-free work space, and handling the feeling before the work",
+        (
+            ("start", 5, (
+                "Pick one task you've been avoiding and do only the first step: open it and write one sentence.",
+                "Set a 10-minute timer and work on one thing until it rings. Stopping after that is allowed.",
+                "Tonight, write tomorrow's first tiny action so the start is decided before {peak}.",
+                "Break your biggest task into steps of 15 minutes or less and do the first one today.",
+                "Start work with the same two-minute ritual (water, clear desk, open the file), then begin.",
+            )),
+            ("distractions", 3, (
+                "Clear your main work spot ({loc}) of everything the current task doesn't need.",
+                "Put your phone in another room for one focused work block today.",
+                "Block distracting sites during your work hours, especially around {peak}.",
+            )),
+            ("emotion", 3, (
+                "Before starting, name the feeling you're avoiding ({emo}) and rate it from 1 to 10.",
+                "Write down what you fear will happen if you start, then what's more likely to happen.",
+                "Spend two minutes on the feeling before work (breathing, a short walk), then take the tiny first step.",
+            )),
+            ("bad_day", 2, (
+                "Rehearse a bad day: write what you'll tell yourself and the one thing you'll still do.",
+                "Plan your restart: after a bad day, the next step is only the smallest action on your list.",
+            )),
+        ),
+    ),
+    (
+        (OTHER,),
+        "your own triggers, times and places, delaying urges with a named replacement, and your reasons for change",
+        (
+            ("context", 5, (
+                "Note every time {trigger} comes up today and what you did next.",
+                "Plan your riskiest time ({peak}) in advance: write down what you'll do instead.",
+                "Add friction where it usually happens ({loc}) so {name} takes a few more steps.",
+                "When {emo} shows up today, pause and note it before anything else happens.",
+                "Change one cue in {loc} that starts {name}: move it, hide it, or swap it for something else.",
+            )),
+            ("delay", 3, (
+                "Choose one replacement behaviour and use it twice today when urges come.",
+                "Delay {name} by {delay} minutes once today and do your replacement first.",
+                "Urge surfing: notice the urge, breathe, and let it rise and fall for {delay} minutes without acting.",
+            )),
+            ("motive", 2, (
+                "Write your reason for change ({motive}) on a card and read it before {peak}.",
+                "At the end of today, write down one action that moved you toward {motive}.",
+            )),
+        ),
+    ),
+)
+
+SUMMARY_TEMPLATE = (
+    "A 21-day plan to cut back on {name}, built around {focus}. Tasks target {trigger} during {peak}, "
+    "and each week ties your progress back to {motive}."
+)
+
+
+# ---------- Registry ----------
+
+_FIELD_SPECS = dict.fromkeys(TEMPLATE_FIELDS)
+
+
+class TaskSet:
+    """
+    One category group's compiled templates: the category tasks in plan
+    order (kinds interleaved) and the generic tasks that fill the rest.
+    """
+
+    def __init__(self, focus: str, kinds: Tuple[Tuple[str, int, Tuple[str, ...]], ...]):
+        free_days = DAYS - len(ANCHOR_TASKS)
+        for kind, minimum, templates in kinds:
+            if len(templates) < minimum:
+                raise ValueError(f"Task kind {kind!r} needs {minimum} templates, has {len(templates)}")
+        required = sum(minimum for _, minimum, _ in kinds)
+        if required > free_days:
+            raise ValueError(f"{required} required tasks don't fit in {free_days} free days")
+        if required + len(GENERIC_TASKS) < free_days:
+            raise ValueError(f"Not enough generic tasks to fill {free_days - required} free days")
+
+        # Round-robin over kinds: task r of every kind before task r + 1 of any.
+        rounds = max(minimum for _, minimum, _ in kinds)
+        category = [
+            templates[r] for r in range(rounds) for _, minimum, templates in kinds if r < minimum
+        ]
+        generic = list(GENERIC_TASKS[:free_days - required])
+        # Spread generic tasks evenly between the category ones.
+        generic_slots = {int((i + 0.5) * free_days / len(generic)) for i in range(len(generic))} if generic else set()
+
+        texts: List[str] = []
+        for slot in range(free_days):
+            texts.append(generic.pop(0) if slot in generic_slots else category.pop(0))
+        free = [day for day in range(1, DAYS + 1) if day not in ANCHOR_TASKS]
+        by_day = dict(zip(free, texts))
+        by_day.update(ANCHOR_TASKS)
+
+        self.summary = GuidanceTemplate(SUMMARY_TEMPLATE.replace("{focus}", focus), _FIELD_SPECS)
+        self.days: Tuple[Tuple[str, GuidanceTemplate], ...] = tuple(
+            (f"day_{day}", GuidanceTemplate(by_day[day], _FIELD_SPECS)) for day in range(1, DAYS + 1)
+        )
+
+
+def _build_registry() -> Dict[str, TaskSet]:
+    registry: Dict[str, TaskSet] = {}
+    for categories, focus, kinds in PLAN_TEMPLATES:
+        task_set = TaskSet(focus, kinds)
+        for category in categories:
+            if category in registry:
+                raise ValueError(f"Category {category!r} has more than one task set")
+            registry[category] = task_set
+
+    missing = sorted(set(REGISTRY) - set(registry))
+    if missing:
+        raise ValueError(f"No plan task set for categories: {missing}")
+    return registry
+
+
+TASK_REGISTRY = _build_registry()
+
+
+# ---------- Composition ----------
+
+@functools.lru_cache(maxsize=1024)
+def _compose(category: str, values: Tuple[str, ...]) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    mapping = dict(zip(TASK_FIELDS, values))
+    mapping["delay"] = URGE_DELAY_MINUTES.get(mapping["severity"], URGE_DELAY_MINUTES["moderate"])
+    task_set = TASK_REGISTRY.get(category, TASK_REGISTRY[OTHER])
+    return (
+        task_set.summary.render(mapping),
+        tuple((day, template.render(mapping)) for day, template in task_set.days),
+    )
+
+
+def task_values(summary: QuizSummary) -> Tuple[str, ...]:
+    """
+    `field_values` for TASK_FIELDS, with MISSING_VALUES placeholders treated as empty.
+    """
+    missing = {
+        name: "" for name, value in vars(summary).items()
+        if isinstance(value, str) and value.strip().lower() in MISSING_VALUES
+    }
+    return field_values(summary.model_copy(update=missing) if missing else summary, TASK_FIELDS)
+
+
+def template_plan21(summary: QuizSummary) -> Plan21D:
+    """
+    A personalised Plan21D for `summary`, composed locally from the
+    category's task templates. Same summary values, same plan.
+    """
+    category = (summary.habit_category or OTHER).lower()
+    plan_summary, day_tasks = _compose(category, task_values(summary))
+    # A fresh model each call: callers may edit the plan.
+    return Plan21D(plan_summary=plan_summary, day_tasks=dict(day_tasks))
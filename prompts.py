@@ -1,5 +1,20 @@
 # prompts.py
-SAFETY_PROMPT = """
+"""
+Prompt texts, each split into a static system part and a dynamic user part.
+
+Everything that varies per call (user text, quiz answers, profiles) lives in
+the user message at the end, so every request for a node starts with the
+same long system prefix and provider-side prompt caching can reuse it.
+The chat templates at the bottom are built once at import; the combined
+*_PROMPT strings are the same content as one text (response-cache ids,
+tools, token accounting).
+
+Run `python benchmarks/bench_prompt_prefix.py` to see the cacheable prefix per node.
+"""
+from langchain_core.messages import SystemMessage
+from langchain_core.prompts import ChatPromptTemplate
+
+SAFETY_SYSTEM = """
 You are a STRICT safety and scope classifier for a habit-coach app.
 
 The app ONLY gives behavioral habit-change guidance (for example: scrolling, porn, smoking, overeating, procrastination).
@@ -123,12 +138,12 @@ Return STRICT JSON ONLY:
   "action": "",
   "message": ""
 }}
-
-User: {user_text}
 """.strip()
 
+SAFETY_USER = "User: {user_text}"
+
 
-CANONICALIZE_PROMPT = """
+CANONICALIZE_SYSTEM = """
 You are a habit-name normalizer.
 
 Your job:
@@ -145,17 +160,17 @@ Examples of slang detection:
 
 Return STRICT JSON ONLY:
 
-{
+{{
   "canonical_habit_name": "",
   "habit_category": "",
   "confidence": ""
-}
+}}
+""".strip()
 
-User habit: {user_habit_raw}
-"""
+CANONICALIZE_USER = "User habit: {user_habit_raw}"
 
 
-QUIZ_GENERATOR_PROMPT = """
+QUIZ_GENERATOR_SYSTEM = """
 You are a behavioral habit coach.
 
 You will receive a short description of the user's habit, written in their own words.
@@ -255,7 +270,9 @@ Return STRICT JSON ONLY:
 Where:
 - "habit_name_guess" is your interpreted, clean habit label.
 - "questions" contains 8–10 items maximum.
+""".strip()
 
+QUIZ_GENERATOR_USER = """
 --------------------------------
 INPUT
 --------------------------------
@@ -267,7 +284,7 @@ User habit description:
 
 
 
-QUIZ_SUMMARY_PROMPT = """
+QUIZ_SUMMARY_SYSTEM = """
 You are an expert behavioral habit profiler.
 
 Your job:
@@ -368,18 +385,7 @@ IMPORTANT RULES
 4) Do NOT invent nonsense categories based on slang (e.g. "prn" as its own category).
    - Slang goes into user_habit_raw or canonical_habit_name, not habit_category.
 
---------------------------------
-INPUTS
---------------------------------
-
-User habit description:
-{habit_description}
-
-Quiz form JSON:
-{quiz_form_json}
-
-User's quiz answers:
-{user_quiz_answers}
+The three inputs are given at the end, in the user message.
 
 --------------------------------
 OUTPUT FORMAT (STRICT JSON)
@@ -405,9 +411,24 @@ Return ONLY valid JSON in this structure:
 }}
 """.strip()
 
+QUIZ_SUMMARY_USER = """
+--------------------------------
+INPUTS
+--------------------------------
+
+User habit description:
+{habit_description}
 
+Quiz form JSON:
+{quiz_form_json}
 
-PLAN_21D_PROMPT = """
+User's quiz answers:
+{user_quiz_answers}
+""".strip()
+
+
+
+PLAN_21D_SYSTEM = """
 You are a world-class behavioral change expert at the level of a lead clinician and research psychologist.
 You specialize in:
 - addiction psychology
@@ -454,11 +475,8 @@ If the situation seems severe, your plan still stays within behavioral and cogni
 INPUT DATA
 --------------------------------
 
-User habit profile (JSON, from diagnostics + quiz answers):
-{quiz_summary_json}
-
-Additional category & clinical guidance:
-{category_guidance}
+The user message at the end gives the user habit profile (JSON, from
+diagnostics + quiz answers) and additional category & clinical guidance.
 
 The JSON includes fields such as:
 - user_habit_raw (exact wording)
@@ -630,12 +648,20 @@ Return ONLY valid JSON in the following structure:
 }}
 """.strip()
 
+PLAN_21D_USER = """
+User habit profile (JSON, from diagnostics + quiz answers):
+{quiz_summary_json}
+
+Additional category & clinical guidance:
+{category_guidance}
+""".strip()
+
 
 
 
 
 
-COACH_PROMPT = """
+COACH_SYSTEM = """
 You are an AI habit coach inside a 21-day habit change app.
 
 You have:
@@ -657,9 +683,58 @@ Style:
 
 You will receive:
 - quiz_summary_json: the structured profile
-- plan_21d_json: the 21-day plan
-- history_text: the conversation so far
+- plan_21d_json: the plan summary, the user's current_day, and only the day_tasks relevant to this message
+- history_text: the conversation so far (older turns may be given as a short summary)
 - user_message: the latest message from the user
 
 Respond with plain text only.
 """.strip()
+
+
+CHAT_SUMMARY_SYSTEM = """
+You maintain a running summary of a conversation between a user and their habit coach.
+
+Update the existing summary with the new messages below.
+Keep only what the coach needs later: slips and when they happened, triggers mentioned,
+adjustments agreed on, commitments made, and how the user is feeling about the plan.
+Write at most 8 short bullet points. Do not invent details.
+Return only the updated summary.
+""".strip()
+
+CHAT_SUMMARY_USER = """
+Existing summary:
+{previous_summary}
+
+New messages:
+{messages}
+""".strip()
+
+
+# ---------- Chat templates ----------
+
+def _chat_template(system: str, user: str) -> ChatPromptTemplate:
+    # The system part has no variables: render it once so every call sends
+    # the identical message object, and only the user message is formatted.
+    return ChatPromptTemplate.from_messages([SystemMessage(content=system.format()), ("human", user)])
+
+
+def _combined(system: str, user: str) -> str:
+    return system + "\n\n" + user
+
+
+SAFETY_MESSAGES = _chat_template(SAFETY_SYSTEM, SAFETY_USER)
+CANONICALIZE_MESSAGES = _chat_template(CANONICALIZE_SYSTEM, CANONICALIZE_USER)
+QUIZ_GENERATOR_MESSAGES = _chat_template(QUIZ_GENERATOR_SYSTEM, QUIZ_GENERATOR_USER)
+QUIZ_SUMMARY_MESSAGES = _chat_template(QUIZ_SUMMARY_SYSTEM, QUIZ_SUMMARY_USER)
+PLAN_21D_MESSAGES = _chat_template(PLAN_21D_SYSTEM, PLAN_21D_USER)
+CHAT_SUMMARY_MESSAGES = _chat_template(CHAT_SUMMARY_SYSTEM, CHAT_SUMMARY_USER)
+# The coach's user message is assembled under a token budget in coach_context.
+COACH_SYSTEM_MESSAGE = SystemMessage(content=COACH_SYSTEM)
+
+SAFETY_PROMPT = _combined(SAFETY_SYSTEM, SAFETY_USER)
+CANONICALIZE_PROMPT = _combined(CANONICALIZE_SYSTEM, CANONICALIZE_USER)
+QUIZ_GENERATOR_PROMPT = _combined(QUIZ_GENERATOR_SYSTEM, QUIZ_GENERATOR_USER)
+QUIZ_SUMMARY_PROMPT = _combined(QUIZ_SUMMARY_SYSTEM, QUIZ_SUMMARY_USER)
+PLAN_21D_PROMPT = _combined(PLAN_21D_SYSTEM, PLAN_21D_USER)
+CHAT_SUMMARY_PROMPT = _combined(CHAT_SUMMARY_SYSTEM, CHAT_SUMMARY_USER)
+COACH_PROMPT = COACH_SYSTEM
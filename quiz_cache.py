@@ -0,0 +1,219 @@
+# quiz_cache.py
+"""
+Similarity cache for QuizForm, keyed by the normalized habit description.
+
+Exact-match caching (response_cache) misses on "zyn" vs "Zyn pouches" vs
+"nicotine pouches all day", yet those quizzes are interchangeable. This index
+normalizes the description with habit_lexicon, vectorizes it as character
+trigrams and serves a stored QuizForm when cosine similarity clears a
+threshold. The quiz names the user's product, so a hit also needs the
+same category and the same products ("instagram" never gets the TikTok
+quiz, "wine" never the beer one), and every word left after normalization
+must have a counterpart (the same word or a near spelling of it) on the
+other side: "I smoke meth" and "I smoke" never share a quiz. Everything runs locally; no embedding service is involved.
+
+Configuration (env):
+- UNHABIT_QUIZ_SIMILARITY_CACHE=0        disable
+- UNHABIT_QUIZ_SIMILARITY_THRESHOLD=0.8  minimum cosine similarity for a hit
+- UNHABIT_QUIZ_SIMILARITY_MAX_ENTRIES=5000
+"""
+import math
+import os
+import threading
+import time
+from collections import Counter as TermCounter, OrderedDict, deque
+from typing import Any, Deque, Dict, FrozenSet, Optional, Set, Tuple
+
+from habit_lexicon import normalize_habit
+from metrics import counter
+from schemas import QuizForm
+
+SIMILARITY_CACHE_ENABLED = os.getenv("UNHABIT_QUIZ_SIMILARITY_CACHE", "1") != "0"
+SIMILARITY_THRESHOLD = float(os.getenv("UNHABIT_QUIZ_SIMILARITY_THRESHOLD", "0.8"))
+SIMILARITY_MAX_ENTRIES = int(os.getenv("UNHABIT_QUIZ_SIMILARITY_MAX_ENTRIES", "5000"))
+
+QUIZ_SIMILARITY_LOOKUPS = counter(
+    "unhabit_quiz_similarity_cache_requests_total",
+    "QuizForm similarity cache lookups by result (hit/miss).",
+    labelnames=("result",),
+)
+
+
+def trigrams(text: str) -> TermCounter:
+    padded = f"  {text} "
+    return TermCounter(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def _norm(vector: TermCounter) -> float:
+    return math.sqrt(sum(v * v for v in vector.values()))
+
+
+def _cosine(a: str, b: str) -> float:
+    va, vb = trigrams(a), trigrams(b)
+    dot = sum(count * vb.get(gram, 0) for gram, count in va.items())
+    return dot / (_norm(va) * _norm(vb)) if dot else 0.0
+
+
+class _Entry:
+    __slots__ = ("normalized", "category", "products", "words", "vector", "norm", "quiz_form")
+
+    def __init__(self, normalized: str, category: Optional[str], products: FrozenSet[str], quiz_form: QuizForm):
+        self.normalized = normalized
+        self.category = category
+        self.products = products
+        self.words = frozenset(normalized.split())
+        self.vector = trigrams(normalized)
+        self.norm = _norm(self.vector)
+        self.quiz_form = quiz_form
+
+
+class QuizFormSimilarityCache:
+    """
+    Bounded n-gram index from normalized habit text to QuizForm.
+
+    Candidates come from an inverted trigram index, so lookups stay cheap as
+    the cache grows. Entries whose detected category or products differ
+    never match, however similar the strings look, and neither do entries
+    with a word the lookup lacks or the other way round (near-identical
+    trigram sets can still hide a different drug or product).
+    """
+
+    def __init__(
+        self,
+        threshold: float = SIMILARITY_THRESHOLD,
+        max_entries: int = SIMILARITY_MAX_ENTRIES,
+        latency_window: int = 1000,
+    ):
+        self.threshold = threshold
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._postings: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self._latencies: Deque[float] = deque(maxlen=latency_window)
+        self.hits = 0
+        self.misses = 0
+
+    def _index(self, entry: _Entry) -> None:
+        for gram in entry.vector:
+            self._postings.setdefault(gram, set()).add(entry.normalized)
+
+    def _unindex(self, entry: _Entry) -> None:
+        for gram in entry.vector:
+            keys = self._postings.get(gram)
+            if keys is not None:
+                keys.discard(entry.normalized)
+                if not keys:
+                    del self._postings[gram]
+
+    def _covered(self, words: FrozenSet[str], others: FrozenSet[str]) -> bool:
+        # Every word in `words` is in `others`, or is a near spelling of one there.
+        return all(word in others or any(_cosine(word, other) >= self.threshold for other in others)
+                   for word in words)
+
+    def _best_match(
+        self, normalized: str, category: Optional[str], products: FrozenSet[str]
+    ) -> Tuple[Optional[_Entry], float]:
+        exact = self._entries.get(normalized)
+        if exact is not None and exact.category == category and exact.products == products:
+            return exact, 1.0
+
+        vector = trigrams(normalized)
+        norm = _norm(vector)
+        if not norm:
+            return None, 0.0
+
+        words = frozenset(normalized.split())
+        candidates: Set[str] = set()
+        for gram in vector:
+            candidates |= self._postings.get(gram, set())
+
+        best: Optional[_Entry] = None
+        best_score = 0.0
+        for key in candidates:
+            entry = self._entries[key]
+            if category != entry.category or products != entry.products:
+                continue
+            if not (self._covered(words, entry.words) and self._covered(entry.words, words)):
+                continue
+            dot = sum(count * entry.vector.get(gram, 0) for gram, count in vector.items())
+            score = dot / (norm * entry.norm) if entry.norm else 0.0
+            if score > best_score:
+                best, best_score = entry, score
+        return best, best_score
+
+    def get(self, habit_description: str) -> Optional[QuizForm]:
+        started = time.perf_counter()
+        normalized, category, products = normalize_habit(habit_description)
+
+        result: Optional[QuizForm] = None
+        with self._lock:
+            if normalized:
+                entry, score = self._best_match(normalized, category, products)
+                if entry is not None and score >= self.threshold:
+                    self._entries.move_to_end(entry.normalized)
+                    result = entry.quiz_form
+
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            self._latencies.append(time.perf_counter() - started)
+
+        QUIZ_SIMILARITY_LOOKUPS.inc(result="miss" if result is None else "hit")
+        return result
+
+    def put(self, habit_description: str, quiz_form: QuizForm) -> None:
+        normalized, category, products = normalize_habit(habit_description)
+        if not normalized:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(normalized, None)
+            if previous is not None:
+                self._unindex(previous)
+
+            entry = _Entry(normalized, category, products, quiz_form)
+            self._entries[normalized] = entry
+            self._index(entry)
+
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._unindex(evicted)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            latencies = sorted(self._latencies)
+
+        def pct(q: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+
+        return {
+            "entries": len(self._entries),
+            "lookups": lookups,
+            "hits": self.hits,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "lookup_ms_p50": pct(0.50),
+            "lookup_ms_p95": pct(0.95),
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._postings.clear()
+
+
+_cache: Optional[QuizFormSimilarityCache] = (
+    QuizFormSimilarityCache() if SIMILARITY_CACHE_ENABLED else None
+)
+
+
+def get_quiz_form_cache() -> Optional[QuizFormSimilarityCache]:
+    return _cache
+
+
+def set_quiz_form_cache(cache: Optional[QuizFormSimilarityCache]) -> None:
+    global _cache
+    _cache = cache
@@ -0,0 +1,359 @@
+# rate_limiter.py
+"""
+Client-side rate limiting and concurrency governor for LLM calls.
+
+Every model gets a requests-per-minute and a tokens-per-minute token bucket
+plus an optional cap on in-flight requests. Callers queue for a grant in
+priority order (coach turns before onboarding before batch work, FIFO
+within a priority), so a burst waits its turn here instead of turning into
+a 429 storm and silently falling back. A 429 that still gets through drains
+the model's buckets, so everyone behind it backs off together.
+
+Token use is estimated up front (prompt + expected completion) and settled
+against the real usage when the call returns.
+
+Configuration (env; 0 = unlimited):
+- UNHABIT_LLM_RPM, UNHABIT_LLM_TPM, UNHABIT_LLM_MAX_CONCURRENCY  defaults for every model
+- UNHABIT_LLM_LIMITS="gpt-4.1=500/30000/16,gpt-4.1-mini=500/200000"  per model rpm/tpm[/concurrency]
+- UNHABIT_LLM_QUEUE_MAX=1000         waiters per model before callers are rejected
+- UNHABIT_LLM_QUEUE_TIMEOUT=60       seconds a caller may wait for a grant (less
+                                     when the call's own timeout is shorter)
+- UNHABIT_LLM_COMPLETION_ESTIMATE=500  completion tokens assumed when max_tokens is unset
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from metrics import counter
+
+PRIORITIES = {"coach": 0, "onboarding": 1, "batch": 2}
+DEFAULT_PRIORITY = "onboarding"
+
+QUEUE_MAX = int(os.getenv("UNHABIT_LLM_QUEUE_MAX", "1000"))
+QUEUE_TIMEOUT = float(os.getenv("UNHABIT_LLM_QUEUE_TIMEOUT", "60"))
+COMPLETION_ESTIMATE = int(os.getenv("UNHABIT_LLM_COMPLETION_ESTIMATE", "500"))
+
+# Upper bound on one sleep while queued, so waiters notice a new head quickly.
+_POLL_SECONDS = 0.05
+
+RATE_LIMIT_WAITS = counter(
+    "unhabit_llm_rate_limit_waits_total",
+    "LLM calls that had to queue for a rate-limit grant.",
+    labelnames=("model", "priority"),
+)
+RATE_LIMIT_WAIT_SECONDS = counter(
+    "unhabit_llm_rate_limit_wait_seconds_total",
+    "Seconds spent queued for rate-limit grants.",
+    labelnames=("model", "priority"),
+)
+RATE_LIMIT_REJECTED = counter(
+    "unhabit_llm_rate_limit_rejected_total",
+    "LLM calls rejected by the limiter (queue full or wait timeout).",
+    labelnames=("model", "reason"),
+)
+PROVIDER_RATE_LIMITED = counter(
+    "unhabit_llm_provider_429_total",
+    "Provider 429 responses seen despite client-side limiting.",
+    labelnames=("model",),
+)
+
+
+class RateLimitExceeded(RuntimeError):
+    """
+    The limiter refused a call: queue full (backpressure) or waited too long.
+    """
+
+
+# ---------- Priority ----------
+
+_priority: ContextVar[str] = ContextVar("unhabit_llm_priority", default=DEFAULT_PRIORITY)
+
+
+@contextmanager
+def llm_priority(name: str) -> Iterator[None]:
+    """
+    Run LLM calls in this block (and tasks started from it) at `name` priority.
+    """
+    if name not in PRIORITIES:
+        raise ValueError(f"Unknown priority {name!r}; expected one of {sorted(PRIORITIES)}")
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+# ---------- Limits ----------
+
+@dataclass(frozen=True)
+class ModelLimits:
+    rpm: float = 0.0
+    tpm: float = 0.0
+    max_concurrency: int = 0
+
+    @property
+    def unlimited(self) -> bool:
+        return not (self.rpm or self.tpm or self.max_concurrency)
+
+
+def parse_limits(spec: str) -> Dict[str, ModelLimits]:
+    """
+    "model=rpm/tpm[/concurrency],..." -> {model: ModelLimits}.
+    """
+    limits: Dict[str, ModelLimits] = {}
+    for part in filter(None, (p.strip() for p in (spec or "").split(","))):
+        model, _, values = part.partition("=")
+        numbers = [float(v) if v else 0.0 for v in values.split("/")]
+        numbers += [0.0] * (3 - len(numbers))
+        limits[model.strip()] = ModelLimits(numbers[0], numbers[1], int(numbers[2]))
+    return limits
+
+
+class _Bucket:
+    """
+    Token bucket refilled continuously at `per_minute / 60` per second.
+    The level may go negative when actual usage exceeds the estimate.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount: float) -> float:
+        # Requests larger than the whole bucket only need it full.
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+
+class Lease:
+    __slots__ = ("tokens", "priority", "waited")
+
+    def __init__(self, tokens: int, priority: str, waited: float):
+        self.tokens = tokens
+        self.priority = priority
+        self.waited = waited
+
+
+class ModelLimiter:
+    """
+    Buckets, in-flight count and priority queue for one model.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        limits: ModelLimits,
+        queue_max: int = QUEUE_MAX,
+        timeout: float = QUEUE_TIMEOUT,
+    ):
+        self.model = model
+        self.limits = limits
+        self.queue_max = queue_max
+        self.timeout = timeout
+        self._requests = _Bucket(limits.rpm) if limits.rpm else None
+        self._tokens = _Bucket(limits.tpm) if limits.tpm else None
+        self._in_flight = 0
+        self._queue: List[Tuple[int, int]] = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.granted = 0
+
+    # ---------- queue ----------
+
+    def _enqueue(self, priority: str) -> Tuple[int, int]:
+        ticket = (PRIORITIES.get(priority, PRIORITIES[DEFAULT_PRIORITY]), next(self._seq))
+        with self._lock:
+            if len(self._queue) >= self.queue_max:
+                RATE_LIMIT_REJECTED.inc(model=self.model, reason="queue_full")
+                raise RateLimitExceeded(f"{self.model}: {len(self._queue)} calls already queued")
+            heapq.heappush(self._queue, ticket)
+        return ticket
+
+    def _leave(self, ticket: Tuple[int, int]) -> None:
+        with self._lock:
+            if ticket in self._queue:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+
+    def _try_grant(self, ticket: Tuple[int, int], tokens: int) -> float:
+        """
+        Grant if `ticket` is at the head and capacity allows; otherwise seconds to wait.
+        """
+        with self._lock:
+            if self._queue[0] != ticket:
+                return _POLL_SECONDS
+            if self.limits.max_concurrency and self._in_flight >= self.limits.max_concurrency:
+                return _POLL_SECONDS
+
+            now = time.monotonic()
+            wait = 0.0
+            for bucket, amount in ((self._requests, 1), (self._tokens, tokens)):
+                if bucket is not None:
+                    bucket.refill(now)
+                    wait = max(wait, bucket.wait_for(amount))
+            if wait > 0:
+                return wait
+
+            if self._requests is not None:
+                self._requests.level -= 1
+            if self._tokens is not None:
+                self._tokens.level -= tokens
+            self._in_flight += 1
+            self.granted += 1
+            heapq.heappop(self._queue)
+            return 0.0
+
+    def _granted(self, tokens: int, priority: str, started: float) -> Lease:
+        waited = time.monotonic() - started
+        if waited > 0.001:
+            RATE_LIMIT_WAITS.inc(model=self.model, priority=priority)
+            RATE_LIMIT_WAIT_SECONDS.inc(waited, model=self.model, priority=priority)
+        return Lease(tokens, priority, waited)
+
+    def _wait_limit(self, timeout: Optional[float]) -> float:
+        return self.timeout if timeout is None else min(self.timeout, timeout)
+
+    def _timed_out(self, ticket: Tuple[int, int], started: float, limit: float) -> None:
+        if time.monotonic() - started > limit:
+            self._leave(ticket)
+            RATE_LIMIT_REJECTED.inc(model=self.model, reason="timeout")
+            raise RateLimitExceeded(f"{self.model}: no rate-limit grant within {limit:.1f}s")
+
+    # ---------- acquire / release ----------
+
+    def acquire(self, tokens: int, priority: Optional[str] = None, timeout: Optional[float] = None) -> Lease:
+        """
+        Block until the call may go out. `timeout` is the time the call itself
+        has left; the wait never outlasts it (nor the queue timeout).
+        """
+        priority = priority or current_priority()
+        limit = self._wait_limit(timeout)
+        started = time.monotonic()
+        ticket = self._enqueue(priority)
+        try:
+            while True:
+                wait = self._try_grant(ticket, tokens)
+                if wait == 0.0:
+                    return self._granted(tokens, priority, started)
+                self._timed_out(ticket, started, limit)
+                time.sleep(min(wait, _POLL_SECONDS))
+        except BaseException:
+            self._leave(ticket)
+            raise
+
+    async def aacquire(self, tokens: int, priority: Optional[str] = None, timeout: Optional[float] = None) -> Lease:
+        """
+        Async `acquire`; waits without blocking the event loop.
+        """
+        priority = priority or current_priority()
+        limit = self._wait_limit(timeout)
+        started = time.monotonic()
+        ticket = self._enqueue(priority)
+        try:
+            while True:
+                wait = self._try_grant(ticket, tokens)
+                if wait == 0.0:
+                    return self._granted(tokens, priority, started)
+                self._timed_out(ticket, started, limit)
+                await asyncio.sleep(min(wait, _POLL_SECONDS))
+        except BaseException:
+            self._leave(ticket)
+            raise
+
+    def release(self, lease: Lease, actual_tokens: Optional[int] = None) -> None:
+        """
+        Finish a call; settle the token estimate against real usage if known.
+        """
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+            if self._tokens is not None and actual_tokens is not None:
+                self._tokens.level = min(
+                    self._tokens.capacity,
+                    self._tokens.level + lease.tokens - actual_tokens,
+                )
+
+    def throttled(self) -> None:
+        """
+        The provider answered 429: empty the buckets so queued calls back off.
+        """
+        PROVIDER_RATE_LIMITED.inc(model=self.model)
+        with self._lock:
+            for bucket in (self._requests, self._tokens):
+                if bucket is not None:
+                    bucket.level = min(bucket.level, 0.0)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "model": self.model,
+                "queued": len(self._queue),
+                "in_flight": self._in_flight,
+                "granted": self.granted,
+                "requests_available": self._requests.level if self._requests else None,
+                "tokens_available": self._tokens.level if self._tokens else None,
+            }
+
+
+class RateLimiter:
+    """
+    Per-model limiters built lazily from default + per-model limits.
+    """
+
+    def __init__(self, default: ModelLimits, per_model: Optional[Dict[str, ModelLimits]] = None):
+        self.default = default
+        self.per_model = dict(per_model or {})
+        self._limiters: Dict[str, Optional[ModelLimiter]] = {}
+        self._lock = threading.Lock()
+
+    def for_model(self, model: str) -> Optional[ModelLimiter]:
+        """
+        The model's limiter, or None when it has no limits (callers skip limiting).
+        """
+        with self._lock:
+            if model not in self._limiters:
+                limits = self.per_model.get(model, self.default)
+                self._limiters[model] = None if limits.unlimited else ModelLimiter(model, limits)
+            return self._limiters[model]
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            limiters = [l for l in self._limiters.values() if l is not None]
+        return [limiter.stats() for limiter in limiters]
+
+
+def _from_env() -> RateLimiter:
+    default = ModelLimits(
+        rpm=float(os.getenv("UNHABIT_LLM_RPM", "0")),
+        tpm=float(os.getenv("UNHABIT_LLM_TPM", "0")),
+        max_concurrency=int(os.getenv("UNHABIT_LLM_MAX_CONCURRENCY", "0")),
+    )
+    return RateLimiter(default, parse_limits(os.getenv("UNHABIT_LLM_LIMITS", "")))
+
+
+_limiter = _from_env()
+
+
+def get_rate_limiter() -> RateLimiter:
+    return _limiter
+
+
+def set_rate_limiter(limiter: RateLimiter) -> None:
+    global _limiter
+    _limiter = limiter
@@ -0,0 +1,280 @@
+# response_cache.py
+"""
+Content-addressed cache for deterministic LLM nodes.
+
+Keys are a SHA-256 over (prompt template id, model, temperature, normalized
+input). Values are stored as JSON text so any tier can hold them. Lookups go
+through an in-memory LRU first and an optional SQLite tier second; SQLite hits
+are promoted into memory.
+
+Configuration (env):
+- UNHABIT_RESPONSE_CACHE=0          disable the cache entirely
+- UNHABIT_CACHE_MAX_ENTRIES=1024    in-memory LRU size
+- UNHABIT_CACHE_TTL_SECONDS=86400   default TTL (0 = never expire)
+- UNHABIT_CACHE_SQLITE_PATH=path    enable the on-disk tier
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple, Type
+
+from pydantic import BaseModel, ValidationError
+
+from metrics import counter
+
+CACHE_ENABLED = os.getenv("UNHABIT_RESPONSE_CACHE", "1") != "0"
+CACHE_MAX_ENTRIES = int(os.getenv("UNHABIT_CACHE_MAX_ENTRIES", "1024"))
+CACHE_TTL_SECONDS = float(os.getenv("UNHABIT_CACHE_TTL_SECONDS", "86400"))
+CACHE_SQLITE_PATH = os.getenv("UNHABIT_CACHE_SQLITE_PATH")
+
+CACHE_REQUESTS = counter(
+    "unhabit_response_cache_requests_total",
+    "Response cache lookups by namespace and result (hit/miss).",
+    labelnames=("namespace", "result"),
+)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_input(text: str) -> str:
+    """
+    Case- and whitespace-insensitive form of the user input.
+    """
+    return _WHITESPACE.sub(" ", (text or "").strip().lower())
+
+
+def template_id(name: str, template: str) -> str:
+    """
+    Stable id for a prompt template; editing the template changes the id,
+    which invalidates everything cached under the old wording.
+    """
+    digest = hashlib.sha256(template.encode("utf-8")).hexdigest()[:12]
+    return f"{name}:{digest}"
+
+
+def make_key(template: str, model: str, temperature: float, text: str) -> str:
+    payload = json.dumps(
+        [template, model, round(temperature, 4), normalize_input(text)],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# ---------- Tiers ----------
+
+Entry = Tuple[Optional[float], str]  # (expires_at, value)
+
+
+class MemoryLRUTier:
+    """
+    Thread-safe in-process LRU with per-entry expiry.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max(1, max_entries)
+        self._data: "OrderedDict[str, Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Entry]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[0] is not None and entry[0] <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry
+
+    def set(self, key: str, value: str, expires_at: Optional[float]) -> None:
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteTier:
+    """
+    On-disk tier shared across processes on the same host.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL"
+                ")"
+            )
+
+    def get(self, key: str) -> Optional[Entry]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT expires_at, value FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[0] is not None and row[0] <= time.time():
+                with self._conn:
+                    self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                return None
+            return row[0], row[1]
+
+    def set(self, key: str, value: str, expires_at: Optional[float]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at),
+            )
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM response_cache")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+# ---------- Cache ----------
+
+class ResponseCache:
+    """
+    Two-tier cache with TTLs and hit/miss accounting per namespace.
+    """
+
+    def __init__(
+        self,
+        memory: Optional[MemoryLRUTier] = None,
+        sqlite: Optional[SQLiteTier] = None,
+        ttl_seconds: Optional[float] = CACHE_TTL_SECONDS,
+    ):
+        self.memory = memory or MemoryLRUTier()
+        self.sqlite = sqlite
+        self.ttl_seconds = ttl_seconds if ttl_seconds else None
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def _record(self, namespace: str, result: str) -> None:
+        CACHE_REQUESTS.inc(namespace=namespace, result=result)
+        with self._lock:
+            bucket = self._stats.setdefault(namespace, {"hit": 0, "miss": 0})
+            bucket[result] += 1
+
+    def get(self, key: str, namespace: str = "default") -> Optional[str]:
+        entry = self.memory.get(key)
+        if entry is None and self.sqlite is not None:
+            entry = self.sqlite.get(key)
+            if entry is not None:
+                self.memory.set(key, entry[1], entry[0])
+        self._record(namespace, "miss" if entry is None else "hit")
+        return entry[1] if entry is not None else None
+
+    def set(self, key: str, value: str, ttl_seconds: Optional[float] = None) -> None:
+        ttl = ttl_seconds if ttl_seconds is not None else self.ttl_seconds
+        expires_at = time.time() + ttl if ttl else None
+        self.memory.set(key, value, expires_at)
+        if self.sqlite is not None:
+            self.sqlite.set(key, value, expires_at)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            out: Dict[str, Dict[str, Any]] = {}
+            for namespace, bucket in self._stats.items():
+                total = bucket["hit"] + bucket["miss"]
+                out[namespace] = {
+                    **bucket,
+                    "hit_rate": (bucket["hit"] / total) if total else 0.0,
+                }
+            return out
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self.sqlite is not None:
+            self.sqlite.clear()
+
+
+def _build_default_cache() -> Optional[ResponseCache]:
+    if not CACHE_ENABLED:
+        return None
+    sqlite = SQLiteTier(CACHE_SQLITE_PATH) if CACHE_SQLITE_PATH else None
+    return ResponseCache(MemoryLRUTier(CACHE_MAX_ENTRIES), sqlite, CACHE_TTL_SECONDS)
+
+
+_cache: Optional[ResponseCache] = _build_default_cache()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    return _cache
+
+
+def set_response_cache(cache: Optional[ResponseCache]) -> None:
+    """
+    Swap the process-wide cache (pass None to disable caching).
+    """
+    global _cache
+    _cache = cache
+
+
+# ---------- Node helpers ----------
+
+def lookup(
+    template: str,
+    model: str,
+    temperature: float,
+    text: str,
+    schema: Optional[Type[BaseModel]] = None,
+) -> Tuple[Optional[str], Any]:
+    """
+    Return (key, cached_value). The value is a `schema` instance, or a dict
+    when no schema is given. key is None when caching is disabled.
+    """
+    cache = _cache
+    if cache is None:
+        return None, None
+
+    key = make_key(template, model, temperature, text)
+    namespace = template.split(":", 1)[0]
+    raw = cache.get(key, namespace=namespace)
+    if raw is None:
+        return key, None
+
+    try:
+        if schema is not None:
+            return key, schema.model_validate_json(raw)
+        return key, json.loads(raw)
+    except (ValidationError, ValueError):
+        # Schema changed under a stale entry; treat it as a miss.
+        return key, None
+
+
+def store(key: Optional[str], value: Any) -> None:
+    """
+    Store a node result under a key from `lookup` (no-op when caching is off).
+    """
+    cache = _cache
+    if cache is None or key is None:
+        return
+    if isinstance(value, BaseModel):
+        raw = value.model_dump_json()
+    else:
+        raw = json.dumps(value, ensure_ascii=False)
+    cache.set(key, raw)
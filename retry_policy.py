@@ -0,0 +1,273 @@
+# retry_policy.py
+"""
+Unified retry policy for LLM calls.
+
+Failures are classified (timeout, rate_limit, server, connection, parse,
+fatal). Retryable ones are retried with exponential backoff and full
+jitter, inside a per-call time budget, with settings per node. The OpenAI
+SDK's own retries are switched off in llm_clients so attempts don't
+multiply.
+
+Retries also respect the node's deadline (deadlines.py): each attempt gets
+the time left as `attempt.timeout`, and hedging happens per attempt (a hedge
+gets the time left when it fires). Calls made inside the wrappers are
+labelled with the node for instrumentation.py.
+
+Configuration (env):
+- UNHABIT_RETRY_MAX_ATTEMPTS=3     attempts per call, first one included
+- UNHABIT_RETRY_BASE_DELAY=0.5     seconds before the first retry
+- UNHABIT_RETRY_MAX_DELAY=8        cap on a single backoff
+- UNHABIT_RETRY_BUDGET=60          seconds a call may spend across all attempts
+- UNHABIT_RETRY_POLICIES="plan21=4/60,coach=2/20"  per node attempts[/budget]
+
+A budget never exceeds the node's deadline (the deadline would cut it off
+first); larger configured budgets are lowered to the deadline at import.
+"""
+import asyncio
+import json
+import os
+import random
+import time
+from dataclasses import dataclass, replace
+from typing import Awaitable, Callable, Dict, FrozenSet, Optional, TypeVar
+
+import httpx
+import openai
+from langchain_core.exceptions import OutputParserException
+from pydantic import ValidationError
+
+from deadlines import ahedged, deadline_for, hedged, record_latency
+from instrumentation import llm_node, mark_retry
+from metrics import counter
+from rate_limiter import RateLimitExceeded
+
+T = TypeVar("T")
+
+TIMEOUT = "timeout"
+RATE_LIMIT = "rate_limit"
+SERVER = "server"
+CONNECTION = "connection"
+PARSE = "parse"
+FATAL = "fatal"
+
+TRANSIENT: FrozenSet[str] = frozenset({TIMEOUT, RATE_LIMIT, SERVER, CONNECTION})
+
+LLM_RETRIES = counter(
+    "unhabit_llm_retries_total",
+    "LLM call attempts that failed and were retried, by node and error class.",
+    labelnames=("node", "error"),
+)
+LLM_RETRY_EXHAUSTED = counter(
+    "unhabit_llm_retry_exhausted_total",
+    "LLM calls that failed after their last permitted attempt.",
+    labelnames=("node", "error"),
+)
+
+
+def classify(exc: BaseException) -> str:
+    """
+    Error class of an LLM call failure.
+    """
+    if isinstance(exc, (openai.APITimeoutError, httpx.TimeoutException, asyncio.TimeoutError, TimeoutError)):
+        return TIMEOUT
+    if isinstance(exc, (openai.RateLimitError, RateLimitExceeded)):
+        return RATE_LIMIT
+    if isinstance(exc, (openai.APIConnectionError, httpx.TransportError)):
+        return CONNECTION
+    if isinstance(exc, (json.JSONDecodeError, ValidationError, OutputParserException)):
+        return PARSE
+    status = getattr(exc, "status_code", None)
+    if status == 429:
+        return RATE_LIMIT
+    if isinstance(status, int) and status >= 500:
+        return SERVER
+    return FATAL
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int = int(os.getenv("UNHABIT_RETRY_MAX_ATTEMPTS", "3"))
+    base_delay: float = float(os.getenv("UNHABIT_RETRY_BASE_DELAY", "0.5"))
+    max_delay: float = float(os.getenv("UNHABIT_RETRY_MAX_DELAY", "8"))
+    budget: float = float(os.getenv("UNHABIT_RETRY_BUDGET", "60"))
+    retry_on: FrozenSet[str] = TRANSIENT | {PARSE}
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Full-jitter exponential backoff before retry number `attempt` (1-based).
+        """
+        cap = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, cap)
+
+    def next_delay(
+        self,
+        kind: str,
+        attempt: int,
+        started: float,
+        budget: Optional[float] = None,
+    ) -> Optional[float]:
+        """
+        Seconds to wait before another attempt, or None to give up.
+        Rate limits wait at least two base delays; jitter alone can be ~0.
+        """
+        budget = self.budget if budget is None else budget
+        if kind not in self.retry_on or attempt >= self.max_attempts:
+            return None
+        delay = self.backoff(attempt)
+        if kind == RATE_LIMIT:
+            delay = max(delay, self.base_delay * 2)
+        if time.monotonic() - started + delay >= budget:
+            return None
+        return delay
+
+
+@dataclass
+class Attempt:
+    """
+    Passed to the retried call: which try this is and why the last one failed,
+    so the call can adjust (e.g. a stricter JSON instruction after a parse error).
+    """
+
+    number: int = 0
+    last_error: Optional[str] = None
+    # Seconds left before the node's deadline; pass it as the request timeout.
+    timeout: Optional[float] = None
+
+
+def _parse_overrides(spec: str) -> Dict[str, Dict[str, float]]:
+    overrides: Dict[str, Dict[str, float]] = {}
+    for part in filter(None, (p.strip() for p in (spec or "").split(","))):
+        node, _, values = part.partition("=")
+        fields = values.split("/")
+        override: Dict[str, float] = {"max_attempts": int(fields[0])}
+        if len(fields) > 1 and fields[1]:
+            override["budget"] = float(fields[1])
+        overrides[node.strip()] = override
+    return overrides
+
+
+_DEFAULT = RetryPolicy()
+
+# Coach turns have a user waiting; plan21 is the expensive one worth saving,
+# so it gets its whole (longer) deadline to retry in.
+NODE_POLICIES: Dict[str, RetryPolicy] = {
+    "safety": _DEFAULT,
+    "canonicalize": _DEFAULT,
+    "quiz_form": _DEFAULT,
+    "quiz_summary": _DEFAULT,
+    "plan21": replace(_DEFAULT, budget=deadline_for("plan21")),
+    "coach": replace(_DEFAULT, max_attempts=2, budget=min(_DEFAULT.budget, 20), retry_on=TRANSIENT),
+    "chat_summary": replace(_DEFAULT, max_attempts=2, budget=min(_DEFAULT.budget, 20)),
+}
+for _node, _override in _parse_overrides(os.getenv("UNHABIT_RETRY_POLICIES", "")).items():
+    NODE_POLICIES[_node] = replace(NODE_POLICIES.get(_node, _DEFAULT), **_override)
+for _node, _policy in NODE_POLICIES.items():
+    if _policy.budget > deadline_for(_node):
+        NODE_POLICIES[_node] = replace(_policy, budget=deadline_for(_node))
+
+
+def policy_for(node: str) -> RetryPolicy:
+    return NODE_POLICIES.get(node, _DEFAULT)
+
+
+def retry_delay(
+    node: str,
+    exc: BaseException,
+    attempt: int,
+    started: float,
+    policy: Optional[RetryPolicy] = None,
+    budget: Optional[float] = None,
+) -> Optional[float]:
+    """
+    Wait before retrying after `exc` ended attempt number `attempt`, or None
+    to give up. Records the retry / exhaustion metrics.
+
+    The budget defaults to the policy's, capped by the node's deadline.
+    Used directly where a plain call wrapper doesn't fit: streams (retryable
+    only before their first chunk) and batch rounds.
+    """
+    policy = policy or policy_for(node)
+    if budget is None:
+        budget = min(policy.budget, deadline_for(node))
+    kind = classify(exc)
+    delay = policy.next_delay(kind, attempt, started, budget)
+    if delay is None:
+        LLM_RETRY_EXHAUSTED.inc(node=node, error=kind)
+    else:
+        LLM_RETRIES.inc(node=node, error=kind)
+        mark_retry()
+    return delay
+
+
+def call_with_retry(node: str, fn: Callable[[Attempt], T], policy: Optional[RetryPolicy] = None) -> T:
+    """
+    Run `fn(attempt)` under the node's retry policy and deadline (hedged if
+    the node is); re-raises the last error.
+
+    The deadline reaches the request as `attempt.timeout`: sync calls can't
+    be interrupted from outside, so `fn` must pass it on.
+    """
+    with llm_node(node):
+        return _call_with_retry(node, fn, policy)
+
+
+def _call_with_retry(node: str, fn: Callable[[Attempt], T], policy: Optional[RetryPolicy]) -> T:
+    attempt = Attempt()
+    started = time.monotonic()
+    deadline = started + deadline_for(node)
+    while True:
+        attempt.number += 1
+        attempt.timeout = max(deadline - time.monotonic(), 0.001)
+        call_started = time.monotonic()
+        try:
+            result = hedged(node, lambda timeout: fn(replace(attempt, timeout=timeout)), deadline)
+            record_latency(node, time.monotonic() - call_started)
+            return result
+        except Exception as exc:
+            delay = retry_delay(node, exc, attempt.number, started, policy)
+            if delay is None:
+                raise
+            attempt.last_error = classify(exc)
+            time.sleep(delay)
+
+
+async def acall_with_retry(
+    node: str,
+    fn: Callable[[Attempt], Awaitable[T]],
+    policy: Optional[RetryPolicy] = None,
+) -> T:
+    """
+    Async `call_with_retry`; `fn(attempt)` returns an awaitable.
+
+    Here the deadline is enforced from outside too (time queued at the rate
+    limiter included); passing `attempt.timeout` on is still worthwhile.
+    """
+    with llm_node(node):
+        return await _acall_with_retry(node, fn, policy)
+
+
+async def _acall_with_retry(
+    node: str,
+    fn: Callable[[Attempt], Awaitable[T]],
+    policy: Optional[RetryPolicy],
+) -> T:
+    attempt = Attempt()
+    started = time.monotonic()
+    deadline = started + deadline_for(node)
+    while True:
+        attempt.number += 1
+        attempt.timeout = max(deadline - time.monotonic(), 0.001)
+        call_started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(
+                ahedged(node, lambda timeout: fn(replace(attempt, timeout=timeout)), deadline),
+                attempt.timeout,
+            )
+            record_latency(node, time.monotonic() - call_started)
+            return result
+        except Exception as exc:
+            delay = retry_delay(node, exc, attempt.number, started, policy)
+            if delay is None:
+                raise
+            attempt.last_error = classify(exc)
+            await asyncio.sleep(delay)
@@ -0,0 +1,307 @@
+# safety_prefilter.py
+"""
+Local first stage of the safety classifier.
+
+One Aho-Corasick automaton, built at import, scans the folded user text for
+three kinds of terms in a single pass:
+
+- block:   unambiguous high-risk phrases ("kill myself", "pro ana", "heroin"),
+           each mapped to a SafetyResult.risk category;
+- caution: words that are usually harmless but can carry risk ("die",
+           "pills", "teen", "weight");
+- habit:   the everyday habit slang from habit_lexicon ("tiktok", "zyn").
+
+Decisions:
+- "block":    any block term. Answered locally with block_and_escalate, i.e.
+              never weaker than what the LLM would return.
+- "allow":    a known everyday habit, no block or caution term, short text,
+              and every word is habit slang or in the SAFE_WORDS vocabulary.
+- "escalate": everything else goes to the LLM classifier as before.
+
+Only "allow" skips a check the LLM would have made, so the allow rule is
+deliberately narrow: a lexicon can't list every risky word, so any word
+outside the vocabulary escalates, and substance categories (alcohol,
+cannabis) always escalate because severity there is a judgement call.
+
+Configuration (env):
+- UNHABIT_SAFETY_PREFILTER=1        set to 0 to send everything to the LLM
+- UNHABIT_PREFILTER_MAX_ALLOW_CHARS=280
+"""
+import os
+import re
+import unicodedata
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from habit_lexicon import FILLER_WORDS, SLANG_TO_CATEGORY, fold
+from metrics import counter
+from schemas import SafetyResult
+
+PREFILTER_ENABLED = os.getenv("UNHABIT_SAFETY_PREFILTER", "1") != "0"
+MAX_ALLOW_CHARS = int(os.getenv("UNHABIT_PREFILTER_MAX_ALLOW_CHARS", "280"))
+
+ALLOW, BLOCK, ESCALATE = "allow", "block", "escalate"
+
+PREFILTER_DECISIONS = counter(
+    "unhabit_safety_prefilter_total",
+    "Local safety pre-filter decisions (allow, block, escalate), by risk category.",
+    labelnames=("decision", "risk"),
+)
+
+# ---------- Lexicons ----------
+
+# A trailing "*" matches any word ending ("suicid*" -> suicide, suicidal).
+# A block is final (the LLM never sees the text), so block stems must not
+# start everyday words: "rape" and "pedo" are listed word by word because
+# "rapeseed" and "pedometer" exist. Phrases with an everyday reading ("I hurt
+# her feelings") are caution terms instead.
+BLOCK_TERMS: Dict[str, Tuple[str, ...]] = {
+    "self_harm": (
+        "kill myself", "killing myself", "suicid*", "end my life", "ending my life",
+        "take my own life", "want to die", "wanna die", "wish i was dead", "wish i were dead",
+        "better off dead", "no reason to live", "hurt myself", "hurting myself", "cut myself",
+        "cutting myself", "self harm*", "selfharm*", "self injur*",
+    ),
+    "eating_disorder": (
+        "pro ana", "proana", "pro mia", "thinspo*", "purging", "purge after",
+        "make myself throw up", "make myself vomit", "making myself throw up",
+        "making myself vomit", "starve myself", "starving myself", "stop eating completely",
+        "laxatives to lose",
+    ),
+    "severe_addiction": (
+        "heroin", "fentanyl", "meth", "crystal meth", "methamphetamine", "cocaine",
+        "crack cocaine", "smoking crack", "shooting up",
+    ),
+    "violence": (
+        "kill him", "kill her", "kill them", "kill someone", "kill people", "murder him",
+        "murder her", "murder someone", "stab him", "stab her", "stab someone", "shoot him", "shoot her", "shoot someone",
+        "shoot up a", "make a bomb", "build a bomb", "rape", "raped", "rapes", "raping",
+        "rapist", "rapists", "non consensual", "nonconsensual",
+    ),
+    "other": (
+        "child porn*", "csam", "underage porn*", "underage sex*", "incest", "pedo", "pedos", "pedophile",
+        "pedophiles", "pedophilia", "paedo", "paedos", "paedophile", "paedophiles", "paedophilia",
+        "loli", "lolicon",
+    ),
+}
+
+# Not evidence of risk on their own, but the LLM must decide.
+CAUTION_TERMS: Tuple[str, ...] = (
+    # self-harm / despair
+    "die", "dying", "dead", "death", "kill*", "kms", "hopeless", "worthless", "hate myself",
+    "give up on life", "no point", "end it", "end it all", "overdos*", "blood", "bleed*",
+    # eating
+    "vomit*", "throw up", "throwing up", "laxative*", "starv*", "fasting", "calorie*",
+    "weight", "skinny", "thin", "anorex*", "bulimi*", "binge*", "purge*",
+    # substances and medicine
+    "drug*", "pill*", "med", "meds", "medication*", "medicine*", "dose*", "dosage", "mg",
+    "milligram*", "prescri*", "doctor", "diagnos*", "depress*", "adhd", "adderall", "xanax",
+    "benzo*", "opioid*", "opiate*", "oxy*", "percocet", "ketamine", "mdma", "molly", "lsd",
+    "acid", "shroom*", "coke", "crack", "needle*", "inject*", "alcoholic", "blackout*", "withdrawal*",
+    "seizure*", "detox*", "supplement*", "patch", "patches", "gum", "lozenge*",
+    # minors and sexual content ("i m 1*" catches "I'm 15")
+    "i m 1*", "im 1*", "i am 1*", "years old", "yrs old", "yo", "age", "aged", "teen*", "kid", "kids", "child*", "underage", "minor", "minors", "young", "school*",
+    "student*", "sex*", "nude*", "naked",
+    # violence and crime
+    "hurt someone", "hurt him", "hurt her", "hurt them", "murder*", "stab*", "shoot*", "gun*", "knife", "knives", "weapon*", "bomb*", "fight*",
+    "hit", "hitting", "abuse*", "assault*", "revenge", "steal*", "stole", "shoplift*",
+    "illegal", "police", "arrest*", "hack*",
+)
+
+# Habit categories whose slang alone is not enough to allow.
+ESCALATE_CATEGORIES = frozenset({"alcohol", "cannabis"})
+
+# Everyday words an allowed text may contain besides habit slang and numbers.
+SAFE_WORDS = frozenset("""
+    a about after again all always am an and any app apps are at back bad be because bed bedtime been
+    before being best better bit bored boredom breakfast but buy buying by can cans car check checking
+    chew coffee caffeine commute constantly control cravings craving could cup cups cut cutting daily day
+    days desk did dinner do does doing don done down during each early easy eat eating energy even evening
+    evenings every everyday family feel feeling first for friends from game games get go going good got
+    habit habits had hard has have help home hooked hour hours house how i if in instead into is it its
+    job just keep kind last late less like little lot lots lunch lunchtime many me meeting meetings
+    minutes month months more morning mornings much my need never new next night nightly nights no not
+    now of off office often ok okay on once one only open opening or out over pack packs phone plan
+    problem quit quitting really reduce right s screen should so some sometimes spend spending spent
+    start started starting still stop stopping stress stressed struggle struggling t than that the them
+    then there these they things this those time times tips to today tomorrow tonight too tried try
+    trying two three four five up urge urges usually very ve re ll m d want wanna was waste wasting watch
+    watching way week weekend weekends weeks what when whenever where while why will with without work
+    working would yesterday you your bite biting nails knuckles anxious tired lonely cigarette cigarettes
+    videos video online scrolling
+""".split()) | frozenset(w for word in FILLER_WORDS for w in word.replace("'", " ").split())
+
+_BLOCK_MESSAGES: Dict[str, str] = {
+    "self_harm": (
+        "I’m really sorry you’re feeling this way, and I can’t help with this here. "
+        "Please reach out right now to someone you trust or a local crisis line or emergency number; "
+        "you deserve support from a real person."
+    ),
+    "eating_disorder": (
+        "I can’t help with this here, because it could put your health at risk. "
+        "Please consider talking to a doctor or an eating-disorder support service who can help safely."
+    ),
+    "severe_addiction": (
+        "I can’t safely help with this here, because it may involve serious health risks. "
+        "Please reach out to a doctor, an addiction service, or emergency help if you feel unsafe."
+    ),
+    "violence": (
+        "I can’t help with anything that could harm you or others. "
+        "If you or someone else might be in danger, please contact local emergency services or a trusted person."
+    ),
+    "other": (
+        "I’m here only for habit and behavior coaching, so I can’t respond to this. "
+        "If this is about your health, safety, or something serious, please reach out to a "
+        "qualified professional or local support service."
+    ),
+}
+
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def normalize(text: str) -> str:
+    """
+    Fold case, accents and leetspeak, and reduce the text to " word word ... "
+    so that every term boundary is a single space.
+    """
+    text = text or ""
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    # Plain numbers stay numbers ("10 pouches"); leetspeak only folds inside words.
+    words = [w if w.strip(".,;:?!()%").isdigit() else fold(w) for w in text.lower().split()]
+    return " " + _NON_WORD.sub(" ", " ".join(words)).strip() + " "
+
+
+# ---------- Automaton ----------
+
+Label = Tuple[str, str]  # (kind, category)
+
+
+class Automaton:
+    """
+    Aho-Corasick automaton over character strings. `scan` returns the labels
+    of every pattern occurring in the text, in one pass.
+    """
+
+    def __init__(self, patterns: List[Tuple[str, Label]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Tuple[Label, ...]] = [()]
+        for pattern, label in patterns:
+            state = 0
+            for ch in pattern:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                state = nxt
+            if label not in self._out[state]:
+                self._out[state] += (label,)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] += tuple(x for x in self._out[self._fail[nxt]] if x not in self._out[nxt])
+
+    def __len__(self) -> int:
+        return len(self._goto)
+
+    def scan(self, text: str) -> List[Label]:
+        goto, fail, out = self._goto, self._fail, self._out
+        found: List[Label] = []
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.extend(out[state])
+        return found
+
+
+def _pattern(term: str) -> str:
+    # Terms are matched on word boundaries of the normalized text.
+    if term.endswith("*"):
+        return normalize(term[:-1]).rstrip()
+    return normalize(term)
+
+
+def _build() -> Automaton:
+    patterns: List[Tuple[str, Label]] = []
+    for risk, terms in BLOCK_TERMS.items():
+        patterns.extend((_pattern(term), (BLOCK, risk)) for term in terms)
+    patterns.extend((_pattern(term), (ESCALATE, "caution")) for term in CAUTION_TERMS)
+    patterns.extend((_pattern(slang), (ALLOW, category)) for slang, category in SLANG_TO_CATEGORY.items())
+    return Automaton(patterns)
+
+
+AUTOMATON = _build()
+_HABIT_WORDS = frozenset(word for slang in SLANG_TO_CATEGORY for word in normalize(slang).split())
+
+# Most severe first, so a text with several block terms gets the strictest message.
+_RISK_ORDER = ("self_harm", "other", "violence", "eating_disorder", "severe_addiction")
+
+
+# ---------- Screening ----------
+
+@dataclass(frozen=True)
+class Screening:
+    decision: str  # allow | block | escalate
+    risk: str  # SafetyResult.risk for allow/block, "unknown" for escalate
+    matches: Tuple[Label, ...] = ()
+
+    def result(self) -> Optional[SafetyResult]:
+        """
+        The SafetyResult to use without an LLM call, or None to escalate.
+        """
+        if self.decision == BLOCK:
+            return SafetyResult(risk=self.risk, action="block_and_escalate", message=_BLOCK_MESSAGES[self.risk])
+        if self.decision == ALLOW:
+            return SafetyResult(risk="none", action="allow", message="")
+        return None
+
+
+def screen(text: str) -> Screening:
+    """
+    Classify `text` locally; see the module docstring for the rules.
+    """
+    normalized = normalize(text)
+    matches = tuple(AUTOMATON.scan(normalized))
+    blocked = {category for kind, category in matches if kind == BLOCK}
+    if blocked:
+        risk = next(r for r in _RISK_ORDER if r in blocked)
+        return Screening(BLOCK, risk, matches)
+
+    habits = {category for kind, category in matches if kind == ALLOW}
+    if (
+        habits
+        and not habits & ESCALATE_CATEGORIES
+        and all(kind == ALLOW for kind, _ in matches)
+        and len(text) <= MAX_ALLOW_CHARS
+        and all(w in SAFE_WORDS or w in _HABIT_WORDS or w.isdigit() for w in normalized.split())
+    ):
+        return Screening(ALLOW, "none", matches)
+    return Screening(ESCALATE, "unknown", matches)
+
+
+def prefilter(text: str) -> Optional[SafetyResult]:
+    """
+    Local SafetyResult for clear-cut text, or None when the LLM must decide.
+    Counts every decision in unhabit_safety_prefilter_total.
+    """
+    if not PREFILTER_ENABLED:
+        return None
+    screening = screen(text)
+    PREFILTER_DECISIONS.inc(decision=screening.decision, risk=screening.risk)
+    return screening.result()
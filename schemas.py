@@ -161,24 +161,40 @@ class HabitState(BaseModel):
     # You can store this as JSON string or formatted text like:
     # "q1: ..., q2: ..., q3: ..."
     user_quiz_answers: Optional[str] = None
+    # Fingerprint of the quiz_form those answers were given to
+    quiz_answers_for: Optional[str] = None
 
     # LLM outputs
     safety: Optional[SafetyResult] = None
     quiz_summary: Optional[QuizSummary] = None
     plan21: Optional[Plan21D] = None
 
+    # Where the user is in the plan: ISO date the plan started, and an explicit
+    # day override (1–21) that wins over the date when set.
+    plan_started_at: Optional[str] = None
+    current_day: Optional[int] = None
+
     # Coaching
     last_user_message: Optional[str] = None
     coach_reply: Optional[str] = None
 
+    # Safety screen of last_user_message, run alongside the coach reply
+    turn_safety: Optional[SafetyResult] = None
+
     # Conversation history for the coach
     # Each message: {"role": "user" | "assistant", "content": "..."}
     chat_history: List[Dict[str, str]] = []
 
+    # Running summary of turns that scrolled out of the coach's verbatim window,
+    # and how many chat_history messages it already covers.
+    chat_summary: Optional[str] = None
+    chat_summary_upto: int = 0
+
     # Optional routing field if you add routers later
     next: Optional[str] = None
 
     canonical_habit_name: Optional[str] = None
+    habit_category: Optional[str] = None
     canonical_confidence: Optional[str] = None
 
 
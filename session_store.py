@@ -0,0 +1,439 @@
+# session_store.py
+"""
+Persistent HabitState storage keyed by `HabitState.user_id`.
+
+A session is stored as two parts:
+- a compact JSON snapshot of everything except chat_history
+  (None/default fields dropped), rewritten on save;
+- the chat messages, appended incrementally so a coach turn writes two
+  small rows instead of the whole conversation.
+
+The snapshot also records a digest of the messages stored with it. If the
+history no longer starts with exactly those messages (reset, trimmed or
+rewritten), the message log is rewritten instead of appended to.
+
+Resuming is one `load()` instead of re-running safety/quiz/summary/plan.
+
+Backends: SQLite, a directory of files, and Redis (any client exposing
+get/set/rpush/llen/lrange/delete/expire, e.g. redis-py or the in-process
+`MemoryRedis` below, for tests and local runs without a server).
+Select one with UNHABIT_SESSION_STORE:
+- sqlite:///sessions.db (relative) or sqlite:////abs/path/sessions.db
+- file:///path/to/dir
+- redis://host:6379/0
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from schemas import HabitState
+
+Message = Dict[str, str]
+
+# Snapshot key holding the digest of the stored message log.
+_DIGEST_KEY = "_messages_digest"
+
+
+def _digest(messages: List[Message]) -> str:
+    encoded = json.dumps(messages, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _snapshot(state: HabitState, digest: str) -> str:
+    data = state.model_dump(
+        mode="json",
+        exclude={"chat_history"},
+        exclude_none=True,
+        exclude_defaults=True,
+    )
+    data[_DIGEST_KEY] = digest
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def _stored_digest(snapshot: Optional[str]) -> Optional[str]:
+    return json.loads(snapshot).get(_DIGEST_KEY) if snapshot else None
+
+
+def _restore(snapshot: str, messages: List[Message]) -> HabitState:
+    data: Dict[str, Any] = json.loads(snapshot)
+    data.pop(_DIGEST_KEY, None)
+    data["chat_history"] = messages
+    return HabitState.model_validate(data)
+
+
+class SessionStore(ABC):
+    """
+    Backend interface. Subclasses implement the raw snapshot/message operations;
+    `save()` works out which messages are new.
+    """
+
+    @abstractmethod
+    def load(self, user_id: str) -> Optional[HabitState]:
+        ...
+
+    @abstractmethod
+    def read_snapshot(self, user_id: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def write_snapshot(self, user_id: str, snapshot: str) -> None:
+        ...
+
+    @abstractmethod
+    def append_messages(self, user_id: str, messages: List[Message]) -> None:
+        ...
+
+    @abstractmethod
+    def message_count(self, user_id: str) -> int:
+        ...
+
+    @abstractmethod
+    def clear_messages(self, user_id: str) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self, user_id: str) -> None:
+        ...
+
+    def save(self, state: HabitState) -> None:
+        """
+        Persist state: append only unseen chat messages, then rewrite the snapshot.
+        """
+        if not state.user_id:
+            raise ValueError("HabitState.user_id is required to persist a session")
+
+        history = state.chat_history or []
+        stored = self.message_count(state.user_id)
+        if stored and (
+            stored > len(history)
+            or _digest(history[:stored]) != _stored_digest(self.read_snapshot(state.user_id))
+        ):
+            # History was reset, trimmed or rewritten; start the message log over.
+            self.clear_messages(state.user_id)
+            stored = 0
+        if len(history) > stored:
+            self.append_messages(state.user_id, history[stored:])
+
+        # Written last: a save that dies before this leaves a stale digest,
+        # so the next save rewrites the log rather than trusting it.
+        self.write_snapshot(state.user_id, _snapshot(state, _digest(history)))
+
+
+# ---------- SQLite ----------
+
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " user_id TEXT PRIMARY KEY,"
+                " snapshot TEXT NOT NULL"
+                ")"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                " user_id TEXT NOT NULL,"
+                " seq INTEGER NOT NULL,"
+                " role TEXT NOT NULL,"
+                " content TEXT NOT NULL,"
+                " PRIMARY KEY (user_id, seq)"
+                ")"
+            )
+
+    def load(self, user_id: str) -> Optional[HabitState]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT snapshot FROM sessions WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            messages = [
+                {"role": role, "content": content}
+                for role, content in self._conn.execute(
+                    "SELECT role, content FROM messages WHERE user_id = ? ORDER BY seq",
+                    (user_id,),
+                )
+            ]
+        return _restore(row[0], messages)
+
+    def read_snapshot(self, user_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT snapshot FROM sessions WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def write_snapshot(self, user_id: str, snapshot: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (user_id, snapshot) VALUES (?, ?)",
+                (user_id, snapshot),
+            )
+
+    def append_messages(self, user_id: str, messages: List[Message]) -> None:
+        with self._lock, self._conn:
+            (start,) = self._conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            self._conn.executemany(
+                "INSERT INTO messages (user_id, seq, role, content) VALUES (?, ?, ?, ?)",
+                [
+                    (user_id, start + i, msg.get("role", "user"), msg.get("content", ""))
+                    for i, msg in enumerate(messages)
+                ],
+            )
+
+    def message_count(self, user_id: str) -> int:
+        with self._lock:
+            (count,) = self._conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return count
+
+    def clear_messages(self, user_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
+
+    def delete(self, user_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+            self._conn.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
+
+
+# ---------- Files ----------
+
+class FileSessionStore(SessionStore):
+    """
+    One `<user>.json` snapshot plus one append-only `<user>.messages.jsonl` per user.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _path(self, user_id: str, suffix: str) -> str:
+        return os.path.join(self.directory, quote(user_id, safe="") + suffix)
+
+    def read_snapshot(self, user_id: str) -> Optional[str]:
+        try:
+            with open(self._path(user_id, ".json"), encoding="utf-8") as fh:
+                return fh.read()
+        except FileNotFoundError:
+            return None
+
+    def load(self, user_id: str) -> Optional[HabitState]:
+        snapshot = self.read_snapshot(user_id)
+        if snapshot is None:
+            return None
+
+        messages: List[Message] = []
+        try:
+            with open(self._path(user_id, ".messages.jsonl"), encoding="utf-8") as fh:
+                messages = [json.loads(line) for line in fh if line.strip()]
+        except FileNotFoundError:
+            pass
+        return _restore(snapshot, messages)
+
+    def write_snapshot(self, user_id: str, snapshot: str) -> None:
+        path = self._path(user_id, ".json")
+        tmp = path + ".tmp"
+        with self._lock:
+            with open(tmp, "w", encoding="utf-8") as fh:
+                fh.write(snapshot)
+            os.replace(tmp, path)
+
+    def append_messages(self, user_id: str, messages: List[Message]) -> None:
+        with self._lock, open(self._path(user_id, ".messages.jsonl"), "a", encoding="utf-8") as fh:
+            for msg in messages:
+                fh.write(json.dumps(msg, ensure_ascii=False) + "\n")
+
+    def message_count(self, user_id: str) -> int:
+        try:
+            with open(self._path(user_id, ".messages.jsonl"), encoding="utf-8") as fh:
+                return sum(1 for line in fh if line.strip())
+        except FileNotFoundError:
+            return 0
+
+    def clear_messages(self, user_id: str) -> None:
+        with self._lock:
+            try:
+                os.remove(self._path(user_id, ".messages.jsonl"))
+            except FileNotFoundError:
+                pass
+
+    def delete(self, user_id: str) -> None:
+        self.clear_messages(user_id)
+        with self._lock:
+            try:
+                os.remove(self._path(user_id, ".json"))
+            except FileNotFoundError:
+                pass
+
+
+# ---------- Redis ----------
+
+class RedisSessionStore(SessionStore):
+    """
+    Snapshot in a string key, messages in a list key.
+
+    `client` only needs get/set/rpush/llen/lrange/delete/expire, so
+    redis-py, a fakeredis instance or `MemoryRedis` all work.
+    With ttl_seconds, both keys expire together and every save renews them.
+    """
+
+    def __init__(self, client: Any, prefix: str = "unhabit:session:", ttl_seconds: Optional[int] = None):
+        self.client = client
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+
+    def _state_key(self, user_id: str) -> str:
+        return f"{self.prefix}{user_id}:state"
+
+    def _messages_key(self, user_id: str) -> str:
+        return f"{self.prefix}{user_id}:messages"
+
+    @staticmethod
+    def _text(value: Any) -> str:
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    def load(self, user_id: str) -> Optional[HabitState]:
+        snapshot = self.client.get(self._state_key(user_id))
+        if snapshot is None:
+            return None
+        messages = [
+            json.loads(self._text(raw))
+            for raw in self.client.lrange(self._messages_key(user_id), 0, -1)
+        ]
+        return _restore(self._text(snapshot), messages)
+
+    def read_snapshot(self, user_id: str) -> Optional[str]:
+        snapshot = self.client.get(self._state_key(user_id))
+        return None if snapshot is None else self._text(snapshot)
+
+    def write_snapshot(self, user_id: str, snapshot: str) -> None:
+        if self.ttl_seconds:
+            self.client.set(self._state_key(user_id), snapshot, ex=self.ttl_seconds)
+            # Keep the message list alive as long as the state it belongs to.
+            self.client.expire(self._messages_key(user_id), self.ttl_seconds)
+        else:
+            self.client.set(self._state_key(user_id), snapshot)
+
+    def append_messages(self, user_id: str, messages: List[Message]) -> None:
+        if messages:
+            self.client.rpush(
+                self._messages_key(user_id),
+                *(json.dumps(msg, ensure_ascii=False) for msg in messages),
+            )
+            if self.ttl_seconds:
+                self.client.expire(self._messages_key(user_id), self.ttl_seconds)
+
+    def message_count(self, user_id: str) -> int:
+        return int(self.client.llen(self._messages_key(user_id)))
+
+    def clear_messages(self, user_id: str) -> None:
+        self.client.delete(self._messages_key(user_id))
+
+    def delete(self, user_id: str) -> None:
+        self.client.delete(self._state_key(user_id), self._messages_key(user_id))
+
+
+class MemoryRedis:
+    """
+    In-process stand-in for the redis-py calls RedisSessionStore makes
+    (str values, lists, key expiry). `clock` is injectable so tests can
+    move time forward.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self._data: Dict[str, Tuple[Any, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key: str) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and self.clock() >= expires_at:
+            del self._data[key]
+            return None
+        return value
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            value = self._live(key)
+        return None if value is None else value.encode("utf-8")
+
+    def set(self, key: str, value: str, ex: Optional[int] = None) -> bool:
+        with self._lock:
+            self._data[key] = (value, None if ex is None else self.clock() + ex)
+        return True
+
+    def rpush(self, key: str, *values: str) -> int:
+        with self._lock:
+            items = self._live(key)
+            expires_at = self._data[key][1] if items is not None else None
+            items = list(items or []) + list(values)
+            self._data[key] = (items, expires_at)
+            return len(items)
+
+    def llen(self, key: str) -> int:
+        with self._lock:
+            return len(self._live(key) or [])
+
+    def lrange(self, key: str, start: int, end: int) -> List[bytes]:
+        with self._lock:
+            items = self._live(key) or []
+        stop = len(items) if end == -1 else end + 1
+        return [item.encode("utf-8") for item in items[start:stop]]
+
+    def delete(self, *keys: str) -> int:
+        with self._lock:
+            return sum(1 for key in keys if self._data.pop(key, None) is not None)
+
+    def expire(self, key: str, seconds: int) -> bool:
+        with self._lock:
+            value = self._live(key)
+            if value is None:
+                return False
+            self._data[key] = (value, self.clock() + seconds)
+            return True
+
+    def ttl(self, key: str) -> int:
+        # redis-py semantics: -2 missing key, -1 no expiry.
+        with self._lock:
+            if self._live(key) is None:
+                return -2
+            expires_at = self._data[key][1]
+        return -1 if expires_at is None else max(0, int(expires_at - self.clock()))
+
+
+def store_from_url(url: str) -> SessionStore:
+    if url.startswith("sqlite:///"):
+        return SQLiteSessionStore(url[len("sqlite:///"):])
+    if url.startswith("file:///"):
+        return FileSessionStore(url[len("file://"):])
+    if url.startswith(("redis://", "rediss://")):
+        import redis  # optional dependency, only needed for this backend
+
+        return RedisSessionStore(redis.Redis.from_url(url))
+    raise ValueError(f"Unsupported session store URL: {url}")
+
+
+def get_session_store() -> Optional[SessionStore]:
+    """
+    Store configured by UNHABIT_SESSION_STORE, or None when persistence is off.
+    """
+    url = os.getenv("UNHABIT_SESSION_STORE")
+    return store_from_url(url) if url else None
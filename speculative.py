@@ -0,0 +1,101 @@
+# speculative.py
+"""
+Speculative execution of the safety check and quiz generation.
+
+`quiz_form_node` only needs `habit_description`, so it can run at the same
+time as `safety_node`. The quiz is thrown away when safety comes back as
+"block_and_escalate"; the wasted-call counter tells us what that costs.
+"""
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Tuple
+
+from langgraph.graph import END
+
+from ai_nodes import safety_node, quiz_form_node, asafety_node, aquiz_form_node
+from metrics import counter
+from schemas import HabitState
+
+SPECULATIVE_QUIZ_CALLS = counter(
+    "unhabit_speculative_quiz_total",
+    "Quiz generations started speculatively alongside the safety check.",
+)
+SPECULATIVE_QUIZ_WASTED = counter(
+    "unhabit_speculative_quiz_wasted_total",
+    "Speculative quiz generations discarded because safety blocked the input.",
+)
+
+# Two calls per request; shared so Streamlit reruns don't spawn new pools.
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="speculative")
+
+
+def _is_blocked(safety_update: Dict[str, Any]) -> bool:
+    safety = safety_update.get("safety")
+    return safety is not None and getattr(safety, "action", None) == "block_and_escalate"
+
+
+def _join(
+    safety_update: Dict[str, Any],
+    quiz_update: Dict[str, Any],
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    SPECULATIVE_QUIZ_CALLS.inc()
+    if _is_blocked(safety_update):
+        SPECULATIVE_QUIZ_WASTED.inc()
+        return safety_update, {"quiz_form": None}
+    return safety_update, quiz_update
+
+
+def run_safety_and_quiz(state: HabitState) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Run `safety_node` and `quiz_form_node` concurrently on worker threads.
+
+    Returns (safety_update, quiz_update); quiz_update is {"quiz_form": None}
+    when the input was blocked.
+    """
+    # Each call gets its own copy of the context so priority, node labels and
+    # the client registry follow it onto the worker thread.
+    safety_future = _executor.submit(contextvars.copy_context().run, safety_node, state)
+    quiz_future = _executor.submit(contextvars.copy_context().run, quiz_form_node, state)
+    return _join(safety_future.result(), quiz_future.result())
+
+
+async def arun_safety_and_quiz(state: HabitState) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Async `run_safety_and_quiz` (both calls share the running event loop).
+    """
+    safety_update, quiz_update = await asyncio.gather(
+        asafety_node(state),
+        aquiz_form_node(state),
+    )
+    return _join(safety_update, quiz_update)
+
+
+# ---------- Graph join node ----------
+
+def speculative_gate_node(state: HabitState) -> Dict[str, Any]:
+    """
+    Join point after the parallel `safety` and `quiz_form` branches.
+
+    Drops the speculative quiz on a block and records the routing decision
+    in `state.next` for the conditional edge that follows.
+    """
+    SPECULATIVE_QUIZ_CALLS.inc()
+    if state.safety is not None and state.safety.action == "block_and_escalate":
+        SPECULATIVE_QUIZ_WASTED.inc()
+        return {"quiz_form": None, "next": END}
+    return {"next": "quiz_summary"}
+
+
+def route_after_gate(state: HabitState) -> str:
+    return state.next or END
+
+
+def speculative_stats() -> Dict[str, float]:
+    calls = SPECULATIVE_QUIZ_CALLS.total()
+    wasted = SPECULATIVE_QUIZ_WASTED.total()
+    return {
+        "speculative_calls": calls,
+        "wasted_calls": wasted,
+        "waste_rate": (wasted / calls) if calls else 0.0,
+    }
@@ -0,0 +1,69 @@
+# tests/conftest.py
+import json
+import os
+import sys
+from typing import Any, Callable, Dict, List, Union
+
+import httpx
+import pytest
+
+# Modules are flat at the repo root; llm_clients wants a key even when every
+# call goes to a fake transport.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import llm_clients  # noqa: E402
+
+Reply = Union[str, int, Exception, Callable[[Dict[str, Any]], httpx.Response]]
+
+
+def completion(body: Dict[str, Any], content: str) -> httpx.Response:
+    return httpx.Response(200, json={
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": 0,
+        "model": body.get("model", "test"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+    })
+
+
+class MockLLM:
+    """
+    Chat completions over httpx.MockTransport. Each request takes the next
+    reply: a str is the message content, an int an error status, an
+    exception is raised, a callable builds the response. The last reply repeats.
+    """
+
+    def __init__(self, replies: List[Reply]):
+        self.replies = list(replies)
+        self.requests: List[Dict[str, Any]] = []
+        self.transport = httpx.MockTransport(self._handle)
+
+    def _handle(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        self.requests.append(body)
+        reply = self.replies.pop(0) if len(self.replies) > 1 else self.replies[0]
+        if isinstance(reply, Exception):
+            raise reply
+        if isinstance(reply, int):
+            return httpx.Response(reply, json={"error": {"message": f"status {reply}", "type": "test"}})
+        if callable(reply):
+            return reply(body)
+        return completion(body, reply)
+
+
+@pytest.fixture
+def mock_llm():
+    """
+    `mock_llm(replies)` routes every model from llm_clients through a MockLLM.
+    """
+    previous = llm_clients.get_registry()
+
+    def install(replies: List[Reply]) -> MockLLM:
+        mock = MockLLM(replies)
+        llm_clients.set_registry(llm_clients.ClientRegistry(transport=mock.transport, async_transport=mock.transport))
+        return mock
+
+    yield install
+    llm_clients.set_registry(previous)
@@ -0,0 +1,95 @@
+# tests/test_api_server.py
+import pytest
+from fastapi.testclient import TestClient
+
+import api_server
+import llm_clients
+import quiz_cache
+import response_cache
+from benchmarks.fake_llm import CANNED_PLAN21, install_fake_llm
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(response_cache, "_cache", None)
+    monkeypatch.setattr(quiz_cache, "_cache", None)
+    monkeypatch.setattr(api_server, "CHECKPOINT_DB", str(tmp_path / "checkpoints.sqlite"))
+    monkeypatch.setenv("UNHABIT_SESSION_STORE", f"sqlite:///{tmp_path / 'sessions.sqlite'}")
+    previous = llm_clients.get_registry()
+    install_fake_llm()
+    with TestClient(api_server.app) as test_client:
+        yield test_client
+    llm_clients.set_registry(previous)
+
+
+def _start(client, description="I use zyn all day"):
+    response = client.post("/v1/onboarding/start", json={"habit_description": description})
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_onboarding_then_coach(client):
+    started = _start(client)
+    assert started["awaiting_answers"] and not started["blocked"]
+    assert started["quiz_form"]["questions"]
+    user_id = started["user_id"]
+
+    answered = client.post(f"/v1/onboarding/{user_id}/answers", json={"answers": {"q1": "ten a day"}}).json()
+    assert answered["plan21"]["day_tasks"] == CANNED_PLAN21["day_tasks"]
+    assert answered["coach_reply"]
+
+    turn = client.post(f"/v1/coach/{user_id}", json={"message": "I slipped last night"}).json()
+    assert turn["coach_reply"]
+    with client.stream("POST", f"/v1/coach/{user_id}/stream", json={"message": "what is day 3?"}) as stream:
+        streamed = "".join(stream.iter_text())
+    assert streamed
+
+    session = client.get(f"/v1/sessions/{user_id}").json()
+    assert [m["content"] for m in session["chat_history"] if m["role"] == "user"][-2:] == [
+        "I slipped last night", "what is day 3?",
+    ]
+    assert session["chat_history"][-1]["content"] == streamed.strip()
+
+
+def test_blocked_onboarding_has_no_quiz_and_refuses_answers(client):
+    started = _start(client, "I want to kill myself")
+    assert started["blocked"] and started["quiz_form"] is None and not started["awaiting_answers"]
+    response = client.post(f"/v1/onboarding/{started['user_id']}/answers", json={"answers": {"q1": "x"}})
+    assert response.status_code == 409
+
+
+def test_unknown_sessions_are_404(client):
+    assert client.post("/v1/coach/nobody", json={"message": "hi"}).status_code == 404
+    assert client.post("/v1/coach/nobody/stream", json={"message": "hi"}).status_code == 404
+    assert client.post("/v1/onboarding/nobody/answers", json={"answers": "{}"}).status_code == 404
+    assert client.get("/v1/sessions/nobody").status_code == 404
+
+
+def test_health_and_metrics(client):
+    assert client.get("/healthz").json() == {"status": "ok"}
+    assert "status" in client.get("/v1/health").json()
+    assert client.get("/metrics").status_code == 200
+
+
+def test_summary_fold_is_saved_with_the_session(client):
+    user_id = _start(client)["user_id"]
+    client.post(f"/v1/onboarding/{user_id}/answers", json={"answers": {"q1": "ten a day"}})
+    for i in range(10):
+        assert client.post(f"/v1/coach/{user_id}", json={"message": f"turn {i}"}).status_code == 200
+    session = client.get(f"/v1/sessions/{user_id}").json()
+    assert session["chat_summary"] and session["chat_summary_upto"] > 0
+
+    upto = session["chat_summary_upto"]
+    for i in range(4):
+        with client.stream("POST", f"/v1/coach/{user_id}/stream", json={"message": f"more {i}"}) as stream:
+            stream.read()
+    assert client.get(f"/v1/sessions/{user_id}").json()["chat_summary_upto"] > upto
+
+
+@pytest.mark.parametrize("message", ["", "   ", "\n\t "])
+def test_blank_messages_are_rejected(client, message):
+    user_id = _start(client)["user_id"]
+    assert client.post(f"/v1/coach/{user_id}", json={"message": message}).status_code == 422
+    assert client.post(f"/v1/coach/{user_id}/stream", json={"message": message}).status_code == 422
+    assert client.post("/v1/onboarding/start", json={"habit_description": message}).status_code == 422
+    assert not client.get(f"/v1/sessions/{user_id}").json()["chat_history"]
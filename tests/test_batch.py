@@ -0,0 +1,124 @@
+# tests/test_batch.py
+import asyncio
+import json
+import time
+
+import httpx
+import openai
+import pytest
+from langchain_core.messages import AIMessage
+
+import ai_nodes
+import batch_runner
+import llm_clients
+import quiz_cache
+import response_cache
+from benchmarks.fake_llm import CANNED_PLAN21, CANNED_QUIZ_FORM, CANNED_QUIZ_SUMMARY, install_fake_llm
+from schemas import HabitState, QuizForm, QuizSummary
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    monkeypatch.setattr(response_cache, "_cache", None)
+    monkeypatch.setattr(quiz_cache, "_cache", None)
+    previous = llm_clients.get_registry()
+    yield install_fake_llm()
+    llm_clients.set_registry(previous)
+
+
+def _write_items(path, descriptions):
+    path.write_text("".join(json.dumps({"id": i, "habit_description": d}) + "\n" for i, d in enumerate(descriptions)))
+
+
+def _lines(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def _states(n):
+    return [
+        HabitState(habit_description=f"zyn {i}", quiz_summary=QuizSummary(**dict(CANNED_QUIZ_SUMMARY, peak_times=f"{i}pm")))
+        for i in range(n)
+    ]
+
+
+def test_abatch_plan21_falls_back_on_errors_and_repairs_parse_failures_concurrently(monkeypatch):
+    monkeypatch.setattr(ai_nodes, "PLAN21_MODE", "llm")
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    outputs = [
+        openai.APITimeoutError(request),
+        AIMessage(content="not json"),
+        AIMessage(content="still not json"),
+        AIMessage(content=json.dumps(CANNED_PLAN21)),
+    ]
+
+    async def fake_batch(llm, prompts, max_concurrency, node):
+        return outputs
+
+    repaired = []
+
+    async def fake_repair(prompt, max_tokens=800, temperature=0.5, node="json"):
+        repaired.append(max_tokens)
+        await asyncio.sleep(0.2)
+        return CANNED_PLAN21
+
+    monkeypatch.setattr(ai_nodes, "_abatch_llm", fake_batch)
+    monkeypatch.setattr(ai_nodes, "_allm_json", fake_repair)
+
+    started = time.monotonic()
+    results = asyncio.run(ai_nodes.abatch_plan21(_states(4)))
+    elapsed = time.monotonic() - started
+
+    assert repaired == [1600, 1600]
+    assert elapsed < 0.35  # both repairs ran at once
+    assert results[0]["plan21"].day_tasks == ai_nodes._fallback_plan21(_states(1)[0].quiz_summary).day_tasks
+    for result in results[1:]:
+        assert result["plan21"].plan_summary == CANNED_PLAN21["plan_summary"]
+
+
+def test_run_batch_keeps_its_async_pool_off_the_shared_registry(tmp_path, fake_llm):
+    source = tmp_path / "in.jsonl"
+    _write_items(source, [f"tiktok {i}" for i in range(3)])
+    # Two runs, two event loops: the second must not inherit the first loop's pool.
+    for n in range(2):
+        stats = batch_runner.run_batch(str(source), str(tmp_path / f"out{n}.jsonl"), log=None)
+        assert stats["processed"] == 3
+    assert fake_llm.stats()["calls"]["quiz_form"] == 6
+    assert llm_clients.get_registry()._http_async_client is None
+
+
+def test_run_batch_resumes_after_a_torn_write(tmp_path, fake_llm):
+    source, output = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    _write_items(source, [f"I scroll tiktok {i} hours a day" for i in range(5)])
+    batch_runner.run_batch(str(source), str(output), chunk_size=2, log=None)
+
+    # Killed mid-write: two complete results and half of a third.
+    text = output.read_text().splitlines(keepends=True)
+    output.write_text("".join(text[:2]) + text[2][: len(text[2]) // 2])
+    assert batch_runner.completed_ids(str(output)) == {"0", "1"}
+
+    stats = batch_runner.run_batch(str(source), str(output), chunk_size=2, log=None)
+    assert stats == dict(stats, skipped=2, processed=3)
+    results = _lines(output)
+    assert sorted(r["id"] for r in results) == [0, 1, 2, 3, 4]
+    assert all(r["quiz_form"] for r in results)
+
+    assert batch_runner.run_batch(str(source), str(output), log=None)["processed"] == 0
+
+
+def test_run_batch_plans_skip_blocked_items(tmp_path, fake_llm):
+    source, output = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    _write_items(source, ["I use zyn all day", "I want to kill myself"])
+    batch_runner.run_batch(str(source), str(output), plans=True, log=None)
+
+    allowed, blocked = sorted(_lines(output), key=lambda r: r["id"])
+    assert allowed["plan21"]["day_tasks"]["day_21"]
+    assert json.loads(allowed["user_quiz_answers"])["answers"]
+    assert blocked["safety"]["action"] == "block_and_escalate"
+    assert blocked["quiz_form"] is None and blocked["plan21"] is None
+
+
+def test_synthetic_answers_cover_every_question():
+    quiz = QuizForm(**CANNED_QUIZ_FORM)
+    answers = json.loads(batch_runner.synthetic_answers(quiz))["answers"]
+    assert set(answers) == {q.id for q in quiz.questions}
+    assert answers["q3"] == "At my desk and in bed before sleeping."
@@ -0,0 +1,26 @@
+# tests/test_habit_canonicalizer.py
+import pytest
+
+from habit_canonicalizer import canonicalize, local_canonical
+
+
+@pytest.mark.parametrize("text", [
+    "cant quit sports ebtting lol",
+    "addicted to late niht vating",
+    "soking every night before bed",
+])
+def test_lone_fuzzy_match_is_low_and_not_used_locally(text):
+    result = canonicalize(text)
+    assert result is None or result["confidence"] == "low"
+    assert local_canonical(text) is None
+
+
+def test_exact_match_is_high():
+    result = canonicalize("I vape all day")
+    assert result["habit_category"] == "nicotine_vaping"
+    assert result["confidence"] == "high"
+
+
+def test_fuzzy_majority_without_exact_support_is_low():
+    result = canonicalize("vaping and smokng ciggies")
+    assert result["confidence"] == "low"
@@ -0,0 +1,71 @@
+# tests/test_llm_clients.py
+import asyncio
+import json
+
+import pytest
+from langchain_core.messages import HumanMessage, SystemMessage
+
+import ai_nodes
+import retry_policy
+from llm_clients import get_chat_model, get_registry
+from rate_limiter import COMPLETION_ESTIMATE
+
+PROMPT = [SystemMessage(content="Return JSON."), HumanMessage(content="plan please")]
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(retry_policy.random, "uniform", lambda low, high: 0.0)
+
+
+def _max_tokens(body):
+    return body.get("max_completion_tokens", body.get("max_tokens"))
+
+
+def test_models_are_pooled(mock_llm):
+    mock_llm(["hi"])
+    a = get_chat_model("gpt-4o-mini", 0.3)
+    assert get_chat_model("gpt-4o-mini", 0.3) is a
+    b = get_chat_model("gpt-4o-mini", 0.3, response_format={"type": "json_object"})
+    assert b is not a
+    assert b.http_client is a.http_client and b.http_async_client is a.http_async_client
+    stats = get_registry().stats()
+    assert stats["hits"] == 1 and stats["misses"] == 2
+
+
+def test_llm_json_caps_completion_tokens(mock_llm):
+    mock = mock_llm(['{"ok": 1}'])
+    assert ai_nodes._llm_json(PROMPT, max_tokens=1600, node="plan21") == {"ok": 1}
+    assert _max_tokens(mock.requests[0]) == 1600
+    assert mock.requests[0]["response_format"] == {"type": "json_object"}
+
+
+def test_rate_limiter_estimate_uses_the_bound_cap(mock_llm):
+    mock_llm(["hi"])
+    llm = get_chat_model("gpt-4o-mini", 0.3)
+    assert llm._estimate(PROMPT, 1600) - llm._estimate(PROMPT) == 1600 - COMPLETION_ESTIMATE
+
+
+def test_llm_json_repairs_after_a_parse_error(mock_llm):
+    mock = mock_llm(["Sure! Here is your plan: {", json.dumps({"ok": 2})])
+    assert ai_nodes._llm_json(PROMPT, max_tokens=800, temperature=0.35, node="plan21") == {"ok": 2}
+
+    first, second = mock.requests
+    assert "Return STRICT JSON" not in first["messages"][-1]["content"]
+    assert "Return STRICT JSON" in second["messages"][-1]["content"]
+    assert second["temperature"] == pytest.approx(first["temperature"] + 0.2)
+    # The cached system prefix is untouched.
+    assert second["messages"][0] == first["messages"][0]
+    assert _max_tokens(second) == 800
+
+
+def test_allm_json_repairs_after_a_parse_error(mock_llm):
+    mock = mock_llm(["not json", json.dumps({"ok": 3})])
+    assert asyncio.run(ai_nodes._allm_json(PROMPT, max_tokens=1600, node="plan21")) == {"ok": 3}
+    assert len(mock.requests) == 2 and _max_tokens(mock.requests[1]) == 1600
+
+
+def test_llm_json_gives_up_with_an_empty_dict(mock_llm):
+    mock = mock_llm(["never json"])
+    assert ai_nodes._llm_json(PROMPT, node="plan21") == {}
+    assert len(mock.requests) == retry_policy.policy_for("plan21").max_attempts
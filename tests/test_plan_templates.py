@@ -0,0 +1,46 @@
+# tests/test_plan_templates.py
+import ai_nodes
+import health
+from benchmarks.fake_llm import CANNED_QUIZ_SUMMARY
+from plan_templates import MISSING_VALUES, template_plan21
+from schemas import HabitState, QuizSummary
+
+
+def _text(plan):
+    return " ".join([plan.plan_summary, *plan.day_tasks.values()])
+
+
+def test_fallback_summary_placeholders_never_reach_the_plan():
+    plan = ai_nodes._fallback_plan21(ai_nodes._quiz_summary_fallback("I use zyn all day"))
+    text = _text(plan)
+    assert "I use zyn all day" not in text
+    assert "nicotine pouches (Zyn)" in text
+    for placeholder in MISSING_VALUES:
+        assert f" {placeholder}" not in text and f"({placeholder})" not in text
+
+
+def test_unrecognized_description_reads_as_your_habit():
+    summary = ai_nodes._quiz_summary_fallback("I bite my nails in meetings")
+    assert summary.habit_category == "other"
+    text = _text(template_plan21(summary))
+    assert "your habit" in text
+    assert "bite my nails in meetings" not in text
+
+
+def test_real_summary_values_are_kept():
+    text = _text(template_plan21(QuizSummary(**CANNED_QUIZ_SUMMARY)))
+    assert "stress at work" in text and "mid-morning and late evening" in text
+
+
+def test_template_runs_do_not_count_towards_plan21_health(monkeypatch):
+    monkeypatch.setattr(health, "HEALTH", health.HealthWindow())
+    monkeypatch.setattr(ai_nodes, "PLAN21_MODE", "template")
+    state = HabitState(habit_description="zyn", quiz_summary=QuizSummary(**CANNED_QUIZ_SUMMARY))
+    for _ in range(health.HEALTH_MIN_RUNS):
+        ai_nodes.plan21_node(state)
+        health.record_run("plan21", True, "timeout")
+
+    summary = health.health_summary()
+    assert summary["local_runs"]["plan21"] == health.HEALTH_MIN_RUNS
+    assert summary["nodes"]["plan21"]["fallback_rate"] == 1.0
+    assert health.node_status("plan21") == health.CRITICAL
@@ -0,0 +1,140 @@
+# tests/test_retry_policy.py
+import asyncio
+import json
+import time
+
+import httpx
+import openai
+import pytest
+from langchain_core.exceptions import OutputParserException
+from langchain_core.messages import HumanMessage
+
+import deadlines
+import retry_policy
+from deadlines import deadline_for
+from llm_clients import get_chat_model
+from rate_limiter import ModelLimiter, ModelLimits, RateLimitExceeded
+from retry_policy import (
+    CONNECTION,
+    FATAL,
+    PARSE,
+    RATE_LIMIT,
+    SERVER,
+    TIMEOUT,
+    RetryPolicy,
+    acall_with_retry,
+    call_with_retry,
+    classify,
+    policy_for,
+)
+
+REQUEST = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+
+def _status_error(cls, status):
+    return cls(f"status {status}", response=httpx.Response(status, request=REQUEST), body=None)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(retry_policy.random, "uniform", lambda low, high: 0.0)
+
+
+@pytest.mark.parametrize("exc, kind", [
+    (openai.APITimeoutError(REQUEST), TIMEOUT),
+    (httpx.ReadTimeout("slow"), TIMEOUT),
+    (asyncio.TimeoutError(), TIMEOUT),
+    (_status_error(openai.RateLimitError, 429), RATE_LIMIT),
+    (RateLimitExceeded("queue full"), RATE_LIMIT),
+    (openai.APIConnectionError(request=REQUEST), CONNECTION),
+    (httpx.ConnectError("refused"), CONNECTION),
+    (_status_error(openai.InternalServerError, 500), SERVER),
+    (_status_error(openai.APIStatusError, 503), SERVER),
+    (json.JSONDecodeError("bad", "x", 0), PARSE),
+    (OutputParserException("bad"), PARSE),
+    (_status_error(openai.BadRequestError, 400), FATAL),
+    (_status_error(openai.AuthenticationError, 401), FATAL),
+    (ValueError("bug"), FATAL),
+])
+def test_classify(exc, kind):
+    assert classify(exc) == kind
+
+
+def test_next_delay_respects_attempts_budget_and_kind():
+    policy = RetryPolicy(max_attempts=3, base_delay=0.5, max_delay=8, budget=10)
+    started = retry_policy.time.monotonic()
+    assert policy.next_delay(SERVER, 1, started) == 0.0
+    assert policy.next_delay(RATE_LIMIT, 1, started) == 1.0  # at least two base delays
+    assert policy.next_delay(SERVER, 3, started) is None
+    assert policy.next_delay(FATAL, 1, started) is None
+    assert policy.next_delay(SERVER, 1, started - 10) is None
+
+
+def test_budgets_never_exceed_deadlines():
+    for node in retry_policy.NODE_POLICIES:
+        assert policy_for(node).budget <= deadline_for(node)
+
+
+def _invoke(attempt):
+    llm = get_chat_model("gpt-4o-mini", 0.3)
+    return llm.invoke([HumanMessage(content="hi")], timeout=attempt.timeout).content
+
+
+def test_transient_errors_are_retried_over_http(mock_llm):
+    mock = mock_llm([429, 500, "done"])
+    assert call_with_retry("quiz_form", _invoke) == "done"
+    assert len(mock.requests) == 3
+
+
+def test_fatal_errors_are_not_retried(mock_llm):
+    mock = mock_llm([400, "never reached"])
+    with pytest.raises(openai.BadRequestError):
+        call_with_retry("quiz_form", _invoke)
+    assert len(mock.requests) == 1
+
+
+def test_retries_stop_at_max_attempts(mock_llm):
+    mock = mock_llm([503])
+    with pytest.raises(openai.InternalServerError):
+        call_with_retry("coach", _invoke)
+    assert len(mock.requests) == policy_for("coach").max_attempts
+
+
+def test_async_retry_passes_the_last_error_to_the_next_attempt(mock_llm):
+    mock_llm(["unused"])
+    seen = []
+
+    async def call(attempt):
+        seen.append((attempt.number, attempt.last_error, attempt.timeout is not None))
+        if attempt.number == 1:
+            raise json.JSONDecodeError("bad", "x", 0)
+        return "ok"
+
+    assert asyncio.run(acall_with_retry("quiz_form", call)) == "ok"
+    assert seen == [(1, None, True), (2, PARSE, True)]
+
+
+def test_hedge_gets_the_time_left_before_the_deadline(monkeypatch):
+    monkeypatch.setattr(deadlines, "hedge_delay", lambda node: 0.05)
+    timeouts = []
+
+    def call(timeout):
+        timeouts.append(timeout)
+        if len(timeouts) == 1:
+            time.sleep(0.3)
+        return "ok"
+
+    deadline = time.monotonic() + 1.0
+    assert deadlines.hedged("plan21", call, deadline) == "ok"
+    first, hedge = timeouts
+    assert first <= 1.0
+    assert hedge <= first - 0.05
+
+
+def test_queue_wait_is_capped_by_the_call_timeout():
+    limiter = ModelLimiter("m", ModelLimits(rpm=1), timeout=60)
+    limiter.acquire(1)
+    started = time.monotonic()
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire(1, timeout=0.2)
+    assert time.monotonic() - started < 1
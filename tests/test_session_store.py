@@ -0,0 +1,99 @@
+# tests/test_session_store.py
+import pytest
+
+from session_store import FileSessionStore, MemoryRedis, RedisSessionStore, SQLiteSessionStore
+from schemas import HabitState
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(params=["sqlite", "file", "redis"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    if request.param == "file":
+        return FileSessionStore(str(tmp_path / "sessions"))
+    return RedisSessionStore(MemoryRedis())
+
+
+def _turns(n, tag="m"):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"{tag}{i}"} for i in range(n)]
+
+
+def _state(history, **extra):
+    return HabitState(user_id="u1", habit_description="zyn", chat_history=history, **extra)
+
+
+def test_round_trip(store):
+    store.save(_state(_turns(4), last_user_message="hi"))
+    loaded = store.load("u1")
+    assert loaded.chat_history == _turns(4)
+    assert loaded.last_user_message == "hi"
+    assert store.load("nobody") is None
+
+
+def test_new_turns_are_appended(store, monkeypatch):
+    store.save(_state(_turns(4)))
+    appended = []
+    original = store.append_messages
+    monkeypatch.setattr(store, "append_messages", lambda user_id, messages: appended.append(messages) or original(user_id, messages))
+    monkeypatch.setattr(store, "clear_messages", lambda user_id: pytest.fail("log rewritten on a plain append"))
+
+    store.save(_state(_turns(6)))
+    assert appended == [_turns(6)[4:]]
+    assert store.load("u1").chat_history == _turns(6)
+
+
+@pytest.mark.parametrize("history", [
+    [],                                   # reset
+    _turns(2),                            # trimmed
+    _turns(4, tag="edited"),              # rewritten, same length
+    _turns(2) + _turns(4, tag="x")[2:],   # tail rewritten
+])
+def test_rewritten_history_rewrites_the_log(store, history):
+    store.save(_state(_turns(4)))
+    store.save(_state(history))
+    assert store.load("u1").chat_history == history
+
+
+def test_save_torn_before_snapshot_is_repaired(store):
+    store.save(_state(_turns(2)))
+    # Crash between appending and rewriting the snapshot: the log has messages
+    # the stored digest doesn't cover.
+    store.append_messages("u1", _turns(4, tag="lost")[2:])
+    store.save(_state(_turns(4)))
+    assert store.load("u1").chat_history == _turns(4)
+
+
+def test_delete(store):
+    store.save(_state(_turns(2)))
+    store.delete("u1")
+    assert store.load("u1") is None
+    assert store.message_count("u1") == 0
+
+
+def test_redis_keys_expire_together_and_saves_renew_them():
+    clock = Clock()
+    client = MemoryRedis(clock=clock)
+    store = RedisSessionStore(client, ttl_seconds=60)
+    state_key, messages_key = store._state_key("u1"), store._messages_key("u1")
+
+    store.save(_state(_turns(2)))
+    assert client.ttl(state_key) == 60 and client.ttl(messages_key) == 60
+
+    clock.now += 50
+    store.save(_state(_turns(4)))
+    assert client.ttl(state_key) == 60 and client.ttl(messages_key) == 60
+
+    clock.now += 59
+    assert store.load("u1").chat_history == _turns(4)
+
+    clock.now += 1
+    assert store.load("u1") is None
+    assert client.llen(messages_key) == 0
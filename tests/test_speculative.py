@@ -0,0 +1,23 @@
+# tests/test_speculative.py
+import speculative
+from rate_limiter import current_priority, llm_priority
+from schemas import HabitState
+
+
+def test_worker_threads_keep_the_callers_context(monkeypatch):
+    seen = {}
+
+    def safety(state):
+        seen["safety"] = current_priority()
+        return {"safety": None}
+
+    def quiz(state):
+        seen["quiz"] = current_priority()
+        return {"quiz_form": "quiz"}
+
+    monkeypatch.setattr(speculative, "safety_node", safety)
+    monkeypatch.setattr(speculative, "quiz_form_node", quiz)
+    with llm_priority("batch"):
+        _, quiz_update = speculative.run_safety_and_quiz(HabitState(habit_description="I vape"))
+    assert seen == {"safety": "batch", "quiz": "batch"}
+    assert quiz_update == {"quiz_form": "quiz"}